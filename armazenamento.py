@@ -0,0 +1,346 @@
+import datetime
+import os
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+import gspread
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+from gspread.utils import absolute_range_name, rowcol_to_a1
+from gspread_dataframe import set_with_dataframe
+from cliente_sheets import ClienteSheets
+
+
+ABA_AGENDA = "Respostas ao formulário 1"
+ABA_MATERIAIS = "Materiais"
+ABA_FICHA = "Ficha Técnica"
+# Livro de movimentações de estoque: só recebe linhas anexadas (baixas, reposições e ajustes)
+ABA_MOVIMENTACOES = "Movimentações de Estoque"
+COLUNAS_MOVIMENTACOES = ["Data", "Tipo", "Material", "Quantidade", "Atendimento", "Observação"]
+# Abas criadas pelo próprio sistema quando ainda não existem, com o seu cabeçalho
+ABAS_DO_SISTEMA = {ABA_MOVIMENTACOES: COLUNAS_MOVIMENTACOES}
+ABAS = [ABA_AGENDA, ABA_MATERIAIS, ABA_FICHA, ABA_MOVIMENTACOES]
+ESCOPOS_GOOGLE = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+# Os DataFrames lidos são indexados pelo número da linha na planilha (a linha 1 é o cabeçalho)
+LINHA_INICIAL_DADOS = 2
+
+
+def completar_linha(linha, tamanho):
+    """A API omite as células vazias no fim de cada linha; completa a linha até `tamanho` colunas."""
+    return list(linha[:tamanho]) + [""] * (tamanho - len(linha))
+
+
+def dataframe_de_valores(valores, primeira_linha=LINHA_INICIAL_DADOS):
+    """Converte uma lista de linhas (cabeçalho + dados) em DataFrame, inferindo tipos como o gspread_dataframe."""
+    if not valores or not any(valores):
+        return pd.DataFrame()
+    largura = max(len(linha) for linha in valores)
+    df = TextParser([completar_linha(linha, largura) for linha in valores], header=0).read()
+    df.index = pd.RangeIndex(primeira_linha, primeira_linha + len(df))
+    # Assim como o get_as_dataframe, descarta colunas sem cabeçalho e sem nenhum valor
+    sem_nome = [col for col in df.columns if str(col).startswith("Unnamed:") and df[col].isna().all()]
+    return df.drop(columns=sem_nome)
+
+
+def texto_celula(valor):
+    """Converte um valor do DataFrame no texto gravado na célula (vazio para nulos, SIM/NÃO para booleanos e datas
+    como na planilha, dd/mm/aaaa, com a hora só quando houver)."""
+    if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+        return ""
+    if pd.api.types.is_bool(valor):
+        return "SIM" if valor else "NÃO"
+    if isinstance(valor, np.datetime64): valor = pd.Timestamp(valor)
+    if isinstance(valor, datetime.datetime):
+        return valor.strftime('%d/%m/%Y' if valor.time() == datetime.time() else '%d/%m/%Y %H:%M:%S')
+    if isinstance(valor, datetime.date):
+        return valor.strftime('%d/%m/%Y')
+    texto = str(valor)
+    return "" if texto in ('nan', 'NaT', '<NA>', 'None') else texto
+
+
+def _agrupar_linhas_consecutivas(linhas):
+    """Agrupa números de linha em intervalos [inicio, fim] consecutivos, do maior para o menor."""
+    intervalos = []
+    for linha in sorted(set(linhas), reverse=True):
+        if intervalos and intervalos[-1][0] == linha + 1:
+            intervalos[-1][0] = linha
+        else:
+            intervalos.append([linha, linha])
+    return intervalos
+
+
+class Armazenamento:
+    """Interface comum dos backends: cada aba da planilha é lida e salva como um DataFrame."""
+
+    identificador = ""
+
+    def ler_intervalos(self, pedidos):
+        """Lê várias abas numa única ida ao armazenamento. Cada pedido é (nome_aba, primeira_linha, num_colunas) e
+        retorna os valores crus [cabeçalho, *linhas] a partir da linha de dados `primeira_linha` (0 = logo após o
+        cabeçalho); `num_colunas` limita a leitura parcial às colunas já conhecidas (None lê a aba inteira)."""
+        raise NotImplementedError
+
+    def salvar_aba(self, nome_aba, df):
+        raise NotImplementedError
+
+    def revisao(self):
+        """Marcador barato da versão dos dados (ex.: data de modificação); muda sempre que alguma aba é alterada."""
+        raise NotImplementedError
+
+    def garantir_aba(self, nome_aba, colunas):
+        """Cria a aba com o cabeçalho `colunas` se ela ainda não existir."""
+        raise NotImplementedError
+
+    def existe_aba(self, nome_aba):
+        """Indica se a aba existe, sem criá-la (para leitores que não devem alterar a planilha)."""
+        raise NotImplementedError
+
+    def ler_linhas(self, nome_aba, primeira_linha=0, num_colunas=None):
+        return self.ler_intervalos([(nome_aba, primeira_linha, num_colunas)])[0]
+
+    def ler_linhas_avulsas(self, nome_aba, linhas):
+        """Valores crus [cabeçalho, *linhas] só das linhas pedidas (números da planilha), na ordem pedida; uma linha que
+        não existe volta vazia. Esta versão lê a aba inteira: os backends a sobrescrevem para ler só as linhas."""
+        valores = self.ler_linhas(nome_aba)
+        return valores[:1] + [valores[int(linha) - 1] if 0 < int(linha) - 1 < len(valores) else [] for linha in linhas]
+
+    def ler_aba(self, nome_aba):
+        return dataframe_de_valores(self.ler_linhas(nome_aba))
+
+    def aplicar_alteracoes(self, nome_aba, celulas=None, linhas_novas=None, linhas_removidas=None):
+        """Grava só o que mudou: `celulas` é {linha: {coluna: valor}}, `linhas_novas` uma lista de {coluna: valor}
+        anexada ao fim e `linhas_removidas` a lista de linhas a apagar. As linhas usam a numeração da planilha
+        antes da gravação: primeiro as células são atualizadas, depois as linhas removidas e por fim as novas anexadas."""
+        raise NotImplementedError
+
+    def ler_abas(self, nomes_abas):
+        return [dataframe_de_valores(valores) for valores in self.ler_intervalos([(nome_aba, 0, None) for nome_aba in nomes_abas])]
+
+
+class ArmazenamentoGSheets(Armazenamento):
+    """Backend sobre a Planilha Google (comportamento original do dashboard).
+
+    Todas as chamadas passam por um ClienteSheets (limite de requisições, agrupamento de leituras idênticas e
+    novas tentativas); passe o mesmo ClienteSheets a todos os backends do processo para que dividam a cota.
+    """
+
+    def __init__(self, client, nome_planilha):
+        self.cliente = client if isinstance(client, ClienteSheets) else ClienteSheets(client)
+        self.client = self.cliente.client
+        self.nome_planilha = nome_planilha
+        self.identificador = f"gsheets:{nome_planilha}"
+
+    def _planilha(self):
+        return self.cliente.planilha(self.nome_planilha)
+
+    def _worksheet(self, nome_aba):
+        # Relido a cada gravação: o tamanho da aba (col_count) precisa estar atualizado
+        return self.cliente.executar(('worksheet', self.nome_planilha, nome_aba), lambda: self._planilha().worksheet(nome_aba))
+
+    def salvar_aba(self, nome_aba, df):
+        worksheet = self._worksheet(nome_aba)
+        # set_with_dataframe redimensiona a aba e grava as células: duas requisições, ambas idempotentes
+        self.cliente.executar(None, lambda: set_with_dataframe(worksheet, df, include_index=False, resize=True), custo=2)
+
+    def revisao(self):
+        # Consulta só o modifiedTime no Drive, sem baixar nenhuma célula (cota do Drive, não a do Sheets)
+        id_planilha = self._planilha().id
+        return self.cliente.executar(('revisao', id_planilha), lambda: self.client.get_file_drive_metadata(id_planilha), api='drive')["modifiedTime"]
+
+    def garantir_aba(self, nome_aba, colunas):
+        planilha = self._planilha()
+        try:
+            self.cliente.executar(('worksheet', self.nome_planilha, nome_aba), lambda: planilha.worksheet(nome_aba))
+        except gspread.WorksheetNotFound:
+            self.cliente.executar(None, lambda: planilha.add_worksheet(nome_aba, rows=1000, cols=len(colunas)).update([colunas]), custo=2, repetir=False)
+
+    def existe_aba(self, nome_aba):
+        planilha = self._planilha()
+        return nome_aba in [aba.title for aba in self.cliente.executar(('abas', self.nome_planilha), planilha.worksheets)]
+
+    def ler_intervalos(self, pedidos):
+        # Um único values_batch_get: a aba inteira, ou o cabeçalho + as linhas a partir de `primeira_linha`
+        intervalos = []
+        for nome_aba, primeira_linha, num_colunas in pedidos:
+            if num_colunas is None:
+                intervalos.append(absolute_range_name(nome_aba))
+            else:
+                ultima_coluna = rowcol_to_a1(1, max(num_colunas, 1))[:-1]
+                intervalos += [absolute_range_name(nome_aba, "1:1"), absolute_range_name(nome_aba, f"A{primeira_linha + LINHA_INICIAL_DADOS}:{ultima_coluna}")]
+        planilha = self._planilha()
+        resposta = self.cliente.executar(('ler', self.nome_planilha, tuple(intervalos)), lambda: planilha.values_batch_get(
+            intervalos, params={"valueRenderOption": "UNFORMATTED_VALUE", "dateTimeRenderOption": "FORMATTED_STRING"}))
+        blocos = iter([intervalo.get("values", []) for intervalo in resposta.get("valueRanges", [])])
+        resultados = []
+        for nome_aba, primeira_linha, num_colunas in pedidos:
+            if num_colunas is None:
+                valores = next(blocos)
+                resultados.append(valores[:1] + valores[1 + primeira_linha:] if valores else [[]])
+            else:
+                cabecalho, linhas = next(blocos), next(blocos)
+                resultados.append([cabecalho[0] if cabecalho else []] + linhas)
+        return resultados
+
+    def ler_linhas_avulsas(self, nome_aba, linhas):
+        # Um único values_batch_get com o cabeçalho e cada linha pedida
+        intervalos = [absolute_range_name(nome_aba, f"{linha}:{linha}") for linha in [1] + [int(linha) for linha in linhas]]
+        planilha = self._planilha()
+        resposta = self.cliente.executar(('ler', self.nome_planilha, tuple(intervalos)), lambda: planilha.values_batch_get(
+            intervalos, params={"valueRenderOption": "UNFORMATTED_VALUE", "dateTimeRenderOption": "FORMATTED_STRING"}))
+        return [(intervalo.get("values") or [[]])[0] for intervalo in resposta.get("valueRanges", [])]
+
+    def aplicar_alteracoes(self, nome_aba, celulas=None, linhas_novas=None, linhas_removidas=None):
+        celulas, linhas_novas, linhas_removidas = celulas or {}, linhas_novas or [], linhas_removidas or []
+        worksheet = self._worksheet(nome_aba)
+        planilha = worksheet.spreadsheet
+        cabecalho = [str(col).strip() for col in self.cliente.executar(('cabecalho', self.nome_planilha, nome_aba), lambda: worksheet.row_values(1))]
+        # Os valores são gravados como texto digitado (USER_ENTERED), como fazia o set_with_dataframe: datas,
+        # números e fórmulas são interpretados pela planilha. Gravações que não podem ser repetidas usam repetir=False.
+        entrada = {"valueInputOption": "USER_ENTERED"}
+        valores = []
+
+        # Colunas que ainda não existem na aba (ex.: 'ID do Atendimento') são criadas no fim do cabeçalho
+        colunas_alteradas = [col for mudancas in list(celulas.values()) + linhas_novas for col in mudancas]
+        colunas_novas = [col for col in dict.fromkeys(colunas_alteradas) if col not in cabecalho]
+        if colunas_novas:
+            faltando = len(cabecalho) + len(colunas_novas) - worksheet.col_count
+            if faltando > 0:
+                self.cliente.executar(None, lambda: planilha.batch_update({"requests": [
+                    {"appendDimension": {"sheetId": worksheet.id, "dimension": "COLUMNS", "length": faltando}}]}), repetir=False)
+            valores += [{"range": absolute_range_name(nome_aba, rowcol_to_a1(1, len(cabecalho) + i + 1)), "values": [[col]]} for i, col in enumerate(colunas_novas)]
+            cabecalho = cabecalho + colunas_novas
+
+        valores += [{"range": absolute_range_name(nome_aba, rowcol_to_a1(int(linha), cabecalho.index(col) + 1)), "values": [[texto_celula(valor)]]}
+                    for linha, mudancas in celulas.items() for col, valor in mudancas.items()]
+        if valores:
+            # Regravar as mesmas células é idempotente: pode ser repetido em falhas passageiras
+            self.cliente.executar(None, lambda: planilha.values_batch_update(dict(entrada, data=valores)))
+        if linhas_removidas:
+            requisicoes = [{"deleteDimension": {"range": {"sheetId": worksheet.id, "dimension": "ROWS", "startIndex": int(inicio) - 1, "endIndex": int(fim)}}}
+                           for inicio, fim in _agrupar_linhas_consecutivas(linhas_removidas)]
+            self.cliente.executar(None, lambda: planilha.batch_update({"requests": requisicoes}), repetir=False)
+        if linhas_novas:
+            # Sem novas tentativas em erros 5xx: a gravação pode ter sido aplicada e as linhas seriam anexadas duas vezes
+            linhas = [[texto_celula(linha.get(col)) for col in cabecalho] for linha in linhas_novas]
+            self.cliente.executar(None, lambda: planilha.values_append(absolute_range_name(nome_aba), dict(entrada, insertDataOption="INSERT_ROWS"),
+                                                                      {"values": linhas}), repetir=False)
+
+
+class ArmazenamentoSQLite(Armazenamento):
+    """Backend local: cada aba vira uma tabela SQLite com as células guardadas como texto, igual à planilha.
+    Com `somente_leitura` o banco precisa existir e é aberto sem permissão de escrita (nunca é criado)."""
+
+    def __init__(self, caminho, somente_leitura=False):
+        self.caminho = caminho
+        self.somente_leitura = somente_leitura
+        self.identificador = f"sqlite:{os.path.abspath(caminho)}"
+
+    @contextmanager
+    def _conectar(self):
+        if self.somente_leitura:
+            if not os.path.isfile(self.caminho):
+                raise FileNotFoundError(f"banco SQLite '{self.caminho}' não encontrado")
+            con = sqlite3.connect(f"{Path(self.caminho).resolve().as_uri()}?mode=ro", uri=True)
+        else:
+            con = sqlite3.connect(self.caminho)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def ler_intervalos(self, pedidos):
+        resultados = []
+        with self._conectar() as con:
+            for nome_aba, primeira_linha, _ in pedidos:
+                cursor = con.execute(f'SELECT * FROM "{nome_aba}" ORDER BY rowid LIMIT -1 OFFSET ?', (primeira_linha,))
+                cabecalho = [col[0] for col in cursor.description]
+                linhas = [["" if valor is None else str(valor) for valor in linha] for linha in cursor.fetchall()]
+                resultados.append([cabecalho] + linhas)
+        return resultados
+
+    def ler_linhas_avulsas(self, nome_aba, linhas):
+        with self._conectar() as con:
+            cursor = con.execute(f'SELECT * FROM "{nome_aba}" LIMIT 0')
+            valores = [[col[0] for col in cursor.description]]
+            for linha in linhas:
+                registro = con.execute(f'SELECT * FROM "{nome_aba}" ORDER BY rowid LIMIT 1 OFFSET ?', (int(linha) - LINHA_INICIAL_DADOS,)).fetchone()
+                valores.append(["" if valor is None else str(valor) for valor in registro] if registro else [])
+        return valores
+
+    def garantir_aba(self, nome_aba, colunas):
+        definicoes = ", ".join(f'"{col}" TEXT' for col in colunas)
+        with self._conectar() as con:
+            con.execute(f'CREATE TABLE IF NOT EXISTS "{nome_aba}" ({definicoes})')
+
+    def existe_aba(self, nome_aba):
+        with self._conectar() as con:
+            return con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (nome_aba,)).fetchone() is not None
+
+    def revisao(self):
+        return os.stat(self.caminho).st_mtime_ns if os.path.exists(self.caminho) else None
+
+    def salvar_aba(self, nome_aba, df):
+        df_texto = df.map(texto_celula)
+        with self._conectar() as con:
+            df_texto.to_sql(nome_aba, con, if_exists="replace", index=False, dtype={col: "TEXT" for col in df_texto.columns})
+
+    def aplicar_alteracoes(self, nome_aba, celulas=None, linhas_novas=None, linhas_removidas=None):
+        celulas, linhas_novas, linhas_removidas = celulas or {}, linhas_novas or [], linhas_removidas or []
+        with self._conectar() as con:
+            cabecalho = [col[1] for col in con.execute(f'PRAGMA table_info("{nome_aba}")')]
+            colunas_alteradas = [col for mudancas in list(celulas.values()) + linhas_novas for col in mudancas]
+            for col in dict.fromkeys(colunas_alteradas):
+                if col not in cabecalho:
+                    con.execute(f'ALTER TABLE "{nome_aba}" ADD COLUMN "{col}" TEXT')
+                    cabecalho.append(col)
+            # A linha N da "planilha" é a (N - 2)-ésima linha da tabela em ordem de rowid
+            rowids = [r[0] for r in con.execute(f'SELECT rowid FROM "{nome_aba}" ORDER BY rowid')]
+            for linha, mudancas in celulas.items():
+                for col, valor in mudancas.items():
+                    con.execute(f'UPDATE "{nome_aba}" SET "{col}" = ? WHERE rowid = ?', (texto_celula(valor), rowids[int(linha) - LINHA_INICIAL_DADOS]))
+            con.executemany(f'DELETE FROM "{nome_aba}" WHERE rowid = ?', [(rowids[int(linha) - LINHA_INICIAL_DADOS],) for linha in set(linhas_removidas)])
+            if linhas_novas:
+                colunas = ", ".join(f'"{col}"' for col in cabecalho)
+                marcadores = ", ".join("?" for _ in cabecalho)
+                con.executemany(f'INSERT INTO "{nome_aba}" ({colunas}) VALUES ({marcadores})',
+                                [[texto_celula(linha.get(col)) for col in cabecalho] for linha in linhas_novas])
+
+
+def criar_armazenamento(backend, client=None, nome_planilha=None, caminho=None, somente_leitura=False):
+    """Instancia o backend escolhido na configuração ('gsheets' ou 'sqlite')."""
+    if backend == "sqlite":
+        return ArmazenamentoSQLite(caminho, somente_leitura)
+    if backend == "gsheets":
+        return ArmazenamentoGSheets(client, nome_planilha)
+    raise ValueError(f"Backend de armazenamento desconhecido: '{backend}'")
+
+
+def separar_origem(origem):
+    """(backend, nome) de um identificador como o dos backends ('gsheets:<planilha>' ou 'sqlite:<arquivo>');
+    sem prefixo, `origem` é o nome de uma Planilha Google."""
+    backend, _, nome = origem.partition(":") if origem.startswith(("gsheets:", "sqlite:")) else ("gsheets", "", origem)
+    return backend, nome
+
+
+def abrir_armazenamento(origem, arquivo_credenciais=".streamlit/credentials.json", somente_leitura=False):
+    """Backend a partir da `origem` (ver `separar_origem`); as planilhas são acessadas com a service account de `arquivo_credenciais`.
+    `somente_leitura` abre os bancos SQLite sem permissão de escrita (o backend do Google não grava nada se não for pedido)."""
+    backend, nome = separar_origem(origem)
+    if backend == "sqlite":
+        return criar_armazenamento(backend, caminho=nome, somente_leitura=somente_leitura)
+    return criar_armazenamento(backend, client=gspread.service_account(filename=arquivo_credenciais, scopes=ESCOPOS_GOOGLE), nome_planilha=nome)
+
+
+def garantir_abas_do_sistema(armazenamento):
+    """Cria as abas mantidas pelo sistema (ex.: movimentações de estoque) que ainda não existem."""
+    for nome_aba, colunas in ABAS_DO_SISTEMA.items():
+        armazenamento.garantir_aba(nome_aba, colunas)
+
+
+def copiar_abas(origem, destino, nomes_abas=ABAS):
+    """Copia as abas de um backend para outro (ex.: da Planilha Google para o SQLite local)."""
+    garantir_abas_do_sistema(origem)
+    for nome_aba in nomes_abas:
+        destino.salvar_aba(nome_aba, origem.ler_aba(nome_aba).dropna(how='all'))
@@ -0,0 +1,173 @@
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from armazenamento import ABA_AGENDA, ABA_MATERIAIS, ABA_FICHA
+from calculos import ModeloCusto, CuboDiario, calcular_financeiro, calcular_analise_clientes, calcular_retencao_coortes, descartar_modelos_custo, projetar_estoque
+from dados import limpar_agenda, ordenar_agenda, limpar_materiais, limpar_ficha, fatiar_periodo, montar_visao_semana
+from ocupacao import IndiceOcupacao
+from sintetico import gerar_dados, argumentos_geracao
+
+
+CAMINHO_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+TAMANHOS_PADRAO = [1_000, 10_000, 100_000, 1_000_000]
+# Piora absoluta mínima para contar como regressão: abaixo disso a diferença é ruído de medição
+PIORA_MINIMA = {'segundos': 0.005, 'pico_mb': 1.0}
+
+
+def _limpeza(ctx):
+    """Como na carga do dashboard, com a validação do esquema e a quarentena ligadas."""
+    quarentena = []
+    ctx['agenda'] = ordenar_agenda(limpar_agenda(ctx['bruto'][ABA_AGENDA].copy(), quarentena))
+    ctx['materiais'] = limpar_materiais(ctx['bruto'][ABA_MATERIAIS].copy(), quarentena)
+    ctx['ficha'] = limpar_ficha(ctx['bruto'][ABA_FICHA].copy(), quarentena)
+
+
+def _filtros(ctx):
+    """Período 'Este Ano' com um profissional e metade dos procedimentos desmarcados, como na barra lateral."""
+    agenda = ctx['agenda']
+    profissionais = sorted(agenda['Profissional Responsável'].dropna().unique())[1:]
+    procedimentos = sorted(agenda['Procedimento Realizado'].dropna().unique())[::2]
+    periodo = fatiar_periodo(agenda, ctx['hoje'].replace(month=1, day=1), ctx['hoje'])
+    ctx['filtrada'] = periodo[periodo['Profissional Responsável'].isin(profissionais) & periodo['Procedimento Realizado'].isin(procedimentos)]
+
+
+def _modelo_custo(ctx):
+    ctx['modelo'] = ModeloCusto(ctx['materiais'], ctx['ficha'])
+
+
+def _cubo_diario(ctx):
+    cubo = CuboDiario(ctx['agenda'], ctx['modelo'])
+    cubo.totais(ctx['hoje'].replace(month=1, day=1), ctx['hoje'])
+    cubo.por_mes(ctx['hoje'].replace(month=1, day=1), ctx['hoje'])
+
+
+def _financeiro(ctx):
+    """Sem o modelo de custo memoizado das execuções anteriores: mede o cálculo, não o acerto do cache."""
+    descartar_modelos_custo()
+    ctx['financeiro'] = calcular_financeiro(ctx['filtrada'], ctx['materiais'], ctx['ficha'])
+
+
+def _crm(ctx):
+    calcular_analise_clientes(ctx['financeiro'][2], ctx['hoje'])
+    calcular_retencao_coortes(ctx['filtrada'])
+
+
+def _agenda_visual(ctx):
+    montar_visao_semana(ctx['agenda'], ctx['hoje'] - pd.Timedelta(days=(ctx['hoje'].weekday() + 1) % 7))
+
+
+def _ocupacao(ctx):
+    indice = IndiceOcupacao(ctx['agenda'], ctx['ficha'])
+    indice.sobreposicoes(ctx['hoje'], ctx['hoje'] + pd.Timedelta(days=6))
+    for profissional in sorted(ctx['agenda']['Profissional Responsável'].dropna().unique()):
+        indice.horarios_livres(profissional, 60, ctx['hoje'])
+
+
+def _projecao_estoque(ctx):
+    projetar_estoque(ctx['agenda'], ctx['materiais'], ctx['modelo'], ctx['hoje'])
+
+
+# Etapas na ordem do pipeline do dashboard; cada uma lê e grava resultados intermediários no contexto
+ETAPAS = [
+    ('limpeza', _limpeza),
+    ('filtros', _filtros),
+    ('modelo_custo', _modelo_custo),
+    ('cubo_diario', _cubo_diario),
+    ('financeiro', _financeiro),
+    ('crm', _crm),
+    ('agenda_visual', _agenda_visual),
+    ('ocupacao', _ocupacao),
+    ('projecao_estoque', _projecao_estoque),
+]
+
+
+def medir(bruto, hoje, repeticoes=5):
+    """Mede cada etapa sobre as abas cruas `bruto`: a mediana do tempo de `repeticoes` execuções (segundos) e o pico
+    de memória alocada durante a etapa (MB), medido numa execução à parte para o tracemalloc não distorcer o tempo."""
+    ctx = {'bruto': bruto, 'hoje': pd.Timestamp(hoje).normalize()}
+    resultados = {}
+    for nome, etapa in ETAPAS:
+        tempos = []
+        for _ in range(max(repeticoes, 1)):
+            inicio = time.perf_counter()
+            etapa(ctx)
+            tempos.append(time.perf_counter() - inicio)
+        tracemalloc.start()
+        try:
+            etapa(ctx)
+            pico = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        resultados[nome] = {'segundos': float(np.median(tempos)), 'pico_mb': pico / 2**20}
+    return resultados
+
+
+def comparar(resultados, baseline, tolerancia, piora_minima=PIORA_MINIMA):
+    """Etapas que ficaram mais de `tolerancia` (fração) mais lentas ou mais pesadas que a baseline e, ao mesmo tempo,
+    pioraram mais que `piora_minima` em valor absoluto (etapas de poucos milissegundos oscilam mais que 25% à toa)."""
+    regressoes = []
+    for nome, medida in resultados.items():
+        referencia = baseline.get(nome)
+        if not referencia: continue
+        for metrica in ('segundos', 'pico_mb'):
+            if medida[metrica] > referencia[metrica] * (1 + tolerancia) and medida[metrica] - referencia[metrica] > piora_minima[metrica]:
+                regressoes.append(f"{nome}: {metrica} {medida[metrica]:.3f} > {referencia[metrica]:.3f} (+{tolerancia:.0%})")
+    return regressoes
+
+
+def ler_baseline(caminho):
+    if not os.path.exists(caminho): return {}
+    with open(caminho, encoding="utf-8") as arquivo:
+        return json.load(arquivo)
+
+
+def main(argv=None):
+    parser = argumentos_geracao(argparse.ArgumentParser(description="Benchmark offline do pipeline de cálculo sobre dados sintéticos."))
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=TAMANHOS_PADRAO, help="números de atendimentos a medir (até 5.000.000)")
+    parser.add_argument("--repeticoes", type=int, default=5, help="execuções de cada etapa (vale a mediana)")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="piora aceita em relação à baseline (0.25 = 25%%)")
+    parser.add_argument("--piora-minima-ms", type=float, default=PIORA_MINIMA['segundos'] * 1000, help="piora absoluta mínima de tempo para acusar regressão")
+    parser.add_argument("--piora-minima-mb", type=float, default=PIORA_MINIMA['pico_mb'], help="piora absoluta mínima de memória para acusar regressão")
+    parser.add_argument("--baseline", default=CAMINHO_BASELINE)
+    parser.add_argument("--gravar-baseline", action="store_true", help="grava as medidas como nova baseline em vez de comparar")
+    args = parser.parse_args(argv)
+
+    hoje = pd.Timestamp.now().normalize()
+    baseline = ler_baseline(args.baseline)
+    regressoes, sem_baseline = [], []
+    for tamanho in args.tamanhos:
+        bruto = gerar_dados(tamanho, args.clientes, args.profissionais, args.procedimentos, args.materiais, args.anos, hoje, args.semente)
+        resultados = medir(bruto, hoje, args.repeticoes)
+        print(f"\n{tamanho:,} atendimentos")
+        for nome, medida in resultados.items():
+            print(f"  {nome:<18} {medida['segundos'] * 1000:>10.1f} ms {medida['pico_mb']:>10.1f} MB")
+        chave = str(tamanho)
+        if args.gravar_baseline:
+            baseline[chave] = resultados
+        elif chave not in baseline:
+            sem_baseline.append(f"{tamanho:,}")
+        else:
+            piora_minima = {'segundos': args.piora_minima_ms / 1000, 'pico_mb': args.piora_minima_mb}
+            regressoes += [f"{tamanho:,} atendimentos - {r}" for r in comparar(resultados, baseline.get(chave, {}), args.tolerancia, piora_minima)]
+
+    if args.gravar_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as arquivo:
+            json.dump(baseline, arquivo, indent=2, sort_keys=True)
+        print(f"\nBaseline gravada em {args.baseline}")
+        return 0
+    if regressoes:
+        print("\nRegressões:\n  " + "\n  ".join(regressoes))
+    if sem_baseline:
+        # Sem baseline não há com o que comparar: falhar evita que o benchmark passe sem verificar nada
+        print(f"\nSem baseline em {args.baseline} para {', '.join(sem_baseline)} atendimentos; grave-a com --gravar-baseline.", file=sys.stderr)
+        return 2
+    return 1 if regressoes else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    from pyarrow import feather
+except ImportError:  # pyarrow é opcional: sem ele a partida a quente fica desligada
+    pa = feather = None
+
+logger = logging.getLogger(__name__)
+TABELAS = ['agenda', 'materiais', 'ficha', 'movimentacoes']
+# Mudar quando a limpeza das abas mudar, para não reaproveitar tabelas limpas com regras antigas
+VERSAO_FORMATO = 5
+
+
+def pasta_cache_usuario(aplicativo="clinflow"):
+    """Pasta de cache do usuário no sistema (fora do repositório), onde fica o cache com os dados dos pacientes."""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser(r"~\AppData\Local")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, aplicativo)
+
+
+def _para_arrow(df):
+    """Colunas de texto com valores de tipos misturados (ex.: números e textos vindos do formulário) viram texto,
+    já que o Arrow exige um tipo por coluna; nulos continuam nulos."""
+    misturadas = [col for col in df.columns if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) not in ('string', 'empty')]
+    if not misturadas: return df
+    return df.assign(**{col: df[col].map(lambda valor: valor if valor is None or (not isinstance(valor, str) and pd.isna(valor)) else str(valor)) for col in misturadas})
+
+
+class CacheDisco:
+    """Último snapshot bom de uma clínica gravado em disco, para a partida a quente.
+
+    Cada tabela limpa vira um arquivo Arrow (Feather sem compressão) em `pasta`, lido com memory map: na partida
+    o dashboard mostra esses dados em milissegundos enquanto a planilha é relida em segundo plano. As gravações
+    rodam numa thread própria e só a versão mais recente pendente é gravada. Requer o pacote `pyarrow`.
+    """
+
+    def __init__(self, pasta, identificador):
+        self.pasta = os.path.join(pasta, re.sub(r'[^\w.-]+', '_', identificador).strip('_'))
+        self.identificador = identificador
+        self._pendente = None
+        self._gravando = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def disponivel():
+        return feather is not None
+
+    def carregar(self):
+        """(agenda, materiais, ficha, movimentacoes) gravados, ou None se não houver cache válido."""
+        if not self.disponivel(): return None
+        try:
+            with open(os.path.join(self.pasta, 'manifesto.json'), encoding='utf-8') as arquivo:
+                manifesto = json.load(arquivo)
+            if manifesto.get('formato') != VERSAO_FORMATO or manifesto.get('identificador') != self.identificador:
+                return None
+            return tuple(feather.read_table(os.path.join(self.pasta, f"{nome}.arrow"), memory_map=True).to_pandas() for nome in TABELAS)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.exception("Cache em disco ilegível em %s; ignorado", self.pasta)
+            return None
+
+    def salvar(self, snapshot):
+        """Grava as tabelas do snapshot numa pasta temporária e a troca pela atual, para nunca deixar um cache pela metade."""
+        temporaria = f"{self.pasta}.tmp-{os.getpid()}-{threading.get_ident()}"
+        shutil.rmtree(temporaria, ignore_errors=True)
+        # Só o usuário do servidor lê o cache: ele guarda nomes, idades e gêneros dos pacientes
+        os.makedirs(os.path.dirname(self.pasta), mode=0o700, exist_ok=True)
+        os.makedirs(temporaria, mode=0o700)
+        try:
+            for nome in TABELAS:
+                df = getattr(snapshot, nome)
+                if df is None: df = pd.DataFrame()
+                feather.write_feather(pa.Table.from_pandas(_para_arrow(df), preserve_index=True), os.path.join(temporaria, f"{nome}.arrow"), compression='uncompressed')
+            with open(os.path.join(temporaria, 'manifesto.json'), 'w', encoding='utf-8') as arquivo:
+                json.dump({'formato': VERSAO_FORMATO, 'identificador': self.identificador, 'versao': snapshot.versao, 'gravado_em': time.time()}, arquivo)
+            antiga = f"{self.pasta}.old-{os.getpid()}-{threading.get_ident()}"
+            if os.path.exists(self.pasta): os.replace(self.pasta, antiga)
+            os.replace(temporaria, self.pasta)
+            shutil.rmtree(antiga, ignore_errors=True)
+        finally:
+            shutil.rmtree(temporaria, ignore_errors=True)
+
+    def salvar_em_segundo_plano(self, snapshot):
+        """Agenda a gravação do snapshot; se uma gravação já está em andamento, grava só o mais recente depois dela."""
+        if not self.disponivel(): return
+        with self._lock:
+            self._pendente = snapshot
+            if self._gravando: return
+            self._gravando = True
+        threading.Thread(target=self._gravar_pendentes, name="clinflow-cache-disco", daemon=True).start()
+
+    def _gravar_pendentes(self):
+        while True:
+            with self._lock:
+                snapshot, self._pendente = self._pendente, None
+                if snapshot is None:
+                    self._gravando = False
+                    return
+            try:
+                self.salvar(snapshot)
+            except Exception:
+                logger.exception("Falha ao gravar o cache em disco em %s", self.pasta)
@@ -0,0 +1,284 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from metricas import METRICAS
+
+
+def hash_conteudo(*dfs):
+    """Hash do conteúdo (colunas, índice e valores) de um ou mais DataFrames."""
+    h = hashlib.sha1()
+    for df in dfs:
+        h.update(repr(list(df.columns)).encode())
+        h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def mapear_valores(serie, mapa):
+    """Equivale a `serie.map(mapa)` com resultado numérico; numa série categórica consulta o mapa uma vez por
+    categoria e espalha o resultado pelos códigos."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        por_categoria = np.append(mapa.reindex(serie.cat.categories).to_numpy(dtype=float), np.nan)
+        return pd.Series(por_categoria[serie.cat.codes.to_numpy()], index=serie.index)
+    return serie.map(mapa).astype(float)
+
+
+class ModeloCusto:
+    """Custo de materiais e preço de venda de cada procedimento, derivados da Ficha Técnica e dos Materiais.
+
+    A Ficha Técnica também é guardada como matriz esparsa procedimento × material, em triplas
+    (linha, coluna, quantidade): o consumo de um conjunto de atendimentos é o vetor de contagem por
+    procedimento vezes essa matriz, sem juntar cada atendimento com as linhas da ficha.
+    """
+
+    def __init__(self, materiais, ficha_tecnica):
+        custo_map = ficha_tecnica.merge(materiais, on='Material', how='left').fillna(0)
+        custo_map['Custo_Item'] = custo_map['Quantidade Usada'] * custo_map['Preco Unitario (R$)']
+        self.custo = custo_map.groupby('Procedimento')['Custo_Item'].sum()
+        self.preco = ficha_tecnica.drop_duplicates(subset=['Procedimento']).set_index('Procedimento')['Preco de Venda (R$)']
+        bom = ficha_tecnica.dropna(subset=['Procedimento', 'Material'])
+        self.bom_procedimentos = pd.Index(bom['Procedimento'].unique())
+        self.bom_materiais = pd.Index(sorted(bom['Material'].unique()))
+        self._bom_linha = self.bom_procedimentos.get_indexer(bom['Procedimento'])
+        self._bom_coluna = self.bom_materiais.get_indexer(bom['Material'])
+        self._bom_quantidade = bom['Quantidade Usada'].to_numpy(dtype=float)
+
+    def aplicar(self, df_agenda):
+        """Acrescenta custo, preço e lucro de cada atendimento (cópia rasa: o snapshot compartilhado não é duplicado)."""
+        agenda_com_calculos = df_agenda.copy(deep=False)
+        agenda_com_calculos['Custo Atendimento (R$)'] = mapear_valores(agenda_com_calculos['Procedimento Realizado'], self.custo).fillna(0)
+        agenda_com_calculos['Preco Venda (R$)'] = mapear_valores(agenda_com_calculos['Procedimento Realizado'], self.preco).fillna(0)
+        agenda_com_calculos['Lucro Atendimento (R$)'] = agenda_com_calculos['Preco Venda (R$)'] - agenda_com_calculos['Custo Atendimento (R$)']
+        return agenda_com_calculos
+
+    def posicoes_procedimentos(self, procedimentos):
+        """Linha da matriz de cada atendimento (-1 para procedimentos fora da Ficha Técnica)."""
+        if isinstance(procedimentos.dtype, pd.CategoricalDtype):
+            por_categoria = np.append(self.bom_procedimentos.get_indexer(procedimentos.cat.categories), -1)
+            return por_categoria[procedimentos.cat.codes.to_numpy()]
+        return self.bom_procedimentos.get_indexer(procedimentos)
+
+    def consumo(self, contagem):
+        """Multiplica contagens por procedimento (vetor, ou matriz períodos × procedimentos) pela matriz da ficha;
+        devolve a quantidade de cada material em `bom_materiais` (por período, se `contagem` for matriz)."""
+        contagem = np.asarray(contagem, dtype=float)
+        pesos = contagem[..., self._bom_linha] * self._bom_quantidade
+        consumo = np.zeros(contagem.shape[:-1] + (len(self.bom_materiais),))
+        np.add.at(consumo.T, self._bom_coluna, np.moveaxis(pesos, -1, 0))
+        return consumo
+
+    def consumo_por_atendimento(self, procedimentos):
+        """Entradas não nulas da ficha para cada atendimento: (posição do atendimento, material, quantidade)."""
+        posicoes = self.posicoes_procedimentos(procedimentos)
+        ordem = np.argsort(self._bom_linha, kind='stable')
+        inicio = np.searchsorted(self._bom_linha[ordem], np.arange(len(self.bom_procedimentos)), side='left')
+        tamanho = np.searchsorted(self._bom_linha[ordem], np.arange(len(self.bom_procedimentos)), side='right') - inicio
+        atendimentos = np.flatnonzero(posicoes >= 0)
+        repeticoes = tamanho[posicoes[atendimentos]]
+        deslocamento = np.arange(repeticoes.sum()) - np.repeat(np.cumsum(repeticoes) - repeticoes, repeticoes)
+        entradas = ordem[np.repeat(inicio[posicoes[atendimentos]], repeticoes) + deslocamento]
+        return np.repeat(atendimentos, repeticoes), self.bom_materiais[self._bom_coluna[entradas]], self._bom_quantidade[entradas]
+
+    def consumo_atendimentos(self, procedimentos):
+        """Quantidade de cada material usada pelos atendimentos (só materiais de algum procedimento realizado)."""
+        posicoes = self.posicoes_procedimentos(procedimentos)
+        contagem = np.bincount(posicoes[posicoes >= 0], minlength=len(self.bom_procedimentos))
+        usados = self.consumo(contagem > 0) > 0
+        return pd.Series(self.consumo(contagem)[usados], index=self.bom_materiais[usados], name='Quantidade Usada')
+
+
+_modelos_custo = OrderedDict()
+_lock_modelos = threading.Lock()
+MAX_MODELOS_CUSTO = 8
+
+
+def obter_modelo_custo(materiais, ficha_tecnica):
+    """Modelo de custo memoizado pelo conteúdo de Materiais + Ficha Técnica: só é reconstruído quando uma das abas muda."""
+    chave = hash_conteudo(materiais, ficha_tecnica)
+    with _lock_modelos:
+        modelo = _modelos_custo.get(chave)
+        METRICAS.registrar_cache("modelo_custo", modelo is not None)
+        if modelo is not None:
+            _modelos_custo.move_to_end(chave)
+            return modelo
+    modelo = ModeloCusto(materiais, ficha_tecnica)
+    with _lock_modelos:
+        _modelos_custo[chave] = modelo
+        while len(_modelos_custo) > MAX_MODELOS_CUSTO:
+            _modelos_custo.popitem(last=False)
+    return modelo
+
+
+def descartar_modelos_custo():
+    """Esvazia a memória de `obter_modelo_custo` (o próximo pedido reconstrói o modelo, como numa carga nova)."""
+    with _lock_modelos:
+        _modelos_custo.clear()
+
+
+class CuboDiario:
+    """Agregado diário (dia × profissional × procedimento) de atendimentos, receita, custo e lucro.
+
+    Guarda as somas acumuladas por dia de cada combinação profissional/procedimento: qualquer janela
+    de datas sai da diferença de duas linhas, e os filtros da barra lateral somam só as combinações
+    selecionadas. O custo de uma consulta não depende do tamanho do histórico. Só os dias com atendimento
+    têm linha (localizada por busca binária): a memória cresce com esses dias, não com o intervalo entre a
+    primeira e a última data (uma data digitada errada, como 2062, não infla o cubo).
+    """
+
+    METRICAS = ['Atendimentos', 'Receita', 'Custo', 'Lucro']
+
+    def __init__(self, agenda, modelo_custo):
+        validos = agenda[agenda['Data do Atendimento'].notna()]
+        dias = validos['Data do Atendimento'].dt.normalize().to_numpy()
+        # Dias distintos com atendimento, em ordem: a linha d do cubo é o dia self.dias[d]
+        self.dias = np.unique(dias)
+        n_dias = len(self.dias)
+        combinacoes = validos.groupby(['Profissional Responsável', 'Procedimento Realizado'], dropna=False, observed=True, sort=False)
+        codigos = combinacoes.ngroup().to_numpy()
+        chaves = combinacoes.size().index
+        self.profissionais = np.asarray(chaves.get_level_values(0), dtype=object)
+        self.procedimentos = np.asarray(chaves.get_level_values(1), dtype=object)
+        n_comb = len(chaves)
+
+        procedimento = validos['Procedimento Realizado']
+        receita = mapear_valores(procedimento, modelo_custo.preco).fillna(0).to_numpy()
+        custo = mapear_valores(procedimento, modelo_custo.custo).fillna(0).to_numpy()
+        posicao = np.searchsorted(self.dias, dias) * n_comb + codigos
+        # acumulado[d] = soma dos dias com atendimento anteriores a self.dias[d]; a janela [i, j) é acumulado[j] - acumulado[i]
+        self.acumulado = np.zeros((n_dias + 1, n_comb, len(self.METRICAS)))
+        for k, pesos in enumerate([None, receita, custo, receita - custo]):
+            self.acumulado[1:, :, k] = np.bincount(posicao, weights=pesos, minlength=n_dias * n_comb).reshape(n_dias, n_comb)
+        np.cumsum(self.acumulado, axis=0, out=self.acumulado)
+
+    def _posicao(self, data):
+        """Linha de `acumulado` com a soma de todos os dias com atendimento anteriores a `data`."""
+        return int(np.searchsorted(self.dias, pd.Timestamp(data).normalize().to_datetime64()))
+
+    def _mascara(self, profissionais, procedimentos):
+        mascara = np.ones(len(self.profissionais), dtype=bool)
+        if profissionais is not None: mascara &= np.isin(self.profissionais, list(profissionais))
+        if procedimentos is not None: mascara &= np.isin(self.procedimentos, list(procedimentos))
+        return mascara
+
+    def totais(self, inicio, fim, profissionais=None, procedimentos=None):
+        """Totais de cada métrica entre `inicio` e `fim` (inclusive), opcionalmente filtrados; None = todos."""
+        i, j = self._posicao(inicio), self._posicao(pd.Timestamp(fim) + pd.Timedelta(days=1))
+        janela = self.acumulado[max(j, i)] - self.acumulado[i]
+        return dict(zip(self.METRICAS, janela[self._mascara(profissionais, procedimentos)].sum(axis=0)))
+
+    def por_mes(self, inicio, fim, profissionais=None, procedimentos=None):
+        """Totais mês a mês dentro da janela (apenas meses com atendimentos), no formato do gráfico mensal."""
+        meses = pd.period_range(pd.Timestamp(inicio), pd.Timestamp(fim), freq='M')
+        if len(meses) == 0:
+            return pd.DataFrame(columns=['Ano-Mes'] + self.METRICAS)
+        inicios = [max(mes.start_time, pd.Timestamp(inicio)) for mes in meses]
+        fins = [min(mes.end_time.normalize(), pd.Timestamp(fim)) + pd.Timedelta(days=1) for mes in meses]
+        i = np.array([self._posicao(data) for data in inicios])
+        j = np.maximum(np.array([self._posicao(data) for data in fins]), i)
+        mensal = (self.acumulado[j] - self.acumulado[i])[:, self._mascara(profissionais, procedimentos)].sum(axis=1)
+        df_mes = pd.DataFrame(mensal, columns=self.METRICAS)
+        df_mes.insert(0, 'Ano-Mes', meses.astype(str))
+        return df_mes[df_mes['Atendimentos'] > 0].reset_index(drop=True)
+
+
+def calcular_financeiro(df_agenda, materiais, ficha_tecnica):
+    """Função vetorizada para calcular finanças e consumo."""
+    if df_agenda.empty: return pd.DataFrame(), pd.DataFrame(), df_agenda.copy(deep=False)
+    modelo_custo = obter_modelo_custo(materiais, ficha_tecnica)
+    agenda_com_calculos = modelo_custo.aplicar(df_agenda)
+    df_financeiro = agenda_com_calculos.groupby('Procedimento Realizado', observed=True).agg(Qtd_Realizada=('Procedimento Realizado', 'count'), Receita_Total_RS=('Preco Venda (R$)', 'sum'), Custo_Total_RS=('Custo Atendimento (R$)', 'sum'), Lucro_Total_RS=('Lucro Atendimento (R$)', 'sum')).reset_index().rename(columns={'Procedimento Realizado': 'Procedimento', 'Receita_Total_RS': 'Receita Total (R$)', 'Custo_Total_RS': 'Custo Total (R$)', 'Lucro_Total_RS': 'Lucro Total (R$)', 'Qtd_Realizada': 'Qtd Realizada'})
+    df_consumo = modelo_custo.consumo_atendimentos(df_agenda['Procedimento Realizado']).rename_axis('Material').reset_index()
+    if not df_consumo.empty:
+        df_consumo = pd.merge(df_consumo, materiais, on='Material', how='left').fillna(0)
+        df_consumo['Custo Total (R$)'] = df_consumo['Quantidade Usada'] * df_consumo['Preco Unitario (R$)']
+    return df_financeiro, df_consumo, agenda_com_calculos
+
+
+def projetar_estoque(agenda, materiais, modelo_custo, hoje=None, pendentes=None):
+    """Projeta o estoque de cada material consumindo, dia a dia, os atendimentos já agendados a partir de `hoje`.
+    Os atendimentos passados ainda sem baixa (`pendentes`; padrão: 'Estoque Deduzido' falso) entram como consumo
+    de hoje. Devolve, por linha de `materiais`, o consumo agendado, o estoque ao fim da agenda e as datas em que o
+    estoque atinge o mínimo e fica negativo."""
+    hoje = pd.Timestamp(hoje if hoje is not None else pd.Timestamp.now()).normalize()
+    datas = agenda['Data do Atendimento']
+    futuros = agenda[datas >= hoje]
+    if pendentes is None: pendentes = agenda[(datas < hoje) & ~agenda['Estoque Deduzido']]
+    dias = np.concatenate([(futuros['Data do Atendimento'] - hoje).dt.days.to_numpy(), np.zeros(len(pendentes), dtype=int)])
+    linhas = np.concatenate([modelo_custo.posicoes_procedimentos(futuros['Procedimento Realizado']), modelo_custo.posicoes_procedimentos(pendentes['Procedimento Realizado'])])
+    dias, linhas = dias[linhas >= 0], linhas[linhas >= 0]
+    # Só os dias com atendimento viram linhas da matriz: um agendamento muito no futuro não a infla
+    distintos, posicao = np.unique(dias, return_inverse=True)
+    if not len(distintos): distintos = np.zeros(1, dtype=int)
+    n_dias, n_proc = len(distintos), len(modelo_custo.bom_procedimentos)
+    contagem_diaria = np.bincount(posicao * n_proc + linhas, minlength=n_dias * n_proc).reshape(n_dias, n_proc)
+    acumulado = np.cumsum(modelo_custo.consumo(contagem_diaria), axis=0)
+
+    colunas = modelo_custo.bom_materiais.get_indexer(materiais['Material'])
+    # Coluna extra de zeros para materiais que não aparecem na Ficha Técnica (posição -1)
+    acumulado = np.append(acumulado, np.zeros((n_dias, 1)), axis=1)[:, colunas]
+    estoque = materiais['Quantidade em Estoque'].to_numpy(dtype=float) if 'Quantidade em Estoque' in materiais.columns else np.zeros(len(materiais))
+    minimo = materiais['Estoque Mínimo'].to_numpy(dtype=float) if 'Estoque Mínimo' in materiais.columns else np.zeros(len(materiais))
+    projetado = estoque - acumulado
+
+    def primeiro_dia(condicao):
+        dia = pd.Series(np.where(condicao.any(axis=0), distintos[condicao.argmax(axis=0)], -1), index=materiais.index)
+        return (hoje + pd.to_timedelta(dia, unit='D')).where(dia >= 0)
+
+    return pd.DataFrame({
+        'Material': materiais['Material'], 'Quantidade em Estoque': estoque, 'Consumo Agendado': acumulado[-1],
+        'Estoque Projetado': projetado[-1], 'Atinge o Mínimo em': primeiro_dia(projetado <= minimo),
+        'Ruptura Prevista': primeiro_dia(projetado < 0)}, index=materiais.index)
+
+
+def _pontuacao_quintil(valores, crescente=True):
+    """Nota de 1 a 5 pelo quintil de cada valor (5 = melhores valores; valores ausentes ficam com 1)."""
+    return np.ceil(valores.rank(pct=True, ascending=crescente) * 5).clip(1, 5).fillna(1).astype('int8')
+
+
+def calcular_analise_clientes(agenda_com_preco, data_referencia=None):
+    """Calcula as métricas de CRM por cliente num único groupby vetorizado, com as notas RFM
+    (recência, frequência e valor, de 1 a 5) em relação a `data_referencia` (padrão: último atendimento)."""
+    if agenda_com_preco.empty or 'Nome do Cliente' not in agenda_com_preco.columns: return pd.DataFrame()
+    agregacoes = {'Total Gasto (R$)': ('Preco Venda (R$)', 'sum'), 'Nº de Visitas': ('Data do Atendimento', 'count'), 'Última Visita': ('Data do Atendimento', 'max')}
+    # 'first' já ignora nulos: primeira idade/gênero informados de cada cliente
+    if 'Idade' in agenda_com_preco.columns: agregacoes['Idade'] = ('Idade', 'first')
+    if 'Genero' in agenda_com_preco.columns: agregacoes['Genero'] = ('Genero', 'first')
+    analise_clientes = agenda_com_preco.groupby('Nome do Cliente', observed=True).agg(**agregacoes)
+    analise_clientes = analise_clientes.rename_axis('Cliente').reset_index()
+    visitas = analise_clientes['Nº de Visitas']
+    analise_clientes['Ticket Médio (R$)'] = (analise_clientes['Total Gasto (R$)'] / visitas.where(visitas > 0)).fillna(0)
+
+    referencia = pd.Timestamp(data_referencia) if data_referencia is not None else analise_clientes['Última Visita'].max()
+    analise_clientes['Recência (dias)'] = (referencia.normalize() - analise_clientes['Última Visita'].dt.normalize()).dt.days
+    analise_clientes['R'] = _pontuacao_quintil(analise_clientes['Recência (dias)'], crescente=False)
+    analise_clientes['F'] = _pontuacao_quintil(visitas)
+    analise_clientes['M'] = _pontuacao_quintil(analise_clientes['Total Gasto (R$)'])
+    analise_clientes['RFM'] = analise_clientes['R'].astype(str) + analise_clientes['F'].astype(str) + analise_clientes['M'].astype(str)
+
+    analise_clientes = analise_clientes.sort_values(by='Total Gasto (R$)', ascending=False)
+    col_order = ['Cliente', 'Total Gasto (R$)', 'Nº de Visitas', 'Ticket Médio (R$)'];
+    if 'Idade' in analise_clientes.columns: col_order.append('Idade')
+    if 'Genero' in analise_clientes.columns: col_order.append('Genero')
+    col_order += ['Última Visita', 'Recência (dias)', 'R', 'F', 'M', 'RFM']
+    categoricas = {col: object for col in col_order if isinstance(analise_clientes[col].dtype, pd.CategoricalDtype)}
+    return analise_clientes[col_order].astype(categoricas).reset_index(drop=True)
+
+
+def calcular_retencao_coortes(agenda):
+    """Retenção mensal por coorte: para os clientes cuja primeira visita foi em cada mês, a fração
+    que voltou 0, 1, 2... meses depois."""
+    validos = agenda[agenda['Data do Atendimento'].notna() & agenda['Nome do Cliente'].notna()]
+    if validos.empty: return pd.DataFrame()
+    datas = validos['Data do Atendimento']
+    mes = (datas.dt.year * 12 + datas.dt.month - 1).to_numpy()
+    cliente = pd.factorize(validos['Nome do Cliente'])[0]
+    coorte = pd.Series(mes).groupby(cliente).transform('min').to_numpy()
+    visitas = pd.DataFrame({'Coorte': coorte, 'Mês': mes - coorte, 'Cliente': cliente}).drop_duplicates()
+    contagem = visitas.groupby(['Coorte', 'Mês']).size().unstack(fill_value=0)
+    retencao = contagem.div(contagem[0], axis=0)
+    retencao.index = [f"{m // 12}-{m % 12 + 1:02d}" for m in retencao.index]
+    retencao.index.name = 'Coorte'
+    retencao.columns = [f"Mês {m}" for m in retencao.columns]
+    retencao.insert(0, 'Clientes', contagem[0].to_numpy())
+    return retencao
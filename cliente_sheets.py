@@ -0,0 +1,129 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future
+import gspread
+import requests
+
+logger = logging.getLogger(__name__)
+# Respostas que indicam falha passageira: cota estourada (429) ou instabilidade do Google (5xx)
+CODIGOS_TEMPORARIOS = {429, 500, 502, 503, 504}
+
+
+class BaldeDeFichas:
+    """Token bucket: até `capacidade` requisições de uma vez, repostas à razão de `por_segundo`.
+    `retirar` espera até haver fichas, em vez de deixar a requisição estourar a cota."""
+
+    def __init__(self, capacidade, por_segundo):
+        self.capacidade = capacidade
+        self.por_segundo = por_segundo
+        self._fichas = float(capacidade)
+        self._ultima = time.monotonic()
+        self._lock = threading.Lock()
+
+    def retirar(self, quantidade=1):
+        quantidade = min(quantidade, self.capacidade)
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._fichas = min(self.capacidade, self._fichas + (agora - self._ultima) * self.por_segundo)
+                self._ultima = agora
+                if self._fichas >= quantidade:
+                    self._fichas -= quantidade
+                    return
+                espera = (quantidade - self._fichas) / self.por_segundo
+            time.sleep(espera)
+
+
+def _codigo_http(erro):
+    resposta = getattr(erro, 'response', None)
+    return getattr(resposta, 'status_code', None)
+
+
+class ClienteSheets:
+    """Cliente gspread compartilhado por todos os backends e sessões do processo.
+
+    - limita as requisições a `requisicoes_por_minuto` (token bucket), abaixo da cota do Google; as consultas de
+      metadados no Drive (api='drive') têm cota própria no Google e um balde separado, `requisicoes_drive_por_minuto`;
+    - agrupa chamadas idênticas em andamento (single-flight): quem chega depois espera e recebe o mesmo resultado;
+    - repete falhas passageiras (429/5xx, queda de conexão) com espera exponencial e jitter;
+    - abre cada planilha uma única vez e reaproveita o handle, em vez de chamar `client.open` a cada leitura.
+
+    `registrar(nome, segundos, erro)` (opcional) recebe cada chamada feita à API, para instrumentação.
+    """
+
+    def __init__(self, client, requisicoes_por_minuto=60, tentativas=5, espera_inicial=1.0, espera_maxima=32.0, registrar=None,
+                 requisicoes_drive_por_minuto=300):
+        self.client = client
+        self.tentativas = tentativas
+        self.espera_inicial = espera_inicial
+        self.espera_maxima = espera_maxima
+        self._registrar = registrar
+        self._baldes = {'sheets': BaldeDeFichas(requisicoes_por_minuto, requisicoes_por_minuto / 60),
+                        'drive': BaldeDeFichas(requisicoes_drive_por_minuto, requisicoes_drive_por_minuto / 60)}
+        self._em_andamento = {}
+        self._planilhas = {}
+        self._lock = threading.Lock()
+
+    def planilha(self, nome):
+        """Handle da planilha `nome`, aberto na primeira vez e reaproveitado depois."""
+        with self._lock:
+            planilha = self._planilhas.get(nome)
+        if planilha is None:
+            planilha = self.executar(('open', nome), lambda: self.client.open(nome))
+            with self._lock:
+                self._planilhas[nome] = planilha
+        return planilha
+
+    def executar(self, chave, funcao, custo=1, repetir=True, api='sheets'):
+        """Executa `funcao` (que faz `custo` requisições à `api`, 'sheets' ou 'drive') respeitando o limite de requisições dela.
+
+        Chamadas com a mesma `chave` já em andamento não são repetidas: esperam a primeira e recebem o mesmo
+        resultado (ou erro); `chave=None` não agrupa (gravações). `chave[0]` dá nome à chamada na instrumentação.
+        Com `repetir=False` (gravações que não podem ser duplicadas) só a recusa por cota (429) é repetida.
+        """
+        if chave is None:
+            return self._com_tentativas('gravacao', funcao, custo, repetir, api)
+        with self._lock:
+            chamada = self._em_andamento.get(chave)
+            primeira = chamada is None
+            if primeira:
+                chamada = self._em_andamento[chave] = Future()
+        if not primeira:
+            return chamada.result()
+        try:
+            chamada.set_result(self._com_tentativas(chave[0], funcao, custo, repetir, api))
+        except BaseException as e:
+            chamada.set_exception(e)
+        finally:
+            with self._lock:
+                del self._em_andamento[chave]
+        return chamada.result()
+
+    def _com_tentativas(self, nome, funcao, custo, repetir, api):
+        nome = f"{api}.{nome}"
+        for tentativa in range(self.tentativas):
+            self._baldes[api].retirar(custo)
+            inicio = time.perf_counter()
+            try:
+                resultado = funcao()
+                self._registrar_chamada(nome, inicio, False)
+                return resultado
+            except gspread.exceptions.APIError as e:
+                self._registrar_chamada(nome, inicio, True)
+                codigo = _codigo_http(e)
+                if not (codigo == 429 or (repetir and codigo in CODIGOS_TEMPORARIOS)) or tentativa == self.tentativas - 1:
+                    raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self._registrar_chamada(nome, inicio, True)
+                if not repetir or tentativa == self.tentativas - 1:
+                    raise
+            # Full jitter: espera aleatória até o teto exponencial, para as sessões não voltarem todas juntas
+            espera = random.uniform(0, min(self.espera_maxima, self.espera_inicial * 2 ** tentativa))
+            logger.warning("Falha passageira em '%s' (tentativa %d de %d); nova tentativa em %.1fs", nome, tentativa + 1, self.tentativas, espera)
+            time.sleep(espera)
+
+    def _registrar_chamada(self, nome, inicio, erro):
+        if self._registrar is not None:
+            self._registrar(nome, time.perf_counter() - inicio, erro)
@@ -0,0 +1,241 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from armazenamento import ABA_AGENDA, ABA_MOVIMENTACOES, garantir_abas_do_sistema
+from cache_disco import CacheDisco
+from dados import SincronizadorAgenda, SincronizadorMovimentacoes, carregar_dados, concatenar_agenda, juntar_quarentena, ordenar_agenda
+from snapshot import Snapshot, RepositorioSnapshots, AtualizadorSegundoPlano, memoria_tabelas
+
+
+# Opção do seletor que mostra todas as clínicas juntas (somente leitura)
+CONSOLIDADO = "🏥 Todas as clínicas"
+SEPARADOR_CLINICA = " · "
+
+
+def ler_configuracao(texto, padrao):
+    """Clínicas configuradas: `texto` é um JSON (ou o caminho de um arquivo JSON) no formato
+    {"Nome": {"origem": "gsheets:<planilha>" | "sqlite:<arquivo>", "ttl": 60, "memoria_mb": 256}, ...} ou {"Nome": "<origem>"}.
+    Sem configuração, usa `padrao` ({nome: origem}). Devolve {nome: {"origem": ..., "ttl": ..., "memoria_mb": ...}}."""
+    if texto and os.path.isfile(texto):
+        with open(texto, encoding="utf-8") as arquivo:
+            texto = arquivo.read()
+    clinicas = json.loads(texto) if texto else padrao
+    return {nome: ({"origem": cfg} if isinstance(cfg, str) else dict(cfg)) for nome, cfg in clinicas.items()}
+
+
+class LimiteMemoriaClinica(MemoryError):
+    """Os dados de uma clínica passaram do limite de memória configurado para ela (`memoria_mb`)."""
+
+
+class Clinica:
+    """Recursos de uma clínica (tenant): backend, sincronizadores incrementais, repositório do snapshot e
+    atualizador em segundo plano. O snapshot só é carregado quando alguém pede e pode ser descartado.
+    O atualizador só consulta o armazenamento enquanto a clínica foi usada nos últimos `tempo_ocioso` segundos
+    (ver `usar`), para clínicas abertas e esquecidas não gastarem a cota de requisições do processo.
+    Com `memoria_maxima` (bytes), uma carga maior que ela é recusada (LimiteMemoriaClinica; a versão anterior
+    continua valendo) e os valores derivados do snapshot são descartados para caber (ver Snapshot)."""
+
+    def __init__(self, nome, armazenamento, ttl=60, intervalo_atualizacao=10, ao_carregar=None, pasta_cache=None, tempo_ocioso=300,
+                 memoria_maxima=None):
+        self.nome = nome
+        self.armazenamento = armazenamento
+        self.intervalo_atualizacao = intervalo_atualizacao
+        self.tempo_ocioso = tempo_ocioso
+        self.memoria_maxima = memoria_maxima
+        self.usada_em = time.monotonic()
+        self.sincronizadores = {ABA_AGENDA: SincronizadorAgenda(armazenamento), ABA_MOVIMENTACOES: SincronizadorMovimentacoes(armazenamento)}
+        cache = CacheDisco(pasta_cache, armazenamento.identificador) if pasta_cache and CacheDisco.disponivel() else None
+        self.repositorio = RepositorioSnapshots(self._carregar, ttl=ttl, cache=cache, memoria_maxima=memoria_maxima)
+        self._ao_carregar = ao_carregar
+        # Linhas das abas com problemas de esquema na última carga (ver `aplicar_esquema`)
+        self.quarentena = juntar_quarentena([])
+        self._atualizador = None
+        self._abas_garantidas = False
+        self._lock = threading.Lock()
+
+    def _carregar(self, completo):
+        if not self._abas_garantidas:
+            garantir_abas_do_sistema(self.armazenamento)
+            self._abas_garantidas = True
+        problemas = []
+        tabelas = carregar_dados(self.armazenamento, self.sincronizadores[ABA_AGENDA], completo, self.sincronizadores[ABA_MOVIMENTACOES], problemas)
+        self.quarentena = juntar_quarentena(problemas)
+        memoria = memoria_tabelas(*tabelas)
+        if self.memoria_maxima is not None and memoria > self.memoria_maxima:
+            # Não guarda nada da carga recusada: a próxima tentativa relê as abas inteiras
+            for sinc in self.sincronizadores.values(): sinc.invalidar()
+            raise LimiteMemoriaClinica(f"os dados da clínica '{self.nome}' ocupam {memoria / 2**20:.1f} MB, "
+                                       f"acima do limite de {self.memoria_maxima / 2**20:.1f} MB (memoria_mb)")
+        if self._ao_carregar: self._ao_carregar(self, memoria)
+        return tabelas
+
+    def usar(self):
+        """Marca a clínica como em uso agora (alguma sessão a consultou)."""
+        self.usada_em = time.monotonic()
+
+    def ociosa(self):
+        return time.monotonic() - self.usada_em > self.tempo_ocioso
+
+    def ativar(self):
+        """Inicia o atualizador em segundo plano, se ainda não estiver rodando."""
+        with self._lock:
+            if self._atualizador is None:
+                self._atualizador = AtualizadorSegundoPlano(self.repositorio, self.armazenamento.revisao, self.intervalo_atualizacao, self.ociosa)
+                self._atualizador.start()
+
+    def desativar(self):
+        """Para o atualizador e libera o snapshot e o estado incremental; a próxima consulta recarrega a clínica.
+        Uma clínica que está sendo recarregada agora não é interrompida (retorna False)."""
+        if not self.repositorio.descartar(esperar=False):
+            return False
+        with self._lock:
+            if self._atualizador is not None:
+                self._atualizador.parar()
+                self._atualizador = None
+        for sinc in self.sincronizadores.values():
+            sinc.invalidar()
+        return True
+
+    def memoria(self):
+        atual = self.repositorio.atual()
+        return atual.memoria() if atual is not None else 0
+
+
+class GerenciadorClinicas:
+    """Clínicas servidas pelo processo, cada uma com o seu snapshot, ttl e atualizador.
+
+    Os snapshots são carregados sob demanda. Quando a memória somada dos snapshots (tabelas e valores derivados)
+    passa de `orcamento_memoria` bytes, as clínicas usadas há mais tempo são descartadas (LRU) até caber, sem nunca
+    descartar a que acabou de ser carregada. O limite de cada clínica (`memoria_mb` na configuração) impede que
+    uma clínica grande ocupe o orçamento inteiro e empurre as outras para fora.
+    `abrir(origem)` cria o backend de uma origem configurada. Com `pasta_cache`, cada clínica
+    guarda o último snapshot em disco e parte dele (ver CacheDisco), inclusive depois de descartada. Clínicas sem
+    consultas há mais de `tempo_ocioso` segundos deixam de ser verificadas em segundo plano até voltarem a ser usadas.
+    """
+
+    def __init__(self, configuracao, abrir, orcamento_memoria=1 << 30, intervalo_atualizacao=10, pasta_cache=None, tempo_ocioso=300):
+        self.configuracao = configuracao
+        self.pasta_cache = pasta_cache
+        self.nomes = list(configuracao)
+        self.orcamento_memoria = orcamento_memoria
+        self.intervalo_atualizacao = intervalo_atualizacao
+        self.tempo_ocioso = tempo_ocioso
+        self._abrir = abrir
+        self._clinicas = OrderedDict()
+        self._lock = threading.Lock()
+        self._consolidado = None
+
+    def clinica(self, nome):
+        """A clínica `nome`, criada na primeira consulta e marcada como a usada mais recentemente."""
+        with self._lock:
+            clinica = self._clinicas.get(nome)
+            if clinica is None:
+                cfg = self.configuracao[nome]
+                memoria_maxima = int(cfg["memoria_mb"] * 2**20) if cfg.get("memoria_mb") else None
+                clinica = Clinica(nome, self._abrir(cfg["origem"]), cfg.get("ttl", 60), self.intervalo_atualizacao,
+                                  ao_carregar=self._respeitar_orcamento, pasta_cache=self.pasta_cache, tempo_ocioso=self.tempo_ocioso,
+                                  memoria_maxima=memoria_maxima)
+                self._clinicas[nome] = clinica
+            self._clinicas.move_to_end(nome)
+        clinica.usar()
+        clinica.ativar()
+        return clinica
+
+    def _respeitar_orcamento(self, carregada, memoria_carregada):
+        """Descarta as clínicas menos usadas (exceto `carregada`, que acabou de ler `memoria_carregada` bytes)
+        enquanto a memória dos snapshots passar do orçamento. Roda dentro da recarga de `carregada`, por isso
+        não espera por clínicas que também estejam recarregando."""
+        with self._lock:
+            ordem = [c for c in self._clinicas.values() if c is not carregada]
+        total = sum(c.memoria() for c in ordem) + memoria_carregada
+        for clinica in ordem:
+            if total <= self.orcamento_memoria: break
+            memoria = clinica.memoria()
+            if memoria and clinica.desativar():
+                total -= memoria
+
+    def repositorio(self, nome):
+        """Repositório de snapshots de uma clínica, ou o consolidado de todas (`CONSOLIDADO`)."""
+        if nome == CONSOLIDADO:
+            with self._lock:
+                if self._consolidado is None:
+                    self._consolidado = RepositorioConsolidado(self)
+                # Quem vê o consolidado está usando todas as clínicas já abertas
+                for clinica in self._clinicas.values(): clinica.usar()
+            return self._consolidado
+        return self.clinica(nome).repositorio
+
+    def snapshots_atuais(self):
+        """Snapshot atual de cada clínica configurada (None para as que não estão carregadas), sem carregar nenhuma."""
+        with self._lock:
+            clinicas = dict(self._clinicas)
+        return {nome: clinicas[nome].repositorio.atual() if nome in clinicas else None for nome in self.nomes}
+
+    def obter_todas(self, forcar=False, completo=False):
+        """Snapshot de cada clínica, carregados em paralelo: custa o tempo da clínica mais lenta, não a soma."""
+        clinicas = [self.clinica(nome) for nome in self.nomes]
+        with ThreadPoolExecutor(max_workers=max(len(clinicas), 1), thread_name_prefix="clinflow-clinicas") as pool:
+            snapshots = list(pool.map(lambda c: c.repositorio.obter(forcar, completo), clinicas))
+        return dict(zip(self.nomes, snapshots))
+
+
+def _prefixar(serie, clinica):
+    """Nomes de procedimento/material prefixados com a clínica (cada clínica tem seus preços e seu estoque)."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie.cat.rename_categories([f"{clinica}{SEPARADOR_CLINICA}{c}" for c in serie.cat.categories])
+    return serie.map(lambda valor: f"{clinica}{SEPARADOR_CLINICA}{valor}" if isinstance(valor, str) and valor else valor)
+
+
+def consolidar(snapshots, versao):
+    """Snapshot somente leitura com os dados de todas as clínicas: a agenda ganha a coluna 'Clínica' e
+    procedimentos e materiais levam o nome da clínica, para custos, preços e estoques não se misturarem."""
+    agendas, materiais, fichas, movimentacoes = [], [], [], []
+    for nome, snap in snapshots.items():
+        agendas.append(snap.agenda.assign(**{'Procedimento Realizado': _prefixar(snap.agenda['Procedimento Realizado'], nome), 'Clínica': nome}))
+        materiais.append(snap.materiais.assign(Material=_prefixar(snap.materiais['Material'], nome)))
+        fichas.append(snap.ficha.assign(Procedimento=_prefixar(snap.ficha['Procedimento'], nome), Material=_prefixar(snap.ficha['Material'], nome)))
+        movimentacoes.append(snap.movimentacoes.assign(Material=_prefixar(snap.movimentacoes['Material'], nome)))
+    agenda = agendas[0]
+    for outra in agendas[1:]:
+        agenda = concatenar_agenda(agenda, outra)
+    return Snapshot(versao, ordenar_agenda(agenda), pd.concat(materiais, ignore_index=True),
+                    pd.concat(fichas, ignore_index=True), pd.concat(movimentacoes, ignore_index=True))
+
+
+class RepositorioConsolidado:
+    """Visão de todas as clínicas com a mesma interface de leitura do RepositorioSnapshots.
+
+    É remontada só quando a versão de alguma clínica muda; as clínicas continuam sendo atualizadas pelos seus
+    próprios atualizadores. Não aceita gravações: alterações são feitas clínica a clínica.
+    """
+
+    def __init__(self, gerenciador):
+        self.gerenciador = gerenciador
+        self._atual = None
+        self._versoes = None
+        self._lock = threading.Lock()
+
+    def _montar(self, snapshots):
+        with self._lock:
+            versoes = tuple(snap.versao for snap in snapshots.values())
+            if versoes != self._versoes:
+                self._atual = consolidar(snapshots, self._atual.versao + 1 if self._atual else 1)
+                self._versoes = versoes
+            return self._atual
+
+    def atual(self):
+        """A visão mais recente, remontada se alguma clínica publicou uma versão nova (sem carregar nenhuma)."""
+        snapshots = self.gerenciador.snapshots_atuais()
+        if self._atual is None or any(snap is None for snap in snapshots.values()):
+            return self._atual
+        return self._montar(snapshots)
+
+    def obter(self, forcar=False, completo=False):
+        return self._montar(self.gerenciador.obter_todas(forcar, completo))
+
+    def publicar(self, **tabelas):
+        raise RuntimeError("A visão consolidada é somente leitura: selecione uma clínica para alterar os dados.")
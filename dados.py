@@ -0,0 +1,571 @@
+import threading
+import time
+import numpy as np
+import pandas as pd
+from armazenamento import ABA_AGENDA, ABA_MATERIAIS, ABA_FICHA, ABA_MOVIMENTACOES, COLUNAS_MOVIMENTACOES, LINHA_INICIAL_DADOS, completar_linha, dataframe_de_valores, texto_celula
+from estoque import COLUNA_ID_ATENDIMENTO, COLUNAS_ID_LEGADO
+from ocupacao import COLUNA_DURACAO
+from metricas import etapa
+
+
+# Esquema em memória da agenda: textos repetitivos viram categorias (filtros e groupbys operam sobre os códigos),
+# o status de estoque vira booleano e a idade um float32. Na gravação o booleano volta a ser SIM/NÃO.
+COLUNAS_CATEGORICAS_AGENDA = ['Profissional Responsável', 'Procedimento Realizado', 'Nome do Cliente', 'Genero', 'Horário do Atendimento']
+FORMATOS_HORARIO = ['%H:%M:%S', '%H:%M', '%I:%M:%S %p', '%I:%M %p']
+# Formatos de data aceitos, tentados em ordem: o da planilha (dia primeiro), com ou sem hora, e o ISO (também o
+# do st.data_editor, '2026-02-05T00:00:00.000', que chegou a ser gravado assim nas células editadas)
+FORMATOS_DATA = ['%d/%m/%Y', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S']
+# Esquema de entrada de cada aba: tipo de cada coluna ('data', 'numero' ou 'texto') e se ela é obrigatória.
+# Células obrigatórias vazias e valores que não puderam ser interpretados vão para a quarentena (ver `aplicar_esquema`).
+ESQUEMAS = {
+    ABA_AGENDA: {'Data do Atendimento': ('data', True), 'Nome do Cliente': ('texto', True), 'Procedimento Realizado': ('texto', True),
+                 'Profissional Responsável': ('texto', True), 'Idade': ('numero', False)},
+    ABA_MATERIAIS: {'Material': ('texto', True), 'Preco Unitario (R$)': ('numero', True), 'Quantidade em Estoque': ('numero', False),
+                    'Estoque Mínimo': ('numero', False)},
+    ABA_FICHA: {'Procedimento': ('texto', True), 'Material': ('texto', True), 'Quantidade Usada': ('numero', True),
+                'Preco de Venda (R$)': ('numero', False), COLUNA_DURACAO: ('numero', False)},
+    ABA_MOVIMENTACOES: {'Data': ('data', True), 'Tipo': ('texto', True), 'Quantidade': ('numero', True)},
+}
+PROBLEMAS_ESQUEMA = {'data': "data inválida (use dd/mm/aaaa)", 'numero': "número inválido", 'vazio': "campo obrigatório vazio"}
+COLUNAS_QUARENTENA = ['Aba', 'Linha', 'Coluna', 'Valor', 'Problema']
+
+
+def _categoria_ordenada(serie):
+    """Categórica com as categorias em ordem alfabética, para que ordenar pela coluna siga a ordem do texto."""
+    return serie.astype(pd.CategoricalDtype(sorted(serie.dropna().unique())))
+
+
+def normalizar_horario(serie):
+    """Padroniza os horários como 'HH:MM' (ordenáveis como texto); valores que não são horário ficam como estão.
+    Os horários se repetem muito, então só os valores distintos são interpretados."""
+    texto = serie.astype('string').str.strip().replace('', pd.NA)
+    distintos = pd.Series(texto.dropna().unique(), dtype=object)
+    horario = pd.Series(pd.NaT, index=distintos.index, dtype='datetime64[ns]')
+    for formato in FORMATOS_HORARIO:
+        faltando = horario.isna()
+        if not faltando.any(): break
+        horario[faltando] = pd.to_datetime(distintos[faltando], format=formato, errors='coerce')
+    normalizados = horario.dt.strftime('%H:%M').where(horario.notna(), distintos)
+    return texto.astype(object).map(dict(zip(distintos, normalizados)))
+
+
+def converter_datas(serie, formatos=FORMATOS_DATA):
+    """Datas interpretadas com formatos explícitos, sem a inferência elemento a elemento do `dayfirst`.
+    As datas se repetem muito, então só os valores distintos são interpretados; o que não casa com nenhum formato vira NaT."""
+    if pd.api.types.is_datetime64_any_dtype(serie): return serie
+    texto = serie.astype('string').str.strip().replace('', pd.NA)
+    distintos = pd.Series(texto.dropna().unique(), dtype=object)
+    if distintos.empty: return pd.Series(pd.NaT, index=serie.index, dtype='datetime64[ns]')
+    datas = pd.Series(pd.NaT, index=distintos.index, dtype='datetime64[ns]')
+    for formato in formatos:
+        faltando = datas.isna()
+        if not faltando.any(): break
+        datas[faltando] = pd.to_datetime(distintos[faltando], format=formato, errors='coerce')
+    return texto.astype(object).map(pd.Series(datas.to_numpy(), index=distintos.to_numpy())).astype('datetime64[ns]')
+
+
+def converter_numeros(serie):
+    """Números como são digitados na planilha: valores já numéricos passam direto; textos aceitam 'R$', espaços e
+    vírgula decimal com ponto de milhar ('R$ 1.234,56' → 1234.56). Vazios e inválidos viram NaN."""
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie): return serie.astype(float)
+    texto = serie.astype('string').str.replace(r'R\$|\s', '', regex=True)
+    virgula = texto.str.contains(',', regex=False).fillna(False).to_numpy(dtype=bool)
+    texto = texto.where(~virgula, texto.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    return pd.to_numeric(texto.fillna('').astype(object), errors='coerce').astype(float)
+
+
+def aplicar_esquema(df, nome_aba, quarentena=None):
+    """Normaliza os nomes das colunas e converte as colunas declaradas em ESQUEMAS[nome_aba].
+
+    As linhas com problemas continuam nos dados (para poderem ser corrigidas pelo editor), mas cada célula
+    obrigatória vazia ou valor não interpretado é anotado em `quarentena` (lista de DataFrames com COLUNAS_QUARENTENA,
+    ver `juntar_quarentena`) em vez de virar zero em silêncio.
+    """
+    df.columns = [str(col).strip() for col in df.columns]
+    for col, (tipo, obrigatoria) in ESQUEMAS.get(nome_aba, {}).items():
+        if col not in df.columns: continue
+        bruto = df[col]
+        convertido = converter_datas(bruto) if tipo == 'data' else converter_numeros(bruto) if tipo == 'numero' else bruto
+        if quarentena is not None:
+            vazio = bruto.astype('string').str.strip().fillna('').eq('').to_numpy(dtype=bool)
+            problema = (vazio & obrigatoria) | (~vazio & convertido.isna().to_numpy())
+            if problema.any():
+                quarentena.append(pd.DataFrame({
+                    'Aba': nome_aba, 'Linha': df.index[problema], 'Coluna': col, 'Valor': bruto[problema].map(texto_celula).to_numpy(),
+                    'Problema': np.where(vazio[problema], PROBLEMAS_ESQUEMA['vazio'], PROBLEMAS_ESQUEMA.get(tipo, ''))}))
+        if tipo != 'texto': df[col] = convertido
+    return df
+
+
+def juntar_quarentena(partes):
+    """Uma tabela (COLUNAS_QUARENTENA) com os problemas anotados por `aplicar_esquema`, por aba e linha."""
+    partes = [parte for parte in partes if not parte.empty]
+    if not partes: return pd.DataFrame(columns=COLUNAS_QUARENTENA)
+    return pd.concat(partes, ignore_index=True).sort_values(['Aba', 'Linha'], kind='stable', ignore_index=True)
+
+
+def limpar_agenda(agenda, quarentena=None):
+    """Limpeza da Agenda: aplica o esquema de entrada, normaliza gênero, horário e status de estoque e aplica o esquema compacto."""
+    agenda = aplicar_esquema(agenda, ABA_AGENDA, quarentena)
+    if 'Idade' in agenda.columns: agenda['Idade'] = agenda['Idade'].astype('float32')
+    if 'Genero' in agenda.columns: agenda['Genero'] = agenda['Genero'].astype('string').str.strip().replace('', pd.NA).astype(object)
+    if 'Horário do Atendimento' in agenda.columns: agenda['Horário do Atendimento'] = normalizar_horario(agenda['Horário do Atendimento'])
+    if 'Estoque Deduzido' not in agenda.columns:
+        agenda['Estoque Deduzido'] = False
+    else:
+        # Como antes, só o que está marcado (ou vazio) como NÃO conta como pendente
+        status = agenda['Estoque Deduzido'].astype('string').str.strip().str.upper().fillna('')
+        agenda['Estoque Deduzido'] = ~status.isin(['NÃO', '']).to_numpy()
+    # Atendimentos que ainda não passaram por uma baixa não têm id (ver `atribuir_ids`)
+    agenda[COLUNA_ID_ATENDIMENTO] = agenda[COLUNA_ID_ATENDIMENTO].map(texto_celula) if COLUNA_ID_ATENDIMENTO in agenda.columns else ''
+    for col in COLUNAS_CATEGORICAS_AGENDA:
+        if col in agenda.columns: agenda[col] = _categoria_ordenada(agenda[col])
+    return agenda
+
+
+def concatenar_agenda(agenda, novas):
+    """Junta linhas novas à agenda unindo as categorias antes, para que o resultado continue categórico."""
+    agenda, novas = agenda.copy(deep=False), novas.copy(deep=False)
+    for col in COLUNAS_CATEGORICAS_AGENDA:
+        if col in agenda.columns and col in novas.columns:
+            categorias = sorted(set(agenda[col].cat.categories) | set(novas[col].cat.categories))
+            if len(categorias) != len(agenda[col].cat.categories):
+                agenda[col] = agenda[col].cat.set_categories(categorias)
+            novas[col] = novas[col].cat.set_categories(categorias)
+    return pd.concat([agenda, novas])
+
+
+def para_edicao(df):
+    """Cópia com as colunas categóricas como texto livre, para o st.data_editor não restringir às categorias existentes."""
+    categoricas = {col: object for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)}
+    return df.astype(categoricas) if categoricas else df
+
+
+def ordenar_agenda(agenda):
+    """Mantém a agenda ordenada pela data do atendimento (datas inválidas no fim), pré-requisito de `fatiar_periodo`.
+    O índice continua sendo a linha da planilha; a ordenação estável preserva a ordem de chegada dentro do mesmo dia."""
+    return agenda.sort_values('Data do Atendimento', kind='stable', na_position='last')
+
+
+def fatiar_periodo(agenda, inicio=None, fim=None):
+    """Atendimentos com data entre `inicio` e `fim` (inclusive; None = sem limite) numa agenda já ordenada.
+    Usa busca binária sobre a coluna de datas: custa O(log n + k) em vez de comparar todas as linhas."""
+    datas = agenda['Data do Atendimento']
+    i = datas.searchsorted(pd.Timestamp(inicio), side='left') if inicio is not None else 0
+    j = datas.searchsorted(pd.Timestamp(fim) + pd.Timedelta(days=1), side='left') if fim is not None else datas.notna().sum()
+    return agenda.iloc[i:j]
+
+
+def buscar_texto(df, termo, colunas):
+    """Máscara das linhas em que alguma das `colunas` contém `termo`, sem diferenciar maiúsculas.
+    Nas colunas categóricas só as categorias são comparadas, e o resultado é espalhado pelos códigos."""
+    termo = termo.strip().casefold()
+    mascara = np.zeros(len(df), dtype=bool)
+    if not termo: return ~mascara
+    for col in colunas:
+        if col not in df.columns: continue
+        serie = df[col]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            achadas = np.array([termo in str(categoria).casefold() for categoria in serie.cat.categories] + [False])
+            mascara |= achadas[serie.cat.codes.to_numpy()]  # código -1 (nulo) cai no False do fim
+        else:
+            mascara |= serie.map(texto_celula).str.casefold().str.contains(termo, regex=False).to_numpy(dtype=bool)
+    return mascara
+
+
+def montar_visao_semana(agenda, inicio, num_dias=7):
+    """Modelo da Agenda Visual: para cada dia a partir de `inicio`, a lista de atendimentos
+    (horário, cliente, procedimento, profissional) já em ordem de horário, como texto pronto para exibir."""
+    inicio = pd.Timestamp(inicio).normalize()
+    semana = fatiar_periodo(agenda, inicio, inicio + pd.Timedelta(days=num_dias - 1))
+    semana = semana.sort_values(['Data do Atendimento', 'Horário do Atendimento'], kind='stable')
+    dias = {(inicio + pd.Timedelta(days=i)).date(): [] for i in range(num_dias)}
+    colunas = ['Horário do Atendimento', 'Nome do Cliente', 'Procedimento Realizado', 'Profissional Responsável']
+    for data, *valores in zip(semana['Data do Atendimento'].dt.date, *(semana[col] for col in colunas)):
+        dias[data].append(tuple(texto_celula(valor) for valor in valores))
+    return dias
+
+
+def limpar_materiais(materiais, quarentena=None):
+    """Limpeza de Materiais: aplica o esquema de entrada, zera os valores ausentes e consolida materiais repetidos.
+
+    Sem materiais repetidos o índice continua sendo a linha da planilha (permitindo gravar só as diferenças);
+    ao consolidar repetidos o índice é renumerado e as gravações voltam a reescrever a aba inteira.
+    """
+    materiais = aplicar_esquema(materiais, ABA_MATERIAIS, quarentena)
+    for col in ['Preco Unitario (R$)', 'Quantidade em Estoque', 'Estoque Mínimo']:
+        if col in materiais.columns: materiais[col] = materiais[col].fillna(0)
+    if not materiais.empty and 'Material' in materiais.columns:
+        if materiais['Material'].dropna().duplicated().any():
+            materiais = materiais.groupby('Material', as_index=False).agg({
+                'Preco Unitario (R$)': 'first', 'Quantidade em Estoque': 'sum', 'Estoque Mínimo': 'first'
+            })
+        else:
+            materiais = materiais.dropna(subset=['Material']).sort_values('Material')
+    return materiais
+
+
+def limpar_ficha(ficha, quarentena=None):
+    """Limpeza da Ficha Técnica: aplica o esquema de entrada e zera quantidades e preços ausentes."""
+    ficha = aplicar_esquema(ficha, ABA_FICHA, quarentena)
+    ficha['Quantidade Usada'] = ficha['Quantidade Usada'].fillna(0)
+    ficha['Preco de Venda (R$)'] = ficha['Preco de Venda (R$)'].fillna(0)
+    return ficha
+
+
+def limpar_movimentacoes(movimentacoes, quarentena=None):
+    """Limpeza do livro de movimentações de estoque: datas, quantidades (com sinal) e textos."""
+    movimentacoes.columns = [str(col).strip() for col in movimentacoes.columns]
+    for col in COLUNAS_MOVIMENTACOES:
+        if col not in movimentacoes.columns: movimentacoes[col] = ''
+    movimentacoes = aplicar_esquema(movimentacoes, ABA_MOVIMENTACOES, quarentena)
+    movimentacoes['Quantidade'] = movimentacoes['Quantidade'].fillna(0)
+    for col in ['Tipo', 'Material', 'Atendimento', 'Observação']:
+        movimentacoes[col] = movimentacoes[col].map(texto_celula).str.strip()
+    return movimentacoes
+
+
+def _texto_linha(linha, tamanho):
+    """Representação textual de uma linha crua, usada para comparar a âncora entre leituras."""
+    return [str(valor) for valor in completar_linha(linha, tamanho)]
+
+
+class SincronizadorAba:
+    """Mantém uma aba que só cresce no fim limpa em memória e, a cada atualização, busca e limpa apenas as linhas novas.
+
+    As linhas novas são sempre anexadas ao fim da aba. Para detectar edições em linhas
+    antigas, a última linha já vista (âncora) é relida junto com as novas: se ela ou o cabeçalho
+    mudarem, ou se a aba encolher, é feita uma recarga completa. Como edições no meio da aba não
+    alteram a âncora, uma recarga completa também é forçada a cada `intervalo_recarga_completa` segundos.
+    """
+
+    def __init__(self, armazenamento, nome_aba, intervalo_recarga_completa=1800):
+        self.armazenamento = armazenamento
+        self.nome_aba = nome_aba
+        self.intervalo_recarga_completa = intervalo_recarga_completa
+        self.dados = None
+        # Problemas de esquema das linhas em memória (ver `aplicar_esquema`), acumulados junto com as linhas novas
+        self.quarentena = []
+        self._cabecalho = None
+        self._ancora = None
+        self._total_linhas = 0
+        self._ultima_recarga_completa = 0.0
+        self._lock = threading.Lock()
+
+    def invalidar(self):
+        """Descarta o estado incremental; a próxima sincronização recarrega a aba inteira."""
+        with self._lock:
+            self.dados = None
+
+    def adotar(self, dados, celulas=None):
+        """Adota a aba como ficou depois de uma gravação deste processo (`dados`: limpa e indexada pela linha da
+        planilha, ver `gravar_alteracoes`) sem relê-la. As linhas já sincronizadas passam a ser as de `dados`; as
+        seguintes (anexadas na gravação ou por outras pessoas) chegam na próxima sincronização incremental. `celulas`
+        ({linha: {coluna: valor}}) são as células gravadas, para acompanhar a âncora se ela foi editada. Se `dados`
+        não cobre as linhas já sincronizadas (ex.: linhas apagadas), a próxima sincronização relê a aba inteira."""
+        celulas = celulas or {}
+        with self._lock:
+            if self.dados is None: return
+            if not self.dados.index.isin(dados.index).all():
+                self.dados = None
+                return
+            ancora = LINHA_INICIAL_DADOS + self._total_linhas - 1
+            if ancora in celulas:
+                if any(col not in self._cabecalho for col in celulas[ancora]):
+                    self.dados = None
+                    return
+                self._ancora = list(self._ancora)
+                for col, valor in celulas[ancora].items():
+                    self._ancora[self._cabecalho.index(col)] = texto_celula(valor)
+            self.dados = dados[dados.index <= ancora]
+            # Células corrigidas nesta gravação saem da quarentena
+            corrigidas = {(linha, col) for linha, mudancas in celulas.items() for col in mudancas
+                          if linha in self.dados.index and col in self.dados.columns and pd.notna(self.dados.at[linha, col])}
+            if corrigidas:
+                self.quarentena = [parte[[(linha, col) not in corrigidas for linha, col in zip(parte['Linha'], parte['Coluna'])]] for parte in self.quarentena]
+
+    def limpar(self, df, quarentena=None):
+        """Limpa as linhas lidas da aba (as novas ou a aba inteira), anotando os problemas em `quarentena`."""
+        return df
+
+    def juntar(self, dados, novas):
+        """Acrescenta as linhas novas já limpas aos dados em memória."""
+        return pd.concat([dados, novas])
+
+    def pedido(self):
+        """Intervalo a ler na próxima sincronização: a aba inteira ou só a âncora e as linhas seguintes."""
+        recarga_vencida = time.monotonic() - self._ultima_recarga_completa > self.intervalo_recarga_completa
+        if self.dados is None or recarga_vencida:
+            return (self.nome_aba, 0, None)
+        return (self.nome_aba, max(self._total_linhas - 1, 0), len(self._cabecalho))
+
+    def sincronizar(self, pedido=None, valores=None):
+        """Retorna os dados atualizados. `valores` pode vir de uma leitura em lote feita com `pedido()`;
+        se não vier (ou o estado mudou desde o pedido), a leitura é feita aqui."""
+        with self._lock:
+            if valores is None or pedido != self.pedido():
+                pedido = self.pedido()
+                valores = self.armazenamento.ler_intervalos([pedido])[0]
+            if pedido[2] is None:
+                return self._recarga_completa(valores)
+            cabecalho, linhas = [str(col) for col in valores[0]], valores[1:]
+            if self._total_linhas:
+                if cabecalho != self._cabecalho or not linhas or _texto_linha(linhas[0], len(cabecalho)) != self._ancora:
+                    return self._recarga_completa(self.armazenamento.ler_linhas(self.nome_aba))
+                linhas = linhas[1:]
+            if linhas:
+                problemas = []
+                novas = self.limpar(self._montar(cabecalho, linhas, self._total_linhas), problemas)
+                self.dados = self.juntar(self.dados, novas) if not self.dados.empty else novas
+                self.quarentena = self.quarentena + problemas
+                self._registrar(cabecalho, linhas)
+            return self.dados
+
+    def _recarga_completa(self, valores):
+        cabecalho, linhas = [str(col) for col in valores[0]], valores[1:]
+        self._total_linhas = 0
+        problemas = []
+        self.dados = self.limpar(self._montar(cabecalho, linhas, 0), problemas)
+        self.quarentena = problemas
+        self._registrar(cabecalho, linhas)
+        self._ultima_recarga_completa = time.monotonic()
+        return self.dados
+
+    def _registrar(self, cabecalho, linhas):
+        self._cabecalho = cabecalho
+        self._total_linhas += len(linhas)
+        if linhas:
+            self._ancora = _texto_linha(linhas[-1], len(cabecalho))
+
+    @staticmethod
+    def _montar(cabecalho, linhas, primeira_linha):
+        """Monta o DataFrame cru mantendo o índice igual ao número da linha na planilha."""
+        df = dataframe_de_valores([cabecalho] + [completar_linha(linha, len(cabecalho)) for linha in linhas], LINHA_INICIAL_DADOS + primeira_linha)
+        return df.dropna(how='all')
+
+
+class SincronizadorAgenda(SincronizadorAba):
+    """Agenda (respostas do formulário) sincronizada de forma incremental, limpa e ordenada por data."""
+
+    def __init__(self, armazenamento, nome_aba=ABA_AGENDA, intervalo_recarga_completa=1800):
+        super().__init__(armazenamento, nome_aba, intervalo_recarga_completa)
+
+    def limpar(self, df, quarentena=None):
+        return ordenar_agenda(limpar_agenda(df, quarentena))
+
+    def juntar(self, dados, novas):
+        return ordenar_agenda(concatenar_agenda(dados, novas))
+
+
+class SincronizadorMovimentacoes(SincronizadorAba):
+    """Livro de movimentações de estoque: só recebe linhas anexadas, então é lido de forma incremental."""
+
+    def __init__(self, armazenamento, nome_aba=ABA_MOVIMENTACOES, intervalo_recarga_completa=1800):
+        super().__init__(armazenamento, nome_aba, intervalo_recarga_completa)
+
+    def limpar(self, df, quarentena=None):
+        return limpar_movimentacoes(df, quarentena)
+
+
+def carregar_dados(armazenamento, sincronizador, completo=False, sincronizador_movimentacoes=None, quarentena=None):
+    """Lê agenda (incremental), Materiais, Ficha Técnica e o livro de movimentações (incremental) numa única ida ao
+    armazenamento e devolve os quatro DataFrames limpos. Com `completo=True` agenda e livro são relidos inteiros.
+    Se `quarentena` (lista) for passada, recebe os problemas de esquema de todas as abas (ver `juntar_quarentena`)."""
+    sincronizadores = [sincronizador] + ([sincronizador_movimentacoes] if sincronizador_movimentacoes else [])
+    if completo:
+        for sinc in sincronizadores: sinc.invalidar()
+    pedidos = [sinc.pedido() for sinc in sincronizadores]
+    with etapa("carga:leitura"):
+        valores_materiais, valores_ficha, *valores = armazenamento.ler_intervalos([(ABA_MATERIAIS, 0, None), (ABA_FICHA, 0, None)] + pedidos)
+    with etapa("carga:limpeza"):
+        agenda, *movimentacoes = [sinc.sincronizar(pedido, v) for sinc, pedido, v in zip(sincronizadores, pedidos, valores)]
+        problemas = [parte for sinc in sincronizadores for parte in sinc.quarentena]
+        materiais = limpar_materiais(dataframe_de_valores(valores_materiais).dropna(how='all'), problemas)
+        ficha = limpar_ficha(dataframe_de_valores(valores_ficha).dropna(how='all'), problemas)
+    if quarentena is not None: quarentena.extend(problemas)
+    movimentacoes = movimentacoes[0] if movimentacoes else limpar_movimentacoes(pd.DataFrame(columns=COLUNAS_MOVIMENTACOES))
+    return agenda, materiais, ficha, movimentacoes
+
+
+def alinhado_com_planilha(df):
+    """Indica se o índice do DataFrame ainda corresponde às linhas da planilha (pré-requisito da gravação por diferenças)."""
+    return pd.api.types.is_integer_dtype(df.index) and df.index.is_unique and (df.empty or df.index.min() >= LINHA_INICIAL_DADOS)
+
+
+def _data_do_editor(valor):
+    """Timestamp de uma data vinda do editor (ver FORMATOS_DATA); textos que não são data ficam como estão, para irem à quarentena."""
+    if not isinstance(valor, str) or not valor.strip(): return valor
+    data = converter_datas(pd.Series([valor], dtype=object)).iloc[0]
+    return valor if pd.isna(data) else data
+
+
+def alteracoes_do_editor(df_base, estado_editor):
+    """Traduz o estado do st.data_editor (posições da tabela exibida) em (celulas, linhas_novas, linhas_removidas) por linha da planilha.
+    O editor devolve as datas editadas como texto ISO: nas colunas de data elas voltam a ser Timestamps (gravados como dd/mm/aaaa)."""
+    linhas = df_base.index
+    datas = {col for col in df_base.columns if pd.api.types.is_datetime64_any_dtype(df_base[col])}
+    def valores(mudancas):
+        return {col: _data_do_editor(valor) if col in datas else valor for col, valor in mudancas.items() if col != "_index"}
+    celulas = {linhas[int(pos)]: valores(mudancas) for pos, mudancas in estado_editor.get("edited_rows", {}).items()}
+    linhas_novas = [valores(linha) for linha in estado_editor.get("added_rows", [])]
+    linhas_removidas = [linhas[int(pos)] for pos in estado_editor.get("deleted_rows", [])]
+    return celulas, linhas_novas, linhas_removidas
+
+
+def aplicar_alteracoes(df_base, celulas=None, linhas_novas=None, linhas_removidas=None):
+    """Aplica as alterações numa cópia do DataFrame (para regravar a aba inteira ou publicar o que acabou de ser salvo)."""
+    df = df_base.copy()
+    for linha, mudancas in (celulas or {}).items():
+        for col, valor in mudancas.items():
+            if col in df.columns and isinstance(df[col].dtype, pd.CategoricalDtype) and pd.notna(valor) and valor not in df[col].cat.categories:
+                df[col] = df[col].cat.add_categories([valor])
+            df.at[linha, col] = valor
+    df = df.drop(index=list(linhas_removidas or []))
+    if alinhado_com_planilha(df_base) and linhas_removidas:
+        # Como na planilha, as linhas abaixo das removidas sobem: o índice continua sendo a linha da planilha
+        removidas = np.sort(np.unique(np.asarray(linhas_removidas, dtype=np.int64)))
+        df.index = df.index - np.searchsorted(removidas, df.index.to_numpy())
+    if linhas_novas:
+        if alinhado_com_planilha(df_base):
+            # As linhas anexadas ocupam as linhas seguintes da planilha
+            inicio = df.index.max() + 1 if not df.empty else LINHA_INICIAL_DADOS
+            df = pd.concat([df, pd.DataFrame(linhas_novas, index=pd.RangeIndex(inicio, inicio + len(linhas_novas)))])
+        else:
+            df = pd.concat([df, pd.DataFrame(linhas_novas)], ignore_index=True)
+    return df
+
+
+# Colunas que identificam uma linha de cada aba, usadas para reencontrá-la se outra pessoa alterou a aba
+CHAVES_ABAS = {ABA_AGENDA: [COLUNA_ID_ATENDIMENTO] + COLUNAS_ID_LEGADO, ABA_MATERIAIS: ['Material'], ABA_FICHA: ['Procedimento', 'Material']}
+LIMPEZA_ABAS = {ABA_AGENDA: lambda df: ordenar_agenda(limpar_agenda(df)), ABA_MATERIAIS: limpar_materiais,
+                ABA_FICHA: limpar_ficha, ABA_MOVIMENTACOES: limpar_movimentacoes}
+
+
+class ConflitoDeEdicao(Exception):
+    """Alterações em linhas que outra pessoa mudou, apagou ou duplicou depois da versão em que a edição começou."""
+
+    def __init__(self, nome_aba, linhas):
+        self.nome_aba = nome_aba
+        self.linhas = list(linhas)
+        super().__init__(f"as linhas {', '.join(str(linha) for linha in self.linhas[:10])} da aba '{nome_aba}' foram alteradas por outra pessoa")
+
+
+def _colunas_chave(nome_aba, df_base, df_atual):
+    chaves = [col for col in CHAVES_ABAS.get(nome_aba, []) if col in df_base.columns and col in df_atual.columns]
+    return chaves or [col for col in df_base.columns if col in df_atual.columns]
+
+
+def mesclar_alteracoes(nome_aba, df_base, df_atual, celulas=None, linhas_removidas=None):
+    """Reposiciona sobre `df_atual` (a aba como está agora) as alterações feitas a partir de `df_base`.
+
+    Cada linha é reencontrada pela chave da aba; se mudou de posição (ex.: outra pessoa apagou linhas acima),
+    a alteração a acompanha. Alterações de outras pessoas em outras linhas ou colunas são preservadas. Há
+    conflito se a linha sumiu ou ficou ambígua, se uma célula alterada também foi mudada por outra pessoa ou se
+    uma linha a apagar foi editada; nesse caso nada é aplicado. Linhas a apagar que já sumiram são ignoradas.
+    """
+    chaves = _colunas_chave(nome_aba, df_base, df_atual)
+    posicoes = {}
+
+    def chave(df, linha):
+        return tuple(texto_celula(df.at[linha, col]) for col in chaves)
+
+    def localizar(linha):
+        """Linhas de `df_atual` com a mesma chave da linha de `df_base` (a mesma posição primeiro, se ainda bater)."""
+        if linha in df_atual.index and chave(df_atual, linha) == chave(df_base, linha):
+            return [linha]
+        if not posicoes:
+            for atual, valores in zip(df_atual.index, zip(*(df_atual[col].map(texto_celula) for col in chaves))):
+                posicoes.setdefault(valores, []).append(atual)
+        return posicoes.get(chave(df_base, linha), [])
+
+    def mudou(destino, linha, colunas):
+        return any(texto_celula(df_atual.at[destino, col]) != texto_celula(df_base.at[linha, col])
+                   for col in colunas if col in df_base.columns and col in df_atual.columns)
+
+    conflitos, novas_celulas, novas_removidas = [], {}, []
+    for linha, mudancas in (celulas or {}).items():
+        destinos = localizar(linha)
+        if len(destinos) != 1 or mudou(destinos[0], linha, mudancas):
+            conflitos.append(linha)
+        else:
+            novas_celulas[destinos[0]] = mudancas
+    for linha in linhas_removidas or []:
+        destinos = localizar(linha)
+        if len(destinos) > 1 or (destinos and mudou(destinos[0], linha, df_base.columns)):
+            conflitos.append(linha)
+        elif destinos:
+            novas_removidas.append(destinos[0])
+    if conflitos:
+        raise ConflitoDeEdicao(nome_aba, conflitos)
+    return novas_celulas, novas_removidas
+
+
+def _em_texto(celulas, linhas_novas):
+    return ({linha: {col: texto_celula(valor) for col, valor in mudancas.items()} for linha, mudancas in celulas.items()},
+            [{col: texto_celula(valor) for col, valor in linha.items()} for linha in linhas_novas])
+
+
+def _reordenar_categorias(df):
+    """Volta a deixar em ordem alfabética as categorias que ganharam valores novos numa edição (ver `_categoria_ordenada`)."""
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            categorias = list(df[col].cat.categories)
+            if categorias != sorted(categorias): df[col] = df[col].cat.reorder_categories(sorted(categorias))
+    return df
+
+
+def _gravar_linhas_avulsas(armazenamento, nome_aba, tabela, df_base, celulas, linhas_removidas):
+    """Caminho rápido de `gravar_alteracoes`: relê só as linhas alteradas e apagadas e, se nenhuma delas mudou de
+    lugar (a chave de cada uma continua na mesma linha), mescla, grava e aplica a alteração sobre `tabela` (a aba
+    limpa em memória), com custo proporcional às linhas editadas. Devolve None se for preciso reler a aba inteira."""
+    limpar = LIMPEZA_ABAS[nome_aba]
+    linhas = sorted(set(celulas) | set(linhas_removidas))
+    bruto = dataframe_de_valores(armazenamento.ler_linhas_avulsas(nome_aba, linhas))
+    if len(bruto) != len(linhas): return None
+    bruto.index = pd.Index(linhas)
+    atual = limpar(bruto.copy())
+    chaves = _colunas_chave(nome_aba, df_base, atual)
+    if set(atual.index) != set(linhas) or any(
+            tuple(texto_celula(atual.at[linha, col]) for col in chaves) != tuple(texto_celula(df_base.at[linha, col]) for col in chaves) for linha in linhas):
+        return None
+    celulas, linhas_removidas = mesclar_alteracoes(nome_aba, df_base, atual, celulas, linhas_removidas)
+    editadas = limpar(aplicar_alteracoes(bruto.astype(object), *_em_texto(celulas, []))) if celulas else atual
+    if set(editadas.index) != set(linhas): return None
+    armazenamento.aplicar_alteracoes(nome_aba, celulas, [], linhas_removidas)
+    # As linhas editadas entram inteiras como estão agora na planilha (com eventuais mudanças de outras pessoas nelas)
+    colunas = [col for col in editadas.columns if col in tabela.columns]
+    gravado = aplicar_alteracoes(tabela, {linha: {col: editadas.at[linha, col] for col in colunas} for linha in celulas}, linhas_removidas=linhas_removidas)
+    gravado = _reordenar_categorias(gravado)
+    return ordenar_agenda(gravado) if nome_aba == ABA_AGENDA else gravado
+
+
+def gravar_alteracoes(armazenamento, nome_aba, df_base, celulas=None, linhas_novas=None, linhas_removidas=None, reler=True, tabela=None):
+    """Grava alterações feitas a partir de `df_base` (a versão que a sessão estava vendo, inteira ou só as linhas
+    exibidas) com controle otimista.
+
+    Relê só a aba alterada, mescla as alterações com o estado atual (ver `mesclar_alteracoes`; lança
+    ConflitoDeEdicao sem gravar nada se houver conflito), grava apenas as diferenças (ou a aba inteira, se ela
+    não espelha mais as linhas da planilha) e devolve a aba limpa como ficou, pronta para ser publicada.
+    Com `reler=False` (abas que só recebem linhas novas) as linhas são anexadas sem reler a aba. Com `tabela`
+    (a aba limpa inteira em memória), edições e remoções releem só as linhas tocadas (ver `_gravar_linhas_avulsas`).
+    """
+    celulas, linhas_novas, linhas_removidas = celulas or {}, linhas_novas or [], linhas_removidas or []
+    limpar = LIMPEZA_ABAS[nome_aba]
+    if not reler and not celulas and not linhas_removidas:
+        armazenamento.aplicar_alteracoes(nome_aba, linhas_novas=linhas_novas)
+        novas = limpar(pd.DataFrame(_em_texto({}, linhas_novas)[1]))
+        return aplicar_alteracoes(df_base, linhas_novas=novas.to_dict('records'))
+    if tabela is not None and not linhas_novas and (celulas or linhas_removidas) and alinhado_com_planilha(tabela) and alinhado_com_planilha(df_base):
+        gravado = _gravar_linhas_avulsas(armazenamento, nome_aba, tabela, df_base, celulas, linhas_removidas)
+        if gravado is not None: return gravado
+    bruto = dataframe_de_valores(armazenamento.ler_linhas(nome_aba)).dropna(how='all')
+    atual = limpar(bruto.copy())
+    celulas, linhas_removidas = mesclar_alteracoes(nome_aba, df_base, atual, celulas, linhas_removidas)
+    if alinhado_com_planilha(atual):
+        armazenamento.aplicar_alteracoes(nome_aba, celulas, linhas_novas, linhas_removidas)
+        gravado = aplicar_alteracoes(bruto.astype(object), *_em_texto(celulas, linhas_novas), linhas_removidas)
+    else:
+        gravado = aplicar_alteracoes(atual, celulas, linhas_novas, linhas_removidas).map(texto_celula)
+        armazenamento.salvar_aba(nome_aba, gravado)
+        gravado.index = pd.RangeIndex(LINHA_INICIAL_DADOS, LINHA_INICIAL_DADOS + len(gravado))
+    return limpar(gravado)
@@ -1,15 +1,28 @@
+import json
+import os
+from html import escape
 import pandas as pd
 import streamlit as st
 import plotly.express as px
 import gspread
-from gspread_dataframe import get_as_dataframe, set_with_dataframe
 from google.oauth2.service_account import Credentials
+from armazenamento import ABA_AGENDA, ABA_MATERIAIS, ABA_FICHA, ABA_MOVIMENTACOES, ESCOPOS_GOOGLE, criar_armazenamento, separar_origem
+from cliente_sheets import ClienteSheets
+from metricas import METRICAS, ArmazenamentoInstrumentado, etapa
+from snapshot import GrafoDerivados, no_derivado
+from clinicas import CONSOLIDADO, GerenciadorClinicas, ler_configuracao
+from cache_disco import pasta_cache_usuario
+from estoque import TIPO_REPOSICAO, TIPO_AJUSTE, COLUNA_ID_ATENDIMENTO, ids_atendimentos, atribuir_ids, atendimentos_baixados, movimentos_de_baixa, estoque_atual, status_estoque
+from ocupacao import COLUNA_DURACAO, IndiceOcupacao
+from calculos import CuboDiario, obter_modelo_custo, calcular_financeiro, calcular_analise_clientes, calcular_retencao_coortes, projetar_estoque
+from dados import ConflitoDeEdicao, buscar_texto, fatiar_periodo, alteracoes_do_editor, gravar_alteracoes, para_edicao, montar_visao_semana
 from datetime import datetime, timedelta
 import plotly.graph_objects as go
 from datetime import datetime
 
 
 st.set_page_config(page_title="Gestão da Clínica", page_icon="🩺", layout="wide")
+METRICAS.iniciar_rodada()
 
 
 st.markdown("""
@@ -79,161 +92,295 @@ st.markdown("""
 
 
 @st.cache_data
-def get_color_map(_profissionais):
+def get_color_map(profissionais):
     """Cria um mapa de cores consistente para cada profissional."""
     colors = ["#FF4B4B", "#17A2B8", "#FFC107", "#28A745", "#6F42C1", "#FD7E14", "#7928CA"]
-    return {prof: colors[i % len(colors)] for i, prof in enumerate(_profissionais)}
+    return {prof: colors[i % len(colors)] for i, prof in enumerate(profissionais)}
 
-@st.cache_resource(ttl=300)
+def html_coluna_agenda(titulo, atendimentos, color_map):
+    """Cabeçalho e cartões de atendimento de uma coluna da Agenda Visual num único bloco HTML (um st.markdown por coluna)."""
+    cartoes = "".join(f"""<div style="border: 1px solid rgba(128, 128, 128, 0.3); border-radius: 8px; padding: 8px; margin-bottom: 8px;"><div style="border-left: 5px solid {color_map.get(prof, '#808080')}; padding-left: 10px; border-radius: 5px;"><strong>⏰ {escape(horario)}</strong><br>👤 {escape(cliente)}<br><small><i>{escape(procedimento)}</i></small></div></div>"""
+                      for horario, cliente, procedimento, prof in atendimentos)
+    return f"""{titulo}<hr style="margin: 8px 0 12px 0;">{cartoes or "<p style='opacity: 0.6;'><small>Sem agendamentos</small></p>"}"""
 
-
-@st.cache_resource(ttl=300)
+@st.cache_resource
 def conectar_gspread():
-    """Conecta ao Google Sheets de forma segura."""
+    """Conecta ao Google Sheets de forma segura. O cliente é único no processo, para que todas as clínicas e
+    sessões dividam o mesmo limite de requisições; falhas não ficam em cache e são tentadas de novo."""
     try:
         creds_dict = st.secrets["gcp_service_account"]
-        creds = Credentials.from_service_account_info(creds_dict, scopes=['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive'])
-        return gspread.authorize(creds)
+        creds = Credentials.from_service_account_info(creds_dict, scopes=ESCOPOS_GOOGLE)
     except (FileNotFoundError, KeyError):
-        
         try:
-            creds = Credentials.from_service_account_file(".streamlit/credentials.json", scopes=['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive'])
-            return gspread.authorize(creds)
+            creds = Credentials.from_service_account_file(".streamlit/credentials.json", scopes=ESCOPOS_GOOGLE)
         except FileNotFoundError:
-            st.error("ERRO: Arquivo 'credentials.json' não encontrado. Configure os secrets no Streamlit Cloud.")
-            return None
+            raise RuntimeError("arquivo 'credentials.json' não encontrado. Configure os secrets no Streamlit Cloud.")
         except Exception as e:
-            st.error(f"Erro de autenticação com Google: {e}")
-            return None
-
-@st.cache_data(ttl=60)
-def carregar_dados_online(_client, nome_planilha):
-    """Carrega, limpa e prepara os dados das 3 abas da Planilha Google."""
+            raise RuntimeError(f"erro de autenticação com Google: {e}")
+    return ClienteSheets(gspread.authorize(creds), REQUISICOES_SHEETS_POR_MINUTO, registrar=METRICAS.registrar_chamada)
+
+def abrir_armazenamento_clinica(origem):
+    """Cria o backend de uma clínica a partir da origem configurada (Planilha Google ou SQLite local), com as chamadas medidas."""
+    backend, nome = separar_origem(origem)
+    if backend == "gsheets":
+        return ArmazenamentoInstrumentado(criar_armazenamento(backend, client=conectar_gspread(), nome_planilha=nome))
+    return ArmazenamentoInstrumentado(criar_armazenamento(backend, caminho=nome))
+
+@st.cache_resource
+def obter_gerenciador(configuracao_json, orcamento_memoria, intervalo, pasta_cache):
+    """Clínicas servidas pelo processo (uma instância por configuração): snapshot, ttl e atualizador de cada uma."""
+    return GerenciadorClinicas(json.loads(configuracao_json), abrir_armazenamento_clinica, orcamento_memoria, intervalo, pasta_cache)
+
+def carregar_snapshot(repositorio, forcar=False, completo=False):
+    """Obtém o snapshot atual dos dados (as 3 abas limpas), carregando-o numa única leitura se necessário."""
     try:
-        spreadsheet = _client.open(nome_planilha)
-        agenda = get_as_dataframe(spreadsheet.worksheet("Respostas ao formulário 1"), evaluate_formulas=True, header=0).dropna(how='all')
-        materiais = get_as_dataframe(spreadsheet.worksheet("Materiais"), evaluate_formulas=True, header=0).dropna(how='all')
-        ficha = get_as_dataframe(spreadsheet.worksheet("Ficha Técnica"), evaluate_formulas=True, header=0).dropna(how='all')
-        
-        # Limpeza da Agenda
-        agenda.columns = [str(col).strip() for col in agenda.columns]
-        agenda['Data do Atendimento'] = pd.to_datetime(agenda['Data do Atendimento'], dayfirst=True, errors='coerce')
-        if 'Idade' in agenda.columns: agenda['Idade'] = pd.to_numeric(agenda['Idade'], errors='coerce')
-        if 'Genero' in agenda.columns: agenda['Genero'] = agenda['Genero'].astype(str).str.strip()
-        if 'Estoque Deduzido' not in agenda.columns:
-            agenda['Estoque Deduzido'] = 'NÃO'
-        else:
-            agenda['Estoque Deduzido'] = agenda['Estoque Deduzido'].fillna('NÃO').astype(str).str.strip().str.upper()
-            agenda.loc[agenda['Estoque Deduzido'] == '', 'Estoque Deduzido'] = 'NÃO'
-        
-        # Limpeza de Materiais 
-        materiais.columns = [str(col).strip() for col in materiais.columns]
-        materiais['Preco Unitario (R$)'] = pd.to_numeric(materiais['Preco Unitario (R$)'], errors='coerce').fillna(0)
-        if 'Quantidade em Estoque' in materiais.columns: materiais['Quantidade em Estoque'] = pd.to_numeric(materiais['Quantidade em Estoque'], errors='coerce').fillna(0)
-        if 'Estoque Mínimo' in materiais.columns: materiais['Estoque Mínimo'] = pd.to_numeric(materiais['Estoque Mínimo'], errors='coerce').fillna(0)
-        if not materiais.empty and 'Material' in materiais.columns:
-            materiais = materiais.groupby('Material', as_index=False).agg({
-                'Preco Unitario (R$)': 'first', 'Quantidade em Estoque': 'sum', 'Estoque Mínimo': 'first'
-            })
-        
-        # Limpeza da Ficha Técnica
-        ficha.columns = [str(col).strip() for col in ficha.columns]
-        ficha['Quantidade Usada'] = pd.to_numeric(ficha['Quantidade Usada'], errors='coerce').fillna(0)
-        ficha['Preco de Venda (R$)'] = pd.to_numeric(ficha['Preco de Venda (R$)'], errors='coerce').fillna(0)
-        
-        return agenda, materiais, ficha
+        return repositorio.obter(forcar, completo)
     except Exception as e:
-        st.error(f"Ocorreu um erro ao carregar dados da Planilha: {e}")
-        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
-
-def salvar_dados_gsheet(client, nome_planilha, nome_aba, df_para_salvar):
-    """Função centralizada e segura para salvar dataframes no Google Sheets."""
-    with st.spinner(f"Salvando dados na aba '{nome_aba}'..."):
+        st.error(f"Ocorreu um erro ao carregar dados do armazenamento: {e}")
+        return None
+
+# Atributo do snapshot que guarda cada aba
+TABELAS_SNAPSHOT = {ABA_AGENDA: 'agenda', ABA_MATERIAIS: 'materiais', ABA_FICHA: 'ficha', ABA_MOVIMENTACOES: 'movimentacoes'}
+
+def salvar_alteracoes(nome_aba, df_base, celulas=None, linhas_novas=None, linhas_removidas=None, reler=True, tabela=None):
+    """Grava as alterações feitas sobre `df_base` (a versão dos dados que a sessão estava vendo) e publica a aba
+    como ficou para todas as sessões, sem recarregar as demais. Alterações de outras pessoas em outras linhas são
+    mescladas; se tocarem as mesmas linhas, nada é gravado e a sessão é avisada (ver `gravar_alteracoes`).
+    Com `tabela` (a aba inteira, quando `df_base` é só uma página dela) só as linhas tocadas são relidas."""
+    with st.spinner(f"Salvando alterações na aba '{nome_aba}'..."):
         try:
-            worksheet = client.open(nome_planilha).worksheet(nome_aba)
-            df_limpo = df_para_salvar.astype(str).replace(['nan', 'NaT', '<NA>', 'None'], '')
-            set_with_dataframe(worksheet, df_limpo, include_index=False, resize=True)
-            st.toast(f"✅ Dados da aba '{nome_aba}' salvos com sucesso!", icon="🎉")
-            return True
+            with etapa(f"gravacao:{nome_aba}"):
+                gravado = gravar_alteracoes(armazenamento, nome_aba, df_base, celulas, linhas_novas, linhas_removidas, reler, tabela)
+        except ConflitoDeEdicao as e:
+            st.error(f"Não foi possível salvar: {e}. Clique em 'Recarregar Dados da Nuvem' e refaça a edição.")
+            return False
         except Exception as e:
+            # A gravação pode ter ficado pela metade: a próxima sincronização relê a aba inteira
+            if nome_aba in sincronizadores: sincronizadores[nome_aba].invalidar()
             st.error(f"Falha ao salvar na aba '{nome_aba}': {e}")
             return False
-
-def calcular_financeiro(df_agenda, materiais, ficha_tecnica):
-    """Função vetorizada para calcular finanças e consumo."""
-    if df_agenda.empty: return pd.DataFrame(), pd.DataFrame(), df_agenda.copy()
-    custo_map = ficha_tecnica.merge(materiais, on='Material', how='left').fillna(0)
-    custo_map['Custo_Item'] = custo_map['Quantidade Usada'] * custo_map['Preco Unitario (R$)']
-    custo_final_map = custo_map.groupby('Procedimento')['Custo_Item'].sum()
-    preco_map = ficha_tecnica.drop_duplicates(subset=['Procedimento']).set_index('Procedimento')['Preco de Venda (R$)']
-    agenda_com_calculos = df_agenda.copy()
-    agenda_com_calculos['Custo Atendimento (R$)'] = agenda_com_calculos['Procedimento Realizado'].map(custo_final_map).fillna(0)
-    agenda_com_calculos['Preco Venda (R$)'] = agenda_com_calculos['Procedimento Realizado'].map(preco_map).fillna(0)
-    agenda_com_calculos['Lucro Atendimento (R$)'] = agenda_com_calculos['Preco Venda (R$)'] - agenda_com_calculos['Custo Atendimento (R$)']
-    df_financeiro = agenda_com_calculos.groupby('Procedimento Realizado').agg(Qtd_Realizada=('Procedimento Realizado', 'count'), Receita_Total_RS=('Preco Venda (R$)', 'sum'), Custo_Total_RS=('Custo Atendimento (R$)', 'sum'), Lucro_Total_RS=('Lucro Atendimento (R$)', 'sum')).reset_index().rename(columns={'Procedimento Realizado': 'Procedimento', 'Receita_Total_RS': 'Receita Total (R$)', 'Custo_Total_RS': 'Custo Total (R$)', 'Lucro_Total_RS': 'Lucro Total (R$)', 'Qtd_Realizada': 'Qtd Realizada'})
-    consumo_agenda = agenda_com_calculos.merge(ficha_tecnica[['Procedimento', 'Material', 'Quantidade Usada']], left_on='Procedimento Realizado', right_on='Procedimento', how='left')
-    df_consumo = consumo_agenda.groupby('Material')['Quantidade Usada'].sum().reset_index()
-    if not df_consumo.empty:
-        df_consumo = pd.merge(df_consumo, materiais, on='Material', how='left').fillna(0)
-        df_consumo['Custo Total (R$)'] = df_consumo['Quantidade Usada'] * df_consumo['Preco Unitario (R$)']
-    return df_financeiro, df_consumo, agenda_com_calculos
-
-def calcular_analise_clientes(agenda_com_preco):
-    """Calcula as métricas de CRM por cliente."""
-    if agenda_com_preco.empty or 'Nome do Cliente' not in agenda_com_preco.columns: return pd.DataFrame()
-    analise_clientes = agenda_com_preco.groupby('Nome do Cliente').agg(Total_Gasto_RS=('Preco Venda (R$)', 'sum'), Total_Visitas=('Data do Atendimento', 'count'), Ultima_Visita=('Data do Atendimento', 'max')).reset_index().rename(columns={'Nome do Cliente': 'Cliente','Total_Gasto_RS': 'Total Gasto (R$)','Total_Visitas': 'Nº de Visitas','Ultima_Visita': 'Última Visita'})
-    if 'Idade' in agenda_com_preco.columns:
-        idade_map = agenda_com_preco.dropna(subset=['Idade']).groupby('Nome do Cliente')['Idade'].first()
-        analise_clientes = analise_clientes.merge(idade_map, left_on='Cliente', right_index=True, how='left')
-    if 'Genero' in agenda_com_preco.columns:
-        genero_map = agenda_com_preco.dropna(subset=['Genero']).groupby('Nome do Cliente')['Genero'].first()
-        analise_clientes = analise_clientes.merge(genero_map, left_on='Cliente', right_index=True, how='left')
-    analise_clientes['Ticket Médio (R$)'] = analise_clientes.apply(lambda row: row['Total Gasto (R$)'] / row['Nº de Visitas'] if row['Nº de Visitas'] > 0 else 0, axis=1)
-    analise_clientes = analise_clientes.sort_values(by='Total Gasto (R$)', ascending=False)
-    col_order = ['Cliente', 'Total Gasto (R$)', 'Nº de Visitas', 'Ticket Médio (R$)'];
-    if 'Idade' in analise_clientes.columns: col_order.append('Idade')
-    if 'Genero' in analise_clientes.columns: col_order.append('Genero')
-    col_order.append('Última Visita')
-    return analise_clientes.reindex(columns=col_order).fillna('')
+    if reler and nome_aba in sincronizadores:
+        # A sincronização incremental continua da aba como foi gravada; linhas apagadas mudam a numeração e pedem uma releitura
+        if linhas_removidas: sincronizadores[nome_aba].invalidar()
+        else: sincronizadores[nome_aba].adotar(gravado, celulas)
+    adotar_snapshot(repositorio.publicar(**{TABELAS_SNAPSHOT[nome_aba]: gravado}))
+    st.toast(f"✅ Dados da aba '{nome_aba}' salvos com sucesso!", icon="🎉")
+    return True
+
+
+# Dados derivados de cada snapshot, calculados só quando a página exibida os pede (ver GrafoDerivados)
+NOS_DERIVADOS = {}
+FILTROS = ('inicio', 'fim', 'profissionais', 'procedimentos')
+
+@no_derivado(NOS_DERIVADOS)
+def opcoes_profissionais(grafo):
+    return sorted(grafo.snapshot.agenda['Profissional Responsável'].dropna().unique())
+
+@no_derivado(NOS_DERIVADOS)
+def opcoes_procedimentos(grafo):
+    return sorted(grafo.snapshot.agenda['Procedimento Realizado'].dropna().unique())
+
+@no_derivado(NOS_DERIVADOS)
+def modelo_custo(grafo):
+    return obter_modelo_custo(grafo.snapshot.materiais, grafo.snapshot.ficha)
+
+@no_derivado(NOS_DERIVADOS)
+def cubo_diario(grafo):
+    return CuboDiario(grafo.snapshot.agenda, grafo['modelo_custo'])
+
+@no_derivado(NOS_DERIVADOS, *FILTROS)
+def agenda_filtrada(grafo):
+    p = grafo.parametros
+    agenda_periodo = fatiar_periodo(grafo.snapshot.agenda, p['inicio'], p['fim'])
+    return agenda_periodo[agenda_periodo['Profissional Responsável'].isin(p['profissionais']) & agenda_periodo['Procedimento Realizado'].isin(p['procedimentos'])]
+
+@no_derivado(NOS_DERIVADOS, *FILTROS)
+def financeiro(grafo):
+    """(df_financeiro, df_consumo, agenda_com_preco) do período e filtros selecionados."""
+    return calcular_financeiro(grafo['agenda_filtrada'], grafo.snapshot.materiais, grafo.snapshot.ficha)
+
+@no_derivado(NOS_DERIVADOS, *FILTROS)
+def kpis_periodo(grafo):
+    p = grafo.parametros
+    return grafo['cubo_diario'].totais(p['inicio'], p['fim'], p['profissionais'], p['procedimentos'])
+
+@no_derivado(NOS_DERIVADOS, 'inicio', 'fim')
+def kpis_periodo_anterior(grafo):
+    """Totais do período de mesma duração imediatamente anterior (sem os filtros de profissional/procedimento)."""
+    inicio, fim = grafo.parametros['inicio'], grafo.parametros['fim']
+    duracao_periodo = max((fim - inicio).days, 1)
+    return grafo['cubo_diario'].totais(inicio - timedelta(days=duracao_periodo), inicio - timedelta(days=1))
+
+@no_derivado(NOS_DERIVADOS, *FILTROS)
+def faturamento_mensal(grafo):
+    p = grafo.parametros
+    return grafo['cubo_diario'].por_mes(p['inicio'], p['fim'], p['profissionais'], p['procedimentos'])
+
+@no_derivado(NOS_DERIVADOS, *FILTROS)
+def crm(grafo):
+    """(análise por cliente, retenção por coorte) do período e filtros selecionados."""
+    return calcular_analise_clientes(grafo['financeiro'][2], grafo.parametros['fim']), calcular_retencao_coortes(grafo['agenda_filtrada'])
+
+@no_derivado(NOS_DERIVADOS)
+def estoque_atual_materiais(grafo):
+    """Materiais com a 'Quantidade em Estoque' atual: saldo inicial da aba mais o livro de movimentações."""
+    return estoque_atual(grafo.snapshot.materiais, grafo.snapshot.movimentacoes)
+
+@no_derivado(NOS_DERIVADOS, 'hoje')
+def ids_agenda_passada(grafo):
+    """(atendimentos passados, seus ids): o gravado na agenda ou o antigo de uma baixa já no livro ('' nos demais)."""
+    agenda_passada = fatiar_periodo(grafo.snapshot.agenda, fim=grafo.parametros['hoje'] - timedelta(days=1))
+    return agenda_passada, ids_atendimentos(agenda_passada, atendimentos_baixados(grafo.snapshot.movimentacoes))
+
+@no_derivado(NOS_DERIVADOS, 'hoje')
+def atendimentos_pendentes(grafo):
+    """(atendimentos passados sem baixa, seus ids): nem marcados como deduzidos (baixas antigas) nem presentes no livro."""
+    agenda_passada, ids = grafo['ids_agenda_passada']
+    pendentes = ~agenda_passada['Estoque Deduzido'] & ~ids.isin(atendimentos_baixados(grafo.snapshot.movimentacoes))
+    return agenda_passada[pendentes], ids[pendentes]
+
+@no_derivado(NOS_DERIVADOS, 'hoje')
+def baixa_pendente(grafo):
+    """(atendimentos passados sem baixa de estoque, consumo de materiais deles)."""
+    pendentes, _ = grafo['atendimentos_pendentes']
+    return pendentes, calcular_financeiro(pendentes, grafo.snapshot.materiais, grafo.snapshot.ficha)[1]
+
+@no_derivado(NOS_DERIVADOS, 'semana')
+def visao_semana(grafo):
+    """{dia: [(horário, cliente, procedimento, profissional), ...]} da semana que começa em `semana`."""
+    return montar_visao_semana(grafo.snapshot.agenda, grafo.parametros['semana'])
+
+@no_derivado(NOS_DERIVADOS)
+def indice_ocupacao(grafo):
+    """Intervalos de cada profissional (horário + duração do procedimento), para sobreposições e horários livres."""
+    return IndiceOcupacao(grafo.snapshot.agenda, grafo.snapshot.ficha)
+
+@no_derivado(NOS_DERIVADOS, 'hoje')
+def projecao_estoque(grafo):
+    return projetar_estoque(grafo.snapshot.agenda, grafo['estoque_atual_materiais'], grafo['modelo_custo'], grafo.parametros['hoje'], grafo['atendimentos_pendentes'][0])
 
 
 NOME_PLANILHA = "Banco de Dados - Clínica"
-client = conectar_gspread()
-TEMPO_ATUALIZACAO_SEGUNDOS = 10  
-
-# if "ultima_atualizacao" not in st.session_state:      #Codigo Bugado 
-#     st.session_state.ultima_atualizacao = datetime.now()
-# else:
-#     tempo_passado = (datetime.now() - st.session_state.ultima_atualizacao).total_seconds()
-#     if tempo_passado > TEMPO_ATUALIZACAO_SEGUNDOS:
-#         st.session_state.ultima_atualizacao = datetime.now()
-#         st.cache_data.clear()
-#         st.cache_resource.clear()
-#         st.rerun() 
-if 'agenda' not in st.session_state and client:
-    st.session_state.agenda, st.session_state.materiais, st.session_state.ficha = carregar_dados_online(client, NOME_PLANILHA)
+# Backend de dados: "gsheets" (padrão) ou "sqlite" para rodar offline sobre um banco local
+BACKEND_ARMAZENAMENTO = os.environ.get("CLINFLOW_ARMAZENAMENTO", "gsheets")
+CAMINHO_BANCO_LOCAL = os.environ.get("CLINFLOW_BANCO_LOCAL", "clinflow.db")
+ORIGEM_PADRAO = f"sqlite:{CAMINHO_BANCO_LOCAL}" if BACKEND_ARMAZENAMENTO == "sqlite" else f"gsheets:{NOME_PLANILHA}"
+# Várias clínicas: JSON (ou caminho de um arquivo JSON) {"Nome": {"origem": "gsheets:<planilha>" | "sqlite:<arquivo>", "ttl": 60}}
+CLINICAS = ler_configuracao(os.environ.get("CLINFLOW_CLINICAS", ""), {NOME_PLANILHA: ORIGEM_PADRAO})
+# Memória máxima somada dos snapshots das clínicas; acima dela as menos usadas são descartadas
+ORCAMENTO_MEMORIA_MB = int(os.environ.get("CLINFLOW_MEMORIA_MB", "1024"))
+# Requisições por minuto ao Google Sheets somando todas as sessões e clínicas (a cota padrão de leitura é 60 por usuário)
+REQUISICOES_SHEETS_POR_MINUTO = int(os.environ.get("CLINFLOW_SHEETS_RPM", "60"))
+TEMPO_ATUALIZACAO_SEGUNDOS = 10
+# Pasta do cache em disco da partida a quente (requer pyarrow), por padrão no cache do usuário; vazio desliga
+PASTA_CACHE_DISCO = os.environ.get("CLINFLOW_CACHE_DISCO", pasta_cache_usuario())
+# Arquivo local de métricas: '.prom' (texto do Prometheus, reescrito) ou JSON (uma linha por exportação, com rotação)
+CAMINHO_METRICAS = os.environ.get("CLINFLOW_METRICAS", "clinflow_metricas.jsonl")
+
+gerenciador = obter_gerenciador(json.dumps(CLINICAS, sort_keys=True), ORCAMENTO_MEMORIA_MB << 20, TEMPO_ATUALIZACAO_SEGUNDOS, PASTA_CACHE_DISCO)
+opcoes_clinicas = gerenciador.nomes + ([CONSOLIDADO] if len(gerenciador.nomes) > 1 else [])
+clinica_selecionada = st.sidebar.selectbox("Clínica", opcoes_clinicas, key="clinica_selecionada") if len(opcoes_clinicas) > 1 else opcoes_clinicas[0]
+# A visão consolidada é somente leitura: baixas, ajustes de estoque e cadastros são feitos clínica a clínica
+consolidado = clinica_selecionada == CONSOLIDADO
+try:
+    clinica = None if consolidado else gerenciador.clinica(clinica_selecionada)
+    repositorio = clinica.repositorio if clinica else gerenciador.repositorio(CONSOLIDADO)
+except Exception as e:
+    st.error(f"Não foi possível conectar à clínica '{clinica_selecionada}': {e}")
+    clinica = repositorio = None
+armazenamento = clinica.armazenamento if clinica else None
+sincronizadores = clinica.sincronizadores if clinica else {}
+
+def adotar_snapshot(snapshot_novo):
+    """Aponta a sessão para outra versão do snapshot compartilhado (da clínica selecionada)."""
+    st.session_state.snapshot, st.session_state.versao_dados = snapshot_novo, snapshot_novo.versao
+    st.session_state.clinica = clinica_selecionada
+
+# Cada sessão guarda só a referência ao snapshot compartilhado e a sua versão, nunca uma cópia dos dados
+if repositorio and ('snapshot' not in st.session_state or st.session_state.get('clinica') != clinica_selecionada):
+    st.session_state.pop('snapshot', None)
+    snapshot_carregado = carregar_snapshot(repositorio)
+    if snapshot_carregado is not None: adotar_snapshot(snapshot_carregado)
 
 def recarregar():
-    keys_to_keep = ['client']
-    for key in list(st.session_state.keys()):
-        if key not in keys_to_keep:
-            del st.session_state[key]
-    st.cache_data.clear(); st.cache_resource.clear(); st.rerun()
+    """Relê todas as abas e publica a nova versão para todas as sessões, sem limpar os caches dos outros usuários."""
+    if repositorio is None:
+        # Sem conexão ainda: descarta os recursos para tentar autenticar de novo
+        st.cache_resource.clear(); st.rerun()
+    snapshot_novo = carregar_snapshot(repositorio, forcar=True, completo=True)
+    if snapshot_novo is not None: adotar_snapshot(snapshot_novo)
+    st.rerun()
+
+def registrar_movimentacoes(movimentos):
+    """Anexa movimentações ao livro de estoque numa única gravação, sem reler a aba: o livro só cresce, então não há
+    o que mesclar. As linhas entram sobre a versão mais nova publicada, para não descartar o que outra sessão anexou."""
+    return salvar_alteracoes(ABA_MOVIMENTACOES, repositorio.atual().movimentacoes, linhas_novas=movimentos, reler=False)
+
+TAMANHO_PAGINA = 50
+
+def editor_paginado(nome_aba, tabela, rotulo, colunas_busca, filtros_agenda=False):
+    """Editor de uma aba grande: busca, filtros e paginação rodam no servidor e só a página exibida vai para o
+    navegador. As alterações são identificadas pela linha da planilha (o índice) e salvas relendo só as linhas tocadas."""
+    chave = f"{nome_aba}:{clinica_selecionada}"
+    colunas_filtro = st.columns([2, 2, 2]) if filtros_agenda else [st]
+    busca = colunas_filtro[0].text_input("🔎 Buscar", key=f"busca:{chave}", placeholder=", ".join(colunas_busca))
+    selecao, periodo, profissionais = tabela, (), []
+    if filtros_agenda:
+        periodo = colunas_filtro[1].date_input("Período", value=(), format="DD/MM/YYYY", key=f"periodo:{chave}")
+        if len(periodo) == 2: selecao = fatiar_periodo(selecao, *periodo)
+        profissionais = colunas_filtro[2].multiselect("Profissional", grafo['opcoes_profissionais'], key=f"profissionais:{chave}")
+        if profissionais: selecao = selecao[selecao['Profissional Responsável'].isin(profissionais)]
+    if busca.strip(): selecao = selecao[buscar_texto(selecao, busca, colunas_busca)]
+    total_paginas = max(1, -(-len(selecao) // TAMANHO_PAGINA))
+    # A chave inclui o total de páginas: quando a busca ou os filtros mudam o total, o editor volta para a página 1
+    pagina = st.number_input(f"Página (de {total_paginas})", min_value=1, max_value=total_paginas, step=1, key=f"pagina:{chave}:{total_paginas}")
+    pagina_df = selecao.iloc[(pagina - 1) * TAMANHO_PAGINA:pagina * TAMANHO_PAGINA]
+    st.caption(f"{len(selecao)} de {len(tabela)} linhas encontradas. Salve as alterações antes de trocar de página ou de filtro.")
+    # Cada página, filtro e versão dos dados tem o seu estado de edição, que guarda posições da página exibida
+    chave_editor = f"{nome_aba}_editor:{clinica_selecionada}:{snapshot.versao}:{busca}|{periodo}|{profissionais}|{pagina}"
+    # O id do atendimento identifica as baixas no livro de estoque e não pode ser editado
+    st.data_editor(para_edicao(pagina_df), num_rows="dynamic", use_container_width=True, key=chave_editor,
+                   disabled=[COLUNA_ID_ATENDIMENTO] if COLUNA_ID_ATENDIMENTO in pagina_df.columns else False)
+    if st.button(f"Salvar Alterações {rotulo}", use_container_width=True):
+     try:
+        celulas, linhas_novas, linhas_removidas = alteracoes_do_editor(pagina_df, st.session_state[chave_editor])
+        if salvar_alteracoes(nome_aba, pagina_df, celulas, linhas_novas, linhas_removidas, tabela=tabela):
+            st.rerun()
+     except Exception as e:
+        st.error(f"Erro ao processar alterações {rotulo.lower()}: {e}")
 
 st.sidebar.title("Navegação")
 pagina_selecionada = st.sidebar.radio("Escolha uma página:", ["📊 Dashboard", "🗓️ Agenda Visual", "📦 Baixa Material", "📊 Status do Estoque", "⚙️ Configurações"], label_visibility="collapsed")
 if st.sidebar.button("Recarregar Dados da Nuvem", use_container_width=True, type="primary"):
     recarregar()
+diagnostico_ativo = st.sidebar.toggle("🔍 Diagnóstico", key="diagnostico_ativo")
 
-if "agenda" not in st.session_state:
+if "snapshot" not in st.session_state:
     st.info("Clique em 'Recarregar Dados da Nuvem' para iniciar o sistema.")
     st.stop()
-if st.session_state.agenda.empty:
+snapshot = st.session_state.snapshot
+
+@st.fragment(run_every=TEMPO_ATUALIZACAO_SEGUNDOS)
+def acompanhar_atualizacoes():
+    """Aplica à sessão a versão mais nova publicada pelo atualizador; em Configurações apenas avisa, para não perder edições."""
+    atual = repositorio.atual()
+    if atual is None or atual.versao == st.session_state.versao_dados: return
+    if pagina_selecionada == "⚙️ Configurações":
+        st.caption("🔄 Há dados novos na nuvem.")
+        if not st.button("Aplicar dados novos", use_container_width=True): return
+    adotar_snapshot(atual)
+    st.rerun()
+
+with st.sidebar:
+    acompanhar_atualizacoes()
+
+if snapshot.agenda.empty:
     st.warning("Sua planilha de agendamentos está vazia. Adicione dados através do Google Forms para começar a análise.")
     st.stop()
 
 
-profissionais_unicos = sorted(st.session_state.agenda['Profissional Responsável'].dropna().unique())
+grafo = GrafoDerivados(snapshot, NOS_DERIVADOS, hoje=datetime.now().date())
+profissionais_unicos = grafo['opcoes_profissionais']
 color_map = get_color_map(profissionais_unicos)
 with st.sidebar.expander("📅 Período de Análise", expanded=True):
     periodo_opts = ["Hoje", "Este Mês", "Mês Passado", "Este Ano", "Últimos 7 dias", "Últimos 30 dias", "Personalizado..."]
@@ -246,16 +393,15 @@ with st.sidebar.expander("📅 Período de Análise", expanded=True):
     elif periodo_selecionado == "Últimos 7 dias": data_inicio, data_fim = today - timedelta(days=6), today
     elif periodo_selecionado == "Últimos 30 dias": data_inicio, data_fim = today - timedelta(days=29), today
     else: 
-        min_data, max_data = st.session_state.agenda['Data do Atendimento'].dropna().min().date(), st.session_state.agenda['Data do Atendimento'].dropna().max().date()
+        min_data, max_data = snapshot.agenda['Data do Atendimento'].dropna().min().date(), snapshot.agenda['Data do Atendimento'].dropna().max().date()
         date_range_value = st.date_input("Selecione o Período Personalizado", [min_data, max_data], min_value=min_data, max_value=max_data)
         if isinstance(date_range_value, (list, tuple)) and len(date_range_value) == 2: data_inicio, data_fim = date_range_value
         else: data_inicio = data_fim = date_range_value
 with st.sidebar.expander("Outros Filtros"):
     profissionais_selecionados = st.multiselect("Profissionais", profissionais_unicos, default=profissionais_unicos)
-    procedimentos_selecionados = st.multiselect("Procedimentos", sorted(st.session_state.agenda['Procedimento Realizado'].dropna().unique()), default=sorted(st.session_state.agenda['Procedimento Realizado'].dropna().unique()))
-
-agenda_filtrada = st.session_state.agenda[(st.session_state.agenda['Data do Atendimento'].dt.date >= data_inicio) & (st.session_state.agenda['Data do Atendimento'].dt.date <= data_fim) & (st.session_state.agenda['Profissional Responsável'].isin(profissionais_selecionados)) & (st.session_state.agenda['Procedimento Realizado'].isin(procedimentos_selecionados))]
-df_financeiro, df_consumo, agenda_com_preco_filtrada = calcular_financeiro(agenda_filtrada, st.session_state.materiais, st.session_state.ficha)
+    procedimentos_selecionados = st.multiselect("Procedimentos", grafo['opcoes_procedimentos'], default=grafo['opcoes_procedimentos'])
+# Só os parâmetros: cada página pede ao grafo apenas os dados que exibe
+grafo.parametros.update(inicio=data_inicio, fim=data_fim, profissionais=tuple(profissionais_selecionados), procedimentos=tuple(procedimentos_selecionados))
 
 if pagina_selecionada == "📊 Dashboard":
     st.title("⚕️ Dashboard de Gestão")
@@ -332,28 +478,20 @@ if pagina_selecionada == "📊 Dashboard":
         st.markdown("### 📈 Resumo do Período")
         st.divider()
 
-        if agenda_filtrada.empty:
+        if grafo['agenda_filtrada'].empty:
             st.warning("Nenhum dado encontrado para os filtros selecionados.")
         else:
-            duracao_periodo = max((data_fim - data_inicio).days, 1)
-            periodo_anterior_fim = data_inicio - timedelta(days=1)
-            periodo_anterior_inicio = data_inicio - timedelta(days=duracao_periodo)
-            
-            agenda_periodo_anterior = st.session_state.agenda[
-                (st.session_state.agenda['Data do Atendimento'].dt.date >= periodo_anterior_inicio) &
-                (st.session_state.agenda['Data do Atendimento'].dt.date <= periodo_anterior_fim)
-            ]
-
-            _, _, agenda_com_preco_anterior = calcular_financeiro(
-                agenda_periodo_anterior, st.session_state.materiais, st.session_state.ficha)
+            # KPIs respondidos pelo cubo diário (construído uma vez por versão dos dados)
+            totais_anterior = grafo['kpis_periodo_anterior']
+            totais_atual = grafo['kpis_periodo']
 
-            total_receita_anterior = agenda_com_preco_anterior['Preco Venda (R$)'].sum() if not agenda_com_preco_anterior.empty else 0
-            total_lucro_anterior = agenda_com_preco_anterior['Lucro Atendimento (R$)'].sum() if not agenda_com_preco_anterior.empty else 0
-            total_atendimentos_anterior = agenda_com_preco_anterior.shape[0] if not agenda_com_preco_anterior.empty else 0
+            total_receita_anterior = totais_anterior['Receita']
+            total_lucro_anterior = totais_anterior['Lucro']
+            total_atendimentos_anterior = int(totais_anterior['Atendimentos'])
 
-            total_receita_atual = agenda_com_preco_filtrada['Preco Venda (R$)'].sum()
-            total_lucro_atual = agenda_com_preco_filtrada['Lucro Atendimento (R$)'].sum()
-            total_atendimentos_atual = agenda_com_preco_filtrada.shape[0]
+            total_receita_atual = totais_atual['Receita']
+            total_lucro_atual = totais_atual['Lucro']
+            total_atendimentos_atual = int(totais_atual['Atendimentos'])
 
             delta_receita = ((total_receita_atual - total_receita_anterior) / total_receita_anterior
                              if total_receita_anterior > 0 else (1 if total_receita_atual > 0 else 0))
@@ -391,34 +529,28 @@ if pagina_selecionada == "📊 Dashboard":
                 <div class="metric-delta" style="color: #A3D9A5;">{delta_atendimentos:.1%} em relação ao período anterior</div>
             </div>
             """, unsafe_allow_html=True)
-            df_mes = agenda_com_preco_filtrada.copy()
-            df_mes['Data do Atendimento'] = pd.to_datetime(df_mes['Data do Atendimento'])
-            df_mes['Ano-Mes'] = df_mes['Data do Atendimento'].dt.to_period('M').astype(str)
-
-            
-            df_mes_agrupado = df_mes.groupby('Ano-Mes').agg({
-                'Preco Venda (R$)': 'sum',
-                'Lucro Atendimento (R$)': 'sum'
-            }).reset_index()
+            df_mes_agrupado = grafo['faturamento_mensal'].rename(
+                columns={'Receita': 'Preco Venda (R$)', 'Lucro': 'Lucro Atendimento (R$)'})
 
             
             df_long = df_mes_agrupado.melt(id_vars='Ano-Mes', value_vars=['Preco Venda (R$)', 'Lucro Atendimento (R$)'], 
                                         var_name='Tipo', value_name='Valor')
 
             # Gráfico de colunas agrupadas 
-            fig = px.bar(df_long, x='Ano-Mes', y='Valor', color='Tipo', barmode='group',
-                        title='Receita e Lucro Mensal',
-                        labels={'Ano-Mes': 'Mês', 'Valor': 'Valor (R$)', 'Tipo': 'Métrica'})
-
-            fig.update_layout(
-                xaxis_tickangle=-45,
-                plot_bgcolor='rgba(0,0,0,0)',
-                yaxis_tickprefix='R$ ',
-                legend_title_text='',
-                margin=dict(l=40, r=40, t=40, b=80)
-            )
-
-            st.plotly_chart(fig, use_container_width=True)
+            with etapa("grafico:receita_mensal"):
+                fig = px.bar(df_long, x='Ano-Mes', y='Valor', color='Tipo', barmode='group',
+                            title='Receita e Lucro Mensal',
+                            labels={'Ano-Mes': 'Mês', 'Valor': 'Valor (R$)', 'Tipo': 'Métrica'})
+
+                fig.update_layout(
+                    xaxis_tickangle=-45,
+                    plot_bgcolor='rgba(0,0,0,0)',
+                    yaxis_tickprefix='R$ ',
+                    legend_title_text='',
+                    margin=dict(l=40, r=40, t=40, b=80)
+                )
+
+                st.plotly_chart(fig, use_container_width=True)
             progresso = min(1.0, total_receita_atual / meta_faturamento) if meta_faturamento > 0 else 0
 
             st.markdown(f"""
@@ -464,14 +596,15 @@ if pagina_selecionada == "📊 Dashboard":
     with tab2:
         st.header("💰 Análise Financeira por Procedimento")
         st.divider()
-        st.dataframe(df_financeiro, use_container_width=True)
+        st.dataframe(grafo['financeiro'][0], use_container_width=True)
 
     
     with tab3:
         st.header("👥 Análise de Clientes (CRM)")
         st.divider()
 
-        df_analise_clientes = calcular_analise_clientes(agenda_com_preco_filtrada)
+        # Calculado uma vez por versão dos dados e combinação de filtros; o resultado é compartilhado, não alterar
+        df_analise_clientes, df_coortes = grafo['crm']
 
         if df_analise_clientes.empty:
             st.warning("Nenhum cliente encontrado para os filtros selecionados.")
@@ -487,14 +620,15 @@ if pagina_selecionada == "📊 Dashboard":
                     df_genero.columns = ['Genero', 'count']  # <- IMPORTANTE!
 
                     
-                    fig_genero = px.pie(
-                        df_genero,
-                        names='Genero',
-                        values='count',
-                        height=300,
+                    with etapa("grafico:genero"):
+                        fig_genero = px.pie(
+                            df_genero,
+                            names='Genero',
+                            values='count',
+                            height=300,
                         
-                    )
-                    st.plotly_chart(fig_genero, use_container_width=True)
+                        )
+                        st.plotly_chart(fig_genero, use_container_width=True)
             else:
                 st.info("Sem dados disponíveis para a análise de Genero.")
 
@@ -504,12 +638,12 @@ if pagina_selecionada == "📊 Dashboard":
                     st.subheader("Distribuição por Faixa Etária")
                     bins = [0, 18, 25, 35, 45, 60, 100]
                     labels = ['0-18', '19-25', '26-35', '36-45', '46-60', '60+']
-                    df_analise_clientes['Faixa Etária'] = pd.cut(
-                        df_analise_clientes['Idade'], bins=bins, labels=labels, right=False)
-                    df_faixa_etaria = df_analise_clientes['Faixa Etária'].value_counts().sort_index().reset_index()
+                    faixa_etaria = pd.cut(df_analise_clientes['Idade'], bins=bins, labels=labels, right=False)
+                    df_faixa_etaria = faixa_etaria.value_counts().sort_index().reset_index()
                     df_faixa_etaria.columns = ['Faixa Etária', 'count']
-                    fig_faixa = px.bar(df_faixa_etaria, x='Faixa Etária', y='count', height=300)
-                    st.plotly_chart(fig_faixa, use_container_width=True)
+                    with etapa("grafico:faixa_etaria"):
+                        fig_faixa = px.bar(df_faixa_etaria, x='Faixa Etária', y='count', height=300)
+                        st.plotly_chart(fig_faixa, use_container_width=True)
 
             st.divider()
             st.subheader("Detalhes por Cliente")
@@ -521,164 +655,193 @@ if pagina_selecionada == "📊 Dashboard":
                     "Ticket Médio (R$)": "R$ {:,.2f}",
                     "Última Visita": "{:%d/%m/%Y}",
                     "Idade": "{:.0f}"
-                }),
+                }, na_rep=""),
                 use_container_width=True
             )
 
+            st.divider()
+            st.subheader("Retenção Mensal por Coorte")
+            st.caption("Fração dos clientes de cada mês de primeira visita que voltou nos meses seguintes.")
+            if not df_coortes.empty:
+                with etapa("grafico:coortes"):
+                    fig_coortes = px.imshow(df_coortes.drop(columns='Clientes'), text_auto='.0%', aspect='auto', color_continuous_scale='Blues',
+                                            zmin=0, zmax=1, labels={'x': 'Meses após a primeira visita', 'y': 'Coorte', 'color': 'Retenção'})
+                    st.plotly_chart(fig_coortes, use_container_width=True)
+
 elif pagina_selecionada == "🗓️ Agenda Visual":
     st.title("🗓️ Agenda Visual da Semana")
-    dia_selecionado = st.date_input("Selecione uma data para ver a semana correspondente", datetime.now(), key="agenda_visual_date")
+    col_data, col_modo = st.columns([3, 1])
+    dia_selecionado = col_data.date_input("Selecione uma data para ver a semana correspondente", datetime.now(), key="agenda_visual_date")
+    modo_visualizacao = col_modo.radio("Visualização", ["Semana", "Dia"], horizontal=True, key="agenda_visual_modo")
+    profissionais_visiveis = set(st.multiselect("Profissionais", profissionais_unicos, default=profissionais_unicos, key="agenda_visual_profissionais"))
     start_of_week = dia_selecionado - timedelta(days=(dia_selecionado.weekday() + 1) % 7)
     end_of_week = start_of_week + timedelta(days=6)
-    st.header(f"Semana de {start_of_week.strftime('%d/%m')} a {end_of_week.strftime('%d/%m/%Y')}", divider="rainbow")
-    agenda_semana = st.session_state.agenda[(st.session_state.agenda['Data do Atendimento'].dt.date >= start_of_week) & (st.session_state.agenda['Data do Atendimento'].dt.date <= end_of_week)].copy()
-    agenda_semana['Horário do Atendimento'] = agenda_semana['Horário do Atendimento'].astype(str)
-    agenda_semana = agenda_semana.sort_values(by='Horário do Atendimento')
     dias_da_semana_str = ["Domingo", "Segunda", "Terça", "Quarta", "Quinta", "Sexta", "Sábado"]
-    dias_semana = [(start_of_week + timedelta(days=i)) for i in range(7)]
-    cols = st.columns(7)
-    for i, dia in enumerate(dias_semana):
-        with cols[i]:
-            st.markdown(f"**<p style='text-align: center;'>{dias_da_semana_str[i]}</p>**", unsafe_allow_html=True)
-            st.markdown(f"<p style='text-align: center; font-size: 24px;'>{dia.day}</p>", unsafe_allow_html=True)
-            st.markdown("---")
-            agendamentos_dia = agenda_semana[agenda_semana['Data do Atendimento'].dt.date == dia]
-            if agendamentos_dia.empty: st.caption("Sem agendamentos")
-            else:
-                for _, agendamento in agendamentos_dia.iterrows():
-                    prof_color = color_map.get(agendamento['Profissional Responsável'], '#808080')
-                    with st.container(border=True): st.markdown(f"""<div style="border-left: 5px solid {prof_color}; padding-left: 10px; border-radius: 5px;"><strong>⏰ {agendamento['Horário do Atendimento']}</strong><br>👤 {agendamento['Nome do Cliente']}<br><small><i>{agendamento['Procedimento Realizado']}</i></small></div>""", unsafe_allow_html=True)
+    # Modelo da semana já agrupado por dia e ordenado por horário, calculado uma vez por semana e versão dos dados
+    grafo.parametros.update(semana=start_of_week)
+    visao = {dia: [a for a in atendimentos if a[3] in profissionais_visiveis or not a[3]] for dia, atendimentos in grafo['visao_semana'].items()}
+    ocupacao = grafo['indice_ocupacao']
+    sobrepostos = ocupacao.sobreposicoes(start_of_week, end_of_week, sorted(profissionais_visiveis))
+    if not sobrepostos.empty:
+        with st.expander(f"⚠️ {len(sobrepostos)} atendimentos com horário sobreposto nesta semana ({sobrepostos['Profissional'].nunique()} profissionais)", expanded=True):
+            st.dataframe(sobrepostos, hide_index=True, use_container_width=True,
+                         column_config={"Início": st.column_config.DatetimeColumn(format="DD/MM/YYYY HH:mm"), "Fim": st.column_config.DatetimeColumn(format="HH:mm")})
+    with st.expander("🔎 Próximos horários livres"):
+        col_prof, col_duracao, col_qtd = st.columns([2, 1, 1])
+        profissional_livre = col_prof.selectbox("Profissional", profissionais_unicos, key="livres_profissional")
+        duracao_livre = col_duracao.number_input("Duração (min)", min_value=15, max_value=480, value=30, step=15, key="livres_duracao")
+        quantidade_livre = col_qtd.number_input("Quantos", min_value=1, max_value=20, value=5, key="livres_quantidade")
+        livres = ocupacao.horarios_livres(profissional_livre, duracao_livre, max(datetime.now(), datetime.combine(start_of_week, datetime.min.time())), quantidade_livre) if profissional_livre else []
+        if livres: st.markdown(" · ".join(f"**{dias_da_semana_str[(h.weekday() + 1) % 7][:3]} {h.strftime('%d/%m %H:%M')}**" for h in livres))
+        else: st.caption("Nenhum horário livre nos próximos 60 dias.")
+    if modo_visualizacao == "Semana":
+        st.header(f"Semana de {start_of_week.strftime('%d/%m')} a {end_of_week.strftime('%d/%m/%Y')}", divider="rainbow")
+        cols = st.columns(7)
+        for i, (dia, atendimentos) in enumerate(visao.items()):
+            titulo = f"<p style='text-align: center;'><strong>{dias_da_semana_str[i]}</strong></p><p style='text-align: center; font-size: 24px;'>{dia.day}</p>"
+            cols[i].markdown(html_coluna_agenda(titulo, atendimentos, color_map), unsafe_allow_html=True)
+    else:
+        st.header(f"{dias_da_semana_str[(dia_selecionado.weekday() + 1) % 7]}, {dia_selecionado.strftime('%d/%m/%Y')}", divider="rainbow")
+        atendimentos_dia = visao[dia_selecionado]
+        profissionais_dia = sorted({a[3] for a in atendimentos_dia})
+        if not profissionais_dia: st.caption("Sem agendamentos")
+        else:
+            # Dia: uma coluna por profissional com atendimento
+            cols = st.columns(len(profissionais_dia))
+            for col, prof in zip(cols, profissionais_dia):
+                titulo = f"<p style='text-align: center;'><strong>{escape(prof) or 'Sem profissional'}</strong></p>"
+                col.markdown(html_coluna_agenda(titulo, [a for a in atendimentos_dia if a[3] == prof], color_map), unsafe_allow_html=True)
     st.sidebar.markdown("---"); st.sidebar.subheader("Legenda de Profissionais");
     for prof, cor in color_map.items(): st.sidebar.markdown(f"<span style='color:{cor};'>●</span> {prof}", unsafe_allow_html=True)
 
+elif consolidado and pagina_selecionada in ("📦 Baixa Material", "⚙️ Configurações"):
+    st.title(pagina_selecionada)
+    st.info("Selecione uma clínica na barra lateral: baixas de estoque e cadastros são feitos clínica a clínica.")
+
 elif pagina_selecionada == "📦 Baixa Material":
     st.title("📦 Baixa Material")
     st.info("Esta página mostra os atendimentos realizados que ainda não tiveram seus materiais deduzidos do estoque.")
-    hoje = datetime.now().date()
-    agenda_com_status = st.session_state.agenda.copy()
-    agenda_com_status['Estoque Deduzido'] = agenda_com_status['Estoque Deduzido'].fillna('NÃO').str.upper()
-    atendimentos_pendentes = agenda_com_status[(agenda_com_status['Data do Atendimento'].dt.date < hoje) & (agenda_com_status['Estoque Deduzido'] == 'NÃO')]
-    if atendimentos_pendentes.empty:
+    pendentes_baixa, df_consumo_pendente = grafo['baixa_pendente']
+    if pendentes_baixa.empty:
         st.success("🎉 Tudo certo! Não há atendimentos passados com baixa de estoque pendente.")
     else:
         st.subheader("Atendimentos com Baixa de Estoque Pendente")
-        st.dataframe(atendimentos_pendentes[['Data do Atendimento', 'Nome do Cliente', 'Procedimento Realizado']], use_container_width=True)
+        st.dataframe(pendentes_baixa[['Data do Atendimento', 'Nome do Cliente', 'Procedimento Realizado']], use_container_width=True)
         st.markdown("---")
         st.subheader("Total de Materiais a Serem Deduzidos")
-        _, df_consumo_pendente, _ = calcular_financeiro(atendimentos_pendentes, st.session_state.materiais, st.session_state.ficha)
         st.dataframe(df_consumo_pendente[['Material', 'Quantidade Usada']], use_container_width=True)
         if st.button("Confirmar Baixa de Estoque e Marcar Atendimentos como Processados", type="primary", use_container_width=True):
             with st.spinner("Processando baixas de estoque..."):
-                materiais_atual = st.session_state.materiais.set_index('Material')
-                consumo_para_deduzir = df_consumo_pendente.set_index('Material')
-                materiais_atual['Quantidade em Estoque'] = materiais_atual['Quantidade em Estoque'].subtract(consumo_para_deduzir['Quantidade Usada'], fill_value=0)
-                if salvar_dados_gsheet(client, NOME_PLANILHA, "Materiais", materiais_atual.reset_index()):
-                    st.session_state.materiais = materiais_atual.reset_index().copy()
-                    agenda_atualizada = st.session_state.agenda.copy()
-                    indices_para_atualizar = atendimentos_pendentes.index
-                    agenda_atualizada.loc[indices_para_atualizar, 'Estoque Deduzido'] = 'SIM'
-                    if salvar_dados_gsheet(client, NOME_PLANILHA, "Respostas ao formulário 1", agenda_atualizada):
-                        st.session_state.agenda = agenda_atualizada.copy()
+                # Os atendimentos ainda sem id (e os de baixas antigas) recebem o seu na agenda antes da baixa: o id não
+                # muda com edições, então reenviar a mesma baixa não desconta duas vezes. As baixas são anexadas ao
+                # livro numa única gravação, e o estoque atual é sempre recalculado a partir dele.
+                agenda_passada, ids = grafo['ids_agenda_passada']
+                relevantes = (ids != '').to_numpy() | agenda_passada.index.isin(pendentes_baixa.index)
+                ids, celulas_ids = atribuir_ids(agenda_passada[relevantes], ids[relevantes])
+                if not celulas_ids or salvar_alteracoes(ABA_AGENDA, agenda_passada[relevantes], celulas=celulas_ids, tabela=snapshot.agenda):
+                    movimentos = movimentos_de_baixa(pendentes_baixa, grafo['modelo_custo'], datetime.now(), ids[pendentes_baixa.index])
+                    if registrar_movimentacoes(movimentos.to_dict('records')):
                         st.success("Baixa de estoque realizada com sucesso!")
                         st.rerun()
 
 elif pagina_selecionada == "📊 Status do Estoque":
     st.title("📊 Status do Estoque Atual")
     st.info("Este painel mostra a quantidade exata de cada material na sua prateleira neste momento.")
-    df_estoque_status = st.session_state.materiais.copy()
+    df_estoque_status = grafo['estoque_atual_materiais'].copy(deep=False)
     if 'Quantidade em Estoque' in df_estoque_status.columns and 'Estoque Mínimo' in df_estoque_status.columns:
-        def get_status(row):
-            if row['Quantidade em Estoque'] <= 0: return "🚨 Crítico (ZERADO)"
-            elif row['Quantidade em Estoque'] <= row['Estoque Mínimo']: return "⚠️ Atenção (REPOR)"
-            return "✅ OK"
-        df_estoque_status['Status'] = df_estoque_status.apply(get_status, axis=1)
+        df_estoque_status['Status'] = status_estoque(df_estoque_status)
         max_stock_value = (df_estoque_status['Estoque Mínimo'] * 3).max()
         if max_stock_value == 0: max_stock_value = 100
         st.dataframe(df_estoque_status[['Status', 'Material', 'Quantidade em Estoque', 'Estoque Mínimo']], use_container_width=True, 
                      column_config={"Status": st.column_config.TextColumn("Status", width="medium"), "Quantidade em Estoque": st.column_config.ProgressColumn("Nível do Estoque", format="%d un", min_value=0, max_value=int(max_stock_value))})
     else: st.warning("Adicione as colunas 'Quantidade em Estoque' e 'Estoque Mínimo' na sua planilha de Materiais.")
+    if not consolidado:
+        with st.expander("➕ Registrar Reposição ou Ajuste de Estoque"):
+            with st.form("form_movimentacao", clear_on_submit=True):
+                material_mov = st.selectbox("Material", snapshot.materiais['Material'].dropna().tolist() if 'Material' in snapshot.materiais.columns else [])
+                tipo_mov = st.radio("Tipo", [TIPO_REPOSICAO, TIPO_AJUSTE], horizontal=True, help="Reposição soma a quantidade ao estoque; ajuste soma ou subtrai (use valores negativos para perdas).")
+                quantidade_mov = st.number_input("Quantidade", value=0.0, step=1.0)
+                observacao_mov = st.text_input("Observação")
+                if st.form_submit_button("Registrar", use_container_width=True):
+                    if material_mov and quantidade_mov:
+                        movimento = {"Data": datetime.now().strftime('%d/%m/%Y %H:%M:%S'), "Tipo": tipo_mov, "Material": material_mov,
+                                     "Quantidade": abs(quantidade_mov) if tipo_mov == TIPO_REPOSICAO else quantidade_mov, "Atendimento": "", "Observação": observacao_mov}
+                        if registrar_movimentacoes([movimento]): st.rerun()
+                    else: st.warning("Escolha o material e uma quantidade diferente de zero.")
+    st.subheader("Projeção pelos Agendamentos Futuros")
+    st.caption("Estoque esperado após os atendimentos já agendados (e os passados ainda sem baixa), pela Ficha Técnica.")
+    df_projecao = grafo['projecao_estoque']
+    st.dataframe(df_projecao.sort_values('Ruptura Prevista', na_position='last'), use_container_width=True, hide_index=True,
+                 column_config={"Atinge o Mínimo em": st.column_config.DateColumn(format="DD/MM/YYYY"), "Ruptura Prevista": st.column_config.DateColumn(format="DD/MM/YYYY")})
 #Materiais alteraçao e salvamento
 elif pagina_selecionada == "⚙️ Configurações":
     st.title("⚙️ Configurações e Cadastros"); st.info("Use os formulários para adicionar novos itens e a tabela para editar os existentes.")
+    quarentena = clinica.quarentena
+    if not quarentena.empty:
+        with st.expander(f"⚠️ Quarentena: {len(quarentena)} células com problemas", expanded=True):
+            st.caption("Estas linhas continuam nos dados, mas os valores abaixo não puderam ser interpretados (ou estão vazios) e contam como zero ou sem data até serem corrigidos na planilha ou nas tabelas desta página.")
+            st.dataframe(quarentena, hide_index=True, use_container_width=True)
     with st.expander("➕ Adicionar Novo Material"):
         with st.form("form_novo_material", clear_on_submit=True):
             novo_material = st.text_input("Nome do Material"); novo_preco = st.number_input("Preço Unitário de Custo (R$)", min_value=0.0, format="%.2f")
             estoque_inicial = st.number_input("Quantidade em Estoque Inicial", min_value=0, step=1); estoque_minimo = st.number_input("Estoque Mínimo", min_value=0, step=1)
             if st.form_submit_button("Adicionar Material", use_container_width=True):
                 if novo_material:
-                    nova_linha = pd.DataFrame([{"Material": novo_material, "Preco Unitario (R$)": novo_preco, "Quantidade em Estoque": estoque_inicial, "Estoque Mínimo": estoque_minimo}])
-                    st.session_state.materiais = pd.concat([st.session_state.materiais, nova_linha], ignore_index=True)
-                    if salvar_dados_gsheet(client, NOME_PLANILHA, "Materiais", st.session_state.materiais): recarregar()
+                    nova_linha = {"Material": novo_material, "Preco Unitario (R$)": novo_preco, "Quantidade em Estoque": estoque_inicial, "Estoque Mínimo": estoque_minimo}
+                    if salvar_alteracoes(ABA_MATERIAIS, snapshot.materiais, linhas_novas=[nova_linha]): st.rerun()
                 else: st.warning("O nome do material não pode ser vazio.")
     st.header("Gerenciar Materiais Existentes", divider="rainbow")
-    st.data_editor(st.session_state.materiais, num_rows="dynamic", use_container_width=True, key="materiais_editor")
-    if st.button("Salvar Alterações nos Materiais", use_container_width=True):
-     try:
-        edited_rows = st.session_state["materiais_editor"].get("edited_rows", {})
-        if edited_rows:
-            
-            df_materiais_final = st.session_state.materiais.copy()
-            for idx, changes in edited_rows.items():
-                for col, new_val in changes.items():
-                    df_materiais_final.at[idx, col] = new_val
-        else:
-            df_materiais_final = st.session_state.materiais.copy()
-
-        if salvar_dados_gsheet(client, NOME_PLANILHA, "Materiais", df_materiais_final):
-            recarregar()
-     except Exception as e:
-        st.error(f"Erro ao processar alterações nos materiais: {e}")
+    st.caption("A 'Quantidade em Estoque' desta aba é o saldo inicial: baixas, reposições e ajustes ficam na aba 'Movimentações de Estoque' e são somados a ela.")
+    editor_paginado(ABA_MATERIAIS, snapshot.materiais, "nos Materiais", ['Material'])
     #Ficha tecnica alteraçao e salvamento
     st.markdown("---")
     with st.expander("➕ Adicionar Novo Item na Ficha Técnica"):
         with st.form("form_nova_ficha", clear_on_submit=True):
-            procedimento_opts = st.session_state.ficha['Procedimento'].unique().tolist()
+            procedimento_opts = snapshot.ficha['Procedimento'].unique().tolist()
             procedimento = st.selectbox("Procedimento (selecione um existente ou digite um novo)", options=procedimento_opts + ['--- NOVO PROCEDIMENTO ---']); 
             if procedimento == '--- NOVO PROCEDIMENTO ---': procedimento = st.text_input("Nome do Novo Procedimento")
-            material = st.selectbox("Material", options=st.session_state.materiais['Material'].unique())
+            material = st.selectbox("Material", options=snapshot.materiais['Material'].unique())
             quantidade = st.number_input("Quantidade Usada", min_value=0.0, step=0.1, format="%.2f")
             preco_venda = st.number_input("Preço de Venda do Procedimento (R$)", min_value=0.0, format="%.2f")
+            duracao = st.number_input("Duração do Procedimento (min)", min_value=5, max_value=480, value=30, step=5)
             if st.form_submit_button("Adicionar Item na Ficha", use_container_width=True):
                 if procedimento and material:
-                    nova_linha_ficha = pd.DataFrame([{"Procedimento": procedimento, "Material": material, "Quantidade Usada": quantidade, "Preco de Venda (R$)": preco_venda}])
-                    st.session_state.ficha = pd.concat([st.session_state.ficha, nova_linha_ficha], ignore_index=True)
-                    if salvar_dados_gsheet(client, NOME_PLANILHA, "Ficha Técnica", st.session_state.ficha_editor): recarregar()
+                    nova_linha_ficha = {"Procedimento": procedimento, "Material": material, "Quantidade Usada": quantidade, "Preco de Venda (R$)": preco_venda, COLUNA_DURACAO: duracao}
+                    if salvar_alteracoes(ABA_FICHA, snapshot.ficha, linhas_novas=[nova_linha_ficha]): st.rerun()
     st.header("Gerenciar Ficha Técnica Existente", divider="rainbow")
-    st.data_editor(st.session_state.ficha, num_rows="dynamic", use_container_width=True, key="ficha_editor")
-    if st.button("Salvar Alterações na Ficha Técnica", use_container_width=True):
-     try:
-        edited_rows = st.session_state["ficha_editor"].get("edited_rows", {})
-        if edited_rows:
-            df_ficha_final = st.session_state.ficha.copy()
-            for idx, changes in edited_rows.items():
-                for col, new_val in changes.items():
-                    df_ficha_final.at[idx, col] = new_val
-        else:
-            df_ficha_final = st.session_state.ficha.copy()
-
-        if salvar_dados_gsheet(client, NOME_PLANILHA, "Ficha Técnica", df_ficha_final):
-            recarregar()
-     except Exception as e:
-        st.error(f"Erro ao processar alterações na ficha técnica: {e}")
+    editor_paginado(ABA_FICHA, snapshot.ficha, "na Ficha Técnica", ['Procedimento', 'Material'])
     
     st.markdown("---")
     st.header("Gerenciar Agendamentos (Edição/Deleção)", divider="rainbow")
     st.info("Para adicionar novos agendamentos, use o Google Form. Esta seção é para corrigir ou deletar registros existentes.")
-    st.data_editor(st.session_state.agenda, num_rows="dynamic", hide_index=True, use_container_width=True, key="agenda_editor")
-    if st.button("Salvar Alterações na Agenda", use_container_width=True):
-     try:
-        edited_rows = st.session_state["agenda_editor"].get("edited_rows", {})
-        if edited_rows:
-            df_agenda_final = st.session_state.agenda.copy()
-            for idx, changes in edited_rows.items():
-                for col, new_val in changes.items():
-                    df_agenda_final.at[idx, col] = new_val
-        else:
-            df_agenda_final = st.session_state.agenda.copy()
-
-        if salvar_dados_gsheet(client, NOME_PLANILHA, "Respostas ao formulário 1", df_agenda_final):
-            recarregar()
-     except Exception as e:
-        st.error(f"Erro ao processar alterações na agenda: {e}")
-
-    st.download_button("📄 Baixar Relatório (Excel)", df_financeiro.to_csv(index=False).encode('utf-8'), file_name="relatorio.csv", mime='text/csv')
\ No newline at end of file
+    editor_paginado(ABA_AGENDA, snapshot.agenda, "na Agenda", ['Nome do Cliente', 'Procedimento Realizado'], filtros_agenda=True)
+
+    # O relatório só é gerado quando o botão é clicado, para a página não pagar pelo cálculo financeiro
+    st.download_button("📄 Baixar Relatório (Excel)", lambda: grafo['financeiro'][0].to_csv(index=False).encode('utf-8'), file_name="relatorio.csv", mime='text/csv')
+
+
+def painel_diagnostico():
+    """Tempos da rodada atual, chamadas ao armazenamento e acertos de cache acumulados pelo processo."""
+    resumo = METRICAS.resumo()
+    with st.sidebar.expander("🔍 Diagnóstico", expanded=True):
+        st.caption(f"Esta rodada: {METRICAS.duracao_rodada() * 1000:.0f} ms · dados versão {st.session_state.get('versao_dados', '-')}")
+        st.dataframe(pd.DataFrame(METRICAS.rodada(), columns=['Etapa', 'ms']).assign(ms=lambda df: df['ms'] * 1000).round(1), hide_index=True, use_container_width=True)
+        st.markdown("**Armazenamento**")
+        chamadas = pd.DataFrame.from_dict(resumo['chamadas'], orient='index', columns=['contagem', 'segundos', 'maximo', 'erros'])
+        st.dataframe(pd.DataFrame({'Chamadas': chamadas['contagem'], 'Média (ms)': chamadas['segundos'] / chamadas['contagem'] * 1000,
+                                   'Máx. (ms)': chamadas['maximo'] * 1000, 'Erros': chamadas['erros']}).round(1), use_container_width=True)
+        st.markdown("**Caches**")
+        caches = pd.DataFrame.from_dict(resumo['caches'], orient='index', columns=['acertos', 'falhas'])
+        st.dataframe(caches.assign(**{'Acerto (%)': (caches['acertos'] / (caches['acertos'] + caches['falhas']) * 100).round(1)}), use_container_width=True)
+        st.markdown("**Clínicas em memória**")
+        memoria = {nome: snap.memoria() / 2**20 if snap is not None else 0.0 for nome, snap in gerenciador.snapshots_atuais().items()}
+        st.dataframe(pd.Series(memoria, name='MB').round(1), use_container_width=True)
+        st.caption(f"Orçamento de memória: {ORCAMENTO_MEMORIA_MB} MB")
+        if CAMINHO_METRICAS: st.caption(f"Métricas exportadas em '{CAMINHO_METRICAS}'.")
+
+if diagnostico_ativo: painel_diagnostico()
+if CAMINHO_METRICAS:
+    try:
+        METRICAS.exportar_periodicamente(CAMINHO_METRICAS)
+    except OSError as e:
+        st.sidebar.caption(f"Não foi possível exportar as métricas: {e}")
@@ -0,0 +1,102 @@
+import uuid
+import numpy as np
+import pandas as pd
+from armazenamento import COLUNAS_MOVIMENTACOES, texto_celula
+
+
+TIPO_BAIXA = "BAIXA"
+TIPO_REPOSICAO = "REPOSIÇÃO"
+TIPO_AJUSTE = "AJUSTE"
+# Coluna da agenda com o identificador de cada atendimento, gravado na primeira baixa e nunca mais alterado
+COLUNA_ID_ATENDIMENTO = 'ID do Atendimento'
+# Colunas do identificador antigo (hash do conteúdo), usado só para reconhecer as baixas registradas antes da coluna de id
+COLUNAS_ID_LEGADO = ['Carimbo de data/hora', 'Nome do Cliente', 'Data do Atendimento', 'Horário do Atendimento', 'Procedimento Realizado', 'Profissional Responsável']
+
+
+def novo_id_atendimento():
+    """Identificador novo de atendimento. O prefixo evita que a planilha o interprete como número."""
+    return f"AT{uuid.uuid4().hex}"
+
+
+def ids_legados(agenda):
+    """Identificador antigo de cada atendimento: hash das colunas que o identificavam, com '-n' nos repetidos.
+    Muda quando o atendimento é editado (e pode mudar entre versões do pandas): serve só para reencontrar baixas antigas."""
+    colunas = {}
+    for col in COLUNAS_ID_LEGADO:
+        if col not in agenda.columns: continue
+        serie = agenda[col]
+        if pd.api.types.is_datetime64_any_dtype(serie): serie = serie.dt.strftime('%Y-%m-%d')
+        colunas[col] = serie.astype('string').fillna('')
+    hashes = pd.util.hash_pandas_object(pd.DataFrame(colunas, index=agenda.index), index=False)
+    ocorrencia = hashes.groupby(hashes).cumcount()
+    return hashes.map('AT{:016x}'.format) + ocorrencia.map(lambda n: f"-{n}" if n else "")
+
+
+def ids_gravados(agenda):
+    """Id gravado na coluna COLUNA_ID_ATENDIMENTO de cada atendimento ('' nos que ainda não têm)."""
+    if COLUNA_ID_ATENDIMENTO not in agenda.columns: return pd.Series('', index=agenda.index, dtype=object)
+    return agenda[COLUNA_ID_ATENDIMENTO].map(lambda valor: texto_celula(valor).strip()).astype(object)
+
+
+def ids_atendimentos(agenda, baixados=frozenset()):
+    """Id de cada atendimento: o gravado na agenda, que não muda quando o atendimento é editado ou outras linhas
+    são apagadas. Sem id gravado, vale o id antigo se já houver baixa com ele em `baixados` (ver `ids_legados`;
+    calcule sobre o mesmo período usado nas baixas antigas); os demais ficam com ''."""
+    ids = ids_gravados(agenda)
+    sem_id = (ids == '').to_numpy()
+    if sem_id.any() and baixados:
+        legados = ids_legados(agenda[sem_id])
+        ids[sem_id] = legados.where(legados.isin(baixados), '').to_numpy(dtype=object)
+    return ids
+
+
+def atribuir_ids(agenda, ids):
+    """Completa os `ids` (de `ids_atendimentos`) antes de uma baixa: os vazios ganham um id novo. Devolve os ids
+    completos e as células a gravar na agenda ({linha: {COLUNA_ID_ATENDIMENTO: id}}) das linhas ainda sem id gravado,
+    inclusive as de baixas antigas, que passam a guardar o id já usado no livro."""
+    ids = ids.astype(object)
+    vazios = (ids == '').to_numpy()
+    ids[vazios] = np.array([novo_id_atendimento() for _ in range(int(vazios.sum()))], dtype=object)
+    faltando = (ids_gravados(agenda) == '').to_numpy()
+    return ids, {linha: {COLUNA_ID_ATENDIMENTO: id_atendimento} for linha, id_atendimento in ids[faltando].items()}
+
+
+def atendimentos_baixados(movimentacoes):
+    """Conjunto dos atendimentos que já têm baixa registrada no livro."""
+    return set(movimentacoes.loc[movimentacoes['Tipo'] == TIPO_BAIXA, 'Atendimento']) - {''}
+
+
+def movimentos_de_baixa(atendimentos, modelo_custo, data, ids):
+    """Linhas do livro que dão baixa nos materiais dos atendimentos, uma por atendimento e material.
+    Atendimentos sem material na Ficha Técnica recebem uma linha sem material, só para ficarem registrados.
+    `ids` (alinhado a `atendimentos`) são os identificadores completos (ver `atribuir_ids`)."""
+    ids = ids.to_numpy()
+    posicoes, materiais, quantidades = modelo_custo.consumo_por_atendimento(atendimentos['Procedimento Realizado'])
+    movimentos = pd.DataFrame({'Atendimento': ids[posicoes], 'Material': materiais, 'Quantidade': quantidades})
+    movimentos = movimentos.groupby(['Atendimento', 'Material'], sort=False, as_index=False)['Quantidade'].sum()
+    movimentos = movimentos[movimentos['Quantidade'] != 0]
+    sem_material = pd.DataFrame({'Atendimento': pd.unique(ids[~pd.Series(ids).isin(movimentos['Atendimento']).to_numpy()]), 'Material': '', 'Quantidade': 0.0})
+    movimentos = pd.concat([movimentos.assign(Quantidade=-movimentos['Quantidade']), sem_material], ignore_index=True)
+    movimentos['Data'] = pd.Timestamp(data).strftime('%d/%m/%Y %H:%M:%S')
+    movimentos['Tipo'] = TIPO_BAIXA
+    movimentos['Observação'] = ''
+    return movimentos[COLUNAS_MOVIMENTACOES]
+
+
+def estoque_atual(materiais, movimentacoes):
+    """Estoque de cada material: a 'Quantidade em Estoque' da aba Materiais (saldo inicial) mais a soma das
+    movimentações do livro. Baixas repetidas do mesmo atendimento e material (ex.: gravação reenviada) contam uma vez."""
+    validas = movimentacoes[movimentacoes['Material'] != '']
+    repetidas = (validas['Tipo'] == TIPO_BAIXA) & validas.duplicated(['Tipo', 'Atendimento', 'Material'])
+    saldo = validas[~repetidas].groupby('Material')['Quantidade'].sum()
+    estoque = materiais.copy(deep=False)
+    if 'Material' in estoque.columns:
+        inicial = estoque['Quantidade em Estoque'] if 'Quantidade em Estoque' in estoque.columns else 0
+        estoque['Quantidade em Estoque'] = inicial + estoque['Material'].map(saldo).fillna(0)
+    return estoque
+
+
+def status_estoque(estoque):
+    """Situação de cada material pelo estoque atual: zerado, no mínimo ou abaixo dele, ou OK."""
+    quantidade, minimo = estoque['Quantidade em Estoque'], estoque['Estoque Mínimo']
+    return pd.Series(np.select([quantidade <= 0, quantidade <= minimo], ["🚨 Crítico (ZERADO)", "⚠️ Atenção (REPOR)"], "✅ OK"), index=estoque.index)
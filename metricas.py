@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from armazenamento import Armazenamento
+
+
+def _escapar_rotulo(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metricas:
+    """Tempos por etapa, chamadas ao armazenamento e acertos de cache, acumulados por processo.
+
+    As etapas também são guardadas por rodada: cada execução do script do Streamlit roda numa thread
+    própria, então `iniciar_rodada` zera só as etapas da thread atual e `rodada()` devolve as dela.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.inicio = time.time()
+        self.etapas = {}    # nome -> [contagem, segundos totais, maior duração]
+        self.chamadas = {}  # nome -> [contagem, segundos totais, maior duração, erros]
+        self.caches = {}    # nome -> [acertos, falhas]
+        self._ultima_exportacao = float('-inf')
+
+    def iniciar_rodada(self):
+        self._local.etapas = []
+        self._local.inicio = time.perf_counter()
+
+    def rodada(self):
+        """[(nome, segundos), ...] das etapas concluídas na rodada atual desta thread, na ordem em que terminaram."""
+        return list(getattr(self._local, 'etapas', []))
+
+    def duracao_rodada(self):
+        inicio = getattr(self._local, 'inicio', None)
+        return time.perf_counter() - inicio if inicio is not None else 0.0
+
+    @contextmanager
+    def etapa(self, nome):
+        """Mede o bloco como uma etapa (carga, limpeza, cálculo, gráfico, gravação...)."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            segundos = time.perf_counter() - inicio
+            self._acumular(self.etapas, nome, segundos)
+            if hasattr(self._local, 'etapas'):
+                self._local.etapas.append((nome, segundos))
+
+    def registrar_chamada(self, nome, segundos, erro=False):
+        self._acumular(self.chamadas, nome, segundos, erro)
+
+    def registrar_cache(self, nome, acerto):
+        with self._lock:
+            contagem = self.caches.setdefault(nome, [0, 0])
+            contagem[0 if acerto else 1] += 1
+
+    def _acumular(self, tabela, nome, segundos, erro=None):
+        with self._lock:
+            linha = tabela.setdefault(nome, [0, 0.0, 0.0] + ([0] if erro is not None else []))
+            linha[0] += 1
+            linha[1] += segundos
+            linha[2] = max(linha[2], segundos)
+            if erro: linha[3] += 1
+
+    def resumo(self):
+        """Cópia consistente dos contadores, no formato exportado em JSON."""
+        with self._lock:
+            return {
+                'instante': time.time(),
+                'desde': self.inicio,
+                'etapas': {nome: {'contagem': c, 'segundos': s, 'maximo': m} for nome, (c, s, m) in self.etapas.items()},
+                'chamadas': {nome: {'contagem': c, 'segundos': s, 'maximo': m, 'erros': e} for nome, (c, s, m, e) in self.chamadas.items()},
+                'caches': {nome: {'acertos': a, 'falhas': f} for nome, (a, f) in self.caches.items()},
+            }
+
+    def para_prometheus(self):
+        """Contadores no formato texto do Prometheus (ex.: para o textfile collector do node_exporter)."""
+        resumo = self.resumo()
+        linhas = []
+
+        def serie(metrica, tipo, ajuda, valores):
+            linhas.extend([f"# HELP {metrica} {ajuda}", f"# TYPE {metrica} {tipo}"])
+            for rotulos, valor in valores:
+                texto_rotulos = ",".join(f'{chave}="{_escapar_rotulo(v)}"' for chave, v in rotulos.items())
+                linhas.append(f"{metrica}{{{texto_rotulos}}} {valor}")
+
+        serie("clinflow_etapa_segundos_total", "counter", "Tempo acumulado em cada etapa.", [({'etapa': n}, d['segundos']) for n, d in resumo['etapas'].items()])
+        serie("clinflow_etapa_execucoes_total", "counter", "Execuções de cada etapa.", [({'etapa': n}, d['contagem']) for n, d in resumo['etapas'].items()])
+        serie("clinflow_chamada_segundos_total", "counter", "Latência acumulada das chamadas ao armazenamento.", [({'chamada': n}, d['segundos']) for n, d in resumo['chamadas'].items()])
+        serie("clinflow_chamadas_total", "counter", "Chamadas ao armazenamento.", [({'chamada': n}, d['contagem']) for n, d in resumo['chamadas'].items()])
+        serie("clinflow_chamada_erros_total", "counter", "Chamadas ao armazenamento que falharam.", [({'chamada': n}, d['erros']) for n, d in resumo['chamadas'].items()])
+        serie("clinflow_cache_total", "counter", "Consultas aos caches de dados derivados.",
+              [({'cache': n, 'resultado': r}, d[chave]) for n, d in resumo['caches'].items() for r, chave in (('acerto', 'acertos'), ('falha', 'falhas'))])
+        return "\n".join(linhas) + "\n"
+
+    def exportar_periodicamente(self, caminho, intervalo=30):
+        """Exporta para `caminho` se a última exportação deste processo foi há mais de `intervalo` segundos."""
+        with self._lock:
+            if time.monotonic() - self._ultima_exportacao < intervalo: return False
+            self._ultima_exportacao = time.monotonic()
+        self.exportar(caminho)
+        return True
+
+    def exportar(self, caminho, tamanho_maximo=5 * 2**20):
+        """Grava os contadores em `caminho`: `.prom` é reescrito no formato do Prometheus; outros arquivos recebem
+        uma linha JSON por exportação e, ao passar de `tamanho_maximo` bytes, o atual vira `caminho.1` (rotação)."""
+        if caminho.endswith('.prom'):
+            temporario = f"{caminho}.tmp"
+            with open(temporario, 'w', encoding='utf-8') as arquivo:
+                arquivo.write(self.para_prometheus())
+            os.replace(temporario, caminho)
+            return
+        if os.path.exists(caminho) and os.path.getsize(caminho) > tamanho_maximo:
+            os.replace(caminho, f"{caminho}.1")
+        with open(caminho, 'a', encoding='utf-8') as arquivo:
+            arquivo.write(json.dumps(self.resumo(), ensure_ascii=False) + "\n")
+
+
+# Registro único do processo
+METRICAS = Metricas()
+etapa = METRICAS.etapa
+
+
+class ArmazenamentoInstrumentado(Armazenamento):
+    """Envolve um backend registrando contagem, latência e falhas de cada chamada ao armazenamento."""
+
+    METODOS = ('ler_intervalos', 'ler_linhas_avulsas', 'salvar_aba', 'revisao', 'garantir_aba', 'existe_aba', 'aplicar_alteracoes')
+
+    def __init__(self, armazenamento, metricas=METRICAS):
+        self.armazenamento = armazenamento
+        self.metricas = metricas
+        self.identificador = armazenamento.identificador
+        self._prefixo = self.identificador.split(':', 1)[0]
+        for nome in self.METODOS:
+            setattr(self, nome, self._medir(nome, getattr(armazenamento, nome)))
+
+    def _medir(self, nome, metodo):
+        def chamar(*args, **kwargs):
+            inicio, erro = time.perf_counter(), False
+            try:
+                return metodo(*args, **kwargs)
+            except Exception:
+                erro = True
+                raise
+            finally:
+                self.metricas.registrar_chamada(f"{self._prefixo}.{nome}", time.perf_counter() - inicio, erro)
+        return chamar
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+from calculos import mapear_valores
+
+
+# Duração de cada procedimento, na Ficha Técnica (repetida nas linhas do procedimento, como o preço de venda)
+COLUNA_DURACAO = 'Duração (min)'
+DURACAO_PADRAO_MINUTOS = 30
+# Expediente (minutos desde a meia-noite) e dias de atendimento (0 = segunda) usados na busca de horários livres
+EXPEDIENTE = (8 * 60, 19 * 60)
+DIAS_ATENDIMENTO = (0, 1, 2, 3, 4, 5)
+MINUTOS_DIA = 24 * 60
+
+
+def duracoes_procedimentos(ficha):
+    """Duração em minutos de cada procedimento (a primeira preenchida nas linhas dele)."""
+    if COLUNA_DURACAO not in ficha.columns: return pd.Series(dtype=float)
+    duracoes = ficha.dropna(subset=['Procedimento', COLUNA_DURACAO])
+    duracoes = duracoes[duracoes[COLUNA_DURACAO] > 0]
+    return duracoes.drop_duplicates(subset=['Procedimento']).set_index('Procedimento')[COLUNA_DURACAO]
+
+
+def _minutos_do_dia(horarios):
+    """Minutos desde a meia-noite de horários 'HH:MM' (NaN para os que não são horário); nas categóricas só as categorias são convertidas."""
+    if isinstance(horarios.dtype, pd.CategoricalDtype):
+        por_categoria = pd.to_datetime(pd.Series(horarios.cat.categories, dtype=object), format='%H:%M', errors='coerce')
+        por_categoria = np.append((por_categoria.dt.hour * 60 + por_categoria.dt.minute).to_numpy(dtype=float), np.nan)
+        return por_categoria[horarios.cat.codes.to_numpy()]
+    horario = pd.to_datetime(horarios.astype('string'), format='%H:%M', errors='coerce')
+    return (horario.dt.hour * 60 + horario.dt.minute).to_numpy(dtype=float)
+
+
+def _arredondar(minuto, passo):
+    return -(-minuto // passo) * passo
+
+
+class IndiceOcupacao:
+    """Índice de intervalos da agenda por profissional, para achar sobreposições e horários livres.
+
+    Cada atendimento vira o intervalo [início, início + duração do procedimento), em minutos desde 1970. Os
+    intervalos de cada profissional ficam ordenados pelo início, com a marca de quem se sobrepõe a outro e os
+    blocos ocupados já unidos: as consultas localizam a janela por busca binária e custam O(log n) mais o que
+    devolvem, sem percorrer a agenda. Atendimentos sem data, horário ou profissional ficam de fora.
+    """
+
+    def __init__(self, agenda, ficha, duracao_padrao=DURACAO_PADRAO_MINUTOS):
+        self.agenda = agenda
+        minutos = _minutos_do_dia(agenda['Horário do Atendimento'])
+        dias = agenda['Data do Atendimento'].to_numpy(dtype='datetime64[m]').astype(np.int64)
+        duracao = mapear_valores(agenda['Procedimento Realizado'], duracoes_procedimentos(ficha)).fillna(duracao_padrao).to_numpy()
+        profissionais = agenda['Profissional Responsável']
+        if isinstance(profissionais.dtype, pd.CategoricalDtype):
+            codigos, nomes = profissionais.cat.codes.to_numpy(), profissionais.cat.categories
+        else:
+            codigos, nomes = pd.factorize(profissionais)
+        validos = np.flatnonzero(~np.isnan(minutos) & agenda['Data do Atendimento'].notna().to_numpy() & (codigos >= 0))
+
+        inicio = dias[validos] + minutos[validos].astype(np.int64)
+        ordem = np.lexsort((inicio, codigos[validos]))
+        self._posicoes = validos[ordem]
+        self._codigos = codigos[validos][ordem]
+        self._inicio = inicio[ordem]
+        self._fim = self._inicio + duracao[validos][ordem].astype(np.int64)
+        self._faixas = {}
+        self._blocos = {}
+        self.sobreposto = np.zeros(len(self._inicio), dtype=bool)
+        limites = np.searchsorted(self._codigos, np.arange(len(nomes) + 1))
+        for codigo, nome in enumerate(nomes):
+            lo, hi = limites[codigo], limites[codigo + 1]
+            if lo == hi: continue
+            self._faixas[nome] = (lo, hi)
+            inicio_p, fim_p = self._inicio[lo:hi], self._fim[lo:hi]
+            # Maior fim entre os atendimentos anteriores: quem começa antes dele está sobreposto a algum anterior.
+            # Um atendimento também está sobreposto se o seguinte (o próximo início) começa antes de ele terminar.
+            fim_anterior = np.concatenate([[np.iinfo(np.int64).min], np.maximum.accumulate(fim_p)[:-1]])
+            com_anterior = inicio_p < fim_anterior
+            self.sobreposto[lo:hi] = com_anterior | np.append(inicio_p[1:] < fim_p[:-1], False)
+            # Blocos ocupados: um novo bloco começa onde não há sobreposição com nenhum atendimento anterior
+            novos = np.flatnonzero(~com_anterior)
+            self._blocos[nome] = (inicio_p[novos], np.maximum.reduceat(fim_p, novos))
+
+    def _janela(self, nome, inicio, fim):
+        lo, hi = self._faixas.get(nome, (0, 0))
+        return lo + np.searchsorted(self._inicio[lo:hi], inicio, side='left'), lo + np.searchsorted(self._inicio[lo:hi], fim, side='left')
+
+    def sobreposicoes(self, inicio, fim, profissionais=None):
+        """Atendimentos de `inicio` a `fim` (datas, inclusive) cujo horário se sobrepõe a outro do mesmo profissional."""
+        inicio = pd.Timestamp(inicio).normalize().to_datetime64().astype('datetime64[m]').astype(np.int64)
+        fim = (pd.Timestamp(fim).normalize() + pd.Timedelta(days=1)).to_datetime64().astype('datetime64[m]').astype(np.int64)
+        partes = []
+        for nome in (self._faixas if profissionais is None else profissionais):
+            lo, hi = self._janela(nome, inicio, fim)
+            partes.append(lo + np.flatnonzero(self.sobreposto[lo:hi]))
+        selecao = np.concatenate(partes) if partes else np.array([], dtype=np.int64)
+        atendimentos = self.agenda.iloc[self._posicoes[selecao]]
+        return pd.DataFrame({
+            'Profissional': atendimentos['Profissional Responsável'].astype(object).to_numpy(),
+            'Início': pd.to_datetime(self._inicio[selecao], unit='m').to_numpy(),
+            'Fim': pd.to_datetime(self._fim[selecao], unit='m').to_numpy(),
+            'Cliente': atendimentos['Nome do Cliente'].astype(object).to_numpy(),
+            'Procedimento': atendimentos['Procedimento Realizado'].astype(object).to_numpy(),
+        }, index=atendimentos.index)
+
+    def horarios_livres(self, profissional, duracao, a_partir_de, quantidade=5, passo=30, expediente=EXPEDIENTE,
+                        dias_atendimento=DIAS_ATENDIMENTO, max_dias=60):
+        """Os próximos `quantidade` horários (Timestamps) em que `profissional` tem `duracao` minutos livres, a partir de
+        `a_partir_de`, começando em múltiplos de `passo` minutos, dentro do expediente e dos dias de atendimento."""
+        blocos_inicio, blocos_fim = self._blocos.get(profissional, (np.array([], dtype=np.int64), np.array([], dtype=np.int64)))
+        duracao = int(duracao)
+        cursor = _arredondar(int(pd.Timestamp(a_partir_de).to_datetime64().astype('datetime64[m]').astype(np.int64)), passo)
+        i = int(np.searchsorted(blocos_fim, cursor, side='right'))
+        dia, livres = cursor // MINUTOS_DIA, []
+        for dia in range(dia, dia + max_dias):
+            # 01/01/1970 foi uma quinta-feira (weekday 3)
+            if (dia + 3) % 7 not in dias_atendimento: continue
+            cursor = max(cursor, dia * MINUTOS_DIA + expediente[0])
+            fecha = dia * MINUTOS_DIA + expediente[1]
+            while cursor + duracao <= fecha and len(livres) < quantidade:
+                while i < len(blocos_fim) and blocos_fim[i] <= cursor: i += 1
+                if i < len(blocos_inicio) and blocos_inicio[i] < cursor + duracao:
+                    cursor = _arredondar(int(blocos_fim[i]), passo)
+                else:
+                    livres.append(pd.Timestamp(cursor, unit='m'))
+                    cursor += _arredondar(duracao, passo)
+            if len(livres) >= quantidade: break
+        return livres
@@ -0,0 +1,122 @@
+import argparse
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from html import escape
+import pandas as pd
+from armazenamento import ABA_MOVIMENTACOES, abrir_armazenamento
+from calculos import calcular_financeiro, calcular_analise_clientes, calcular_retencao_coortes
+from dados import SincronizadorAgenda, SincronizadorMovimentacoes, carregar_dados, fatiar_periodo
+from estoque import estoque_atual, status_estoque
+
+
+FORMATOS = ('csv', 'parquet', 'html')
+
+
+def carregar_clinica(armazenamento):
+    """Lê as abas da clínica numa única ida ao armazenamento: (agenda, materiais, ficha, movimentacoes) limpos.
+    Só lê: uma clínica sem o livro de movimentações (nunca aberta no dashboard) é tratada como sem movimentações."""
+    movimentacoes = SincronizadorMovimentacoes(armazenamento) if armazenamento.existe_aba(ABA_MOVIMENTACOES) else None
+    return carregar_dados(armazenamento, SincronizadorAgenda(armazenamento), True, movimentacoes)
+
+
+def relatorio_mensal(agenda, materiais, ficha, movimentacoes, mes):
+    """Tabelas do relatório de `mes` ('AAAA-MM'): resumo, financeiro por procedimento, consumo de materiais,
+    clientes (CRM), retenção por coorte até o fim do mês e estoque de cada material no fim do mês."""
+    periodo = pd.Period(mes, freq='M')
+    inicio, fim = periodo.start_time, periodo.end_time.normalize()
+    agenda_mes = fatiar_periodo(agenda, inicio, fim)
+    df_financeiro, df_consumo, agenda_com_preco = calcular_financeiro(agenda_mes, materiais, ficha)
+    clientes = calcular_analise_clientes(agenda_com_preco, fim)
+
+    # Movimentações sem data válida entram no saldo, como no dashboard
+    estoque = estoque_atual(materiais, movimentacoes[~(movimentacoes['Data'] >= fim + pd.Timedelta(days=1))])
+    colunas_estoque = [col for col in ['Material', 'Quantidade em Estoque', 'Estoque Mínimo'] if col in estoque.columns]
+    estoque = estoque[colunas_estoque].reset_index(drop=True)
+    if 'Estoque Mínimo' in estoque.columns: estoque.insert(0, 'Status', status_estoque(estoque))
+
+    receita = agenda_com_preco['Preco Venda (R$)'].sum() if not agenda_mes.empty else 0.0
+    custo = agenda_com_preco['Custo Atendimento (R$)'].sum() if not agenda_mes.empty else 0.0
+    resumo = pd.DataFrame([{'Mês': str(periodo), 'Atendimentos': len(agenda_mes), 'Clientes': len(clientes),
+                            'Receita (R$)': receita, 'Custo (R$)': custo, 'Lucro (R$)': receita - custo}])
+    return {
+        'resumo': resumo,
+        'financeiro': df_financeiro,
+        'consumo': df_consumo,
+        'clientes': clientes,
+        'coortes': calcular_retencao_coortes(fatiar_periodo(agenda, fim=fim)).reset_index(),
+        'estoque': estoque,
+    }
+
+
+def nome_arquivo(texto):
+    """Trecho seguro para nome de arquivo a partir do nome da clínica."""
+    return re.sub(r'[^\w.-]+', '_', texto).strip('_') or 'clinica'
+
+
+def gravar_relatorio(tabelas, pasta, formatos, titulo):
+    """Grava cada tabela em `pasta` nos formatos pedidos; o HTML reúne todas as tabelas num único arquivo."""
+    os.makedirs(pasta, exist_ok=True)
+    arquivos = []
+    for nome, df in tabelas.items():
+        if 'csv' in formatos:
+            arquivos.append(os.path.join(pasta, f"{nome}.csv"))
+            df.to_csv(arquivos[-1], index=False)
+        if 'parquet' in formatos:
+            arquivos.append(os.path.join(pasta, f"{nome}.parquet"))
+            df.to_parquet(arquivos[-1], index=False)
+    if 'html' in formatos:
+        secoes = "".join(f"<h2>{escape(nome.capitalize())}</h2>{df.to_html(index=False, na_rep='', float_format='{:,.2f}'.format)}" for nome, df in tabelas.items())
+        arquivos.append(os.path.join(pasta, "relatorio.html"))
+        with open(arquivos[-1], 'w', encoding='utf-8') as arquivo:
+            arquivo.write(f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>{escape(titulo)}</title></head><body><h1>{escape(titulo)}</h1>{secoes}</body></html>")
+    return arquivos
+
+
+def processar_clinica(origem, meses, destino, formatos, arquivo_credenciais):
+    """Carrega uma clínica uma única vez e gera os relatórios de todos os `meses`; roda num processo do pool.
+    Devolve (origem, arquivos gravados, mensagem de erro ou None)."""
+    try:
+        armazenamento = abrir_armazenamento(origem, arquivo_credenciais, somente_leitura=True)
+        agenda, materiais, ficha, movimentacoes = carregar_clinica(armazenamento)
+        clinica = nome_arquivo(armazenamento.identificador.partition(':')[2])
+        arquivos = []
+        for mes in meses:
+            tabelas = relatorio_mensal(agenda, materiais, ficha, movimentacoes, mes)
+            arquivos += gravar_relatorio(tabelas, os.path.join(destino, clinica, mes), formatos, f"{clinica} - {mes}")
+        return origem, arquivos, None
+    except Exception as e:
+        return origem, [], f"{type(e).__name__}: {e}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera relatórios mensais (financeiro, CRM e estoque) de várias clínicas, sem o dashboard.")
+    parser.add_argument("origens", nargs="+", help="planilhas: nome da Planilha Google, 'gsheets:<nome>' ou 'sqlite:<arquivo>'")
+    parser.add_argument("--meses", nargs="+", default=[str(pd.Period(pd.Timestamp.now(), freq='M') - 1)], help="meses AAAA-MM (padrão: mês passado)")
+    parser.add_argument("--destino", default="relatorios", help="pasta de saída (uma subpasta por clínica e mês)")
+    parser.add_argument("--formatos", nargs="+", choices=FORMATOS, default=['csv', 'html'])
+    parser.add_argument("--processos", type=int, default=os.cpu_count(), help="clínicas processadas em paralelo")
+    parser.add_argument("--credenciais", default=".streamlit/credentials.json", help="arquivo da service account do Google")
+    args = parser.parse_args(argv)
+    meses = [str(pd.Period(mes, freq='M')) for mes in args.meses]
+
+    tarefas = [(origem, meses, args.destino, args.formatos, args.credenciais) for origem in dict.fromkeys(args.origens)]
+    if args.processos <= 1 or len(tarefas) == 1:
+        resultados = [processar_clinica(*tarefa) for tarefa in tarefas]
+    else:
+        with ProcessPoolExecutor(max_workers=min(args.processos, len(tarefas))) as pool:
+            resultados = [futuro.result() for futuro in as_completed([pool.submit(processar_clinica, *tarefa) for tarefa in tarefas])]
+
+    falhas = 0
+    for origem, arquivos, erro in resultados:
+        if erro:
+            falhas += 1
+            print(f"✗ {origem}: {erro}", file=sys.stderr)
+        else:
+            print(f"✓ {origem}: {len(arquivos)} arquivos")
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
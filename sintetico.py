@@ -0,0 +1,115 @@
+import argparse
+import numpy as np
+import pandas as pd
+from armazenamento import ABA_AGENDA, ABA_MATERIAIS, ABA_FICHA, ABA_MOVIMENTACOES, COLUNAS_MOVIMENTACOES, LINHA_INICIAL_DADOS, ArmazenamentoSQLite
+from ocupacao import COLUNA_DURACAO
+
+
+GENEROS = np.array(['Feminino', 'Masculino', ''], dtype=object)
+# Atendimentos de 30 em 30 minutos, das 08:00 às 18:30
+HORARIOS = np.array([f"{h:02d}:{m:02d}:00" for h in range(8, 19) for m in (0, 30)], dtype=object)
+
+
+def _pesos(rng, n, concentracao=1.0):
+    """Popularidade de cada item (procedimento, cliente...): poucos itens concentram a maior parte dos atendimentos."""
+    pesos = rng.lognormal(0, concentracao, n)
+    return pesos / pesos.sum()
+
+
+def _datas_texto(inicio, n_dias, formato):
+    return np.array(pd.date_range(inicio, periods=n_dias, freq='D').strftime(formato), dtype=object)
+
+
+def gerar_dados(num_atendimentos=10_000, num_clientes=None, num_profissionais=5, num_procedimentos=20, num_materiais=40, anos=3, fim=None, semente=0):
+    """Agenda, Materiais e Ficha Técnica sintéticas, no formato em que são lidas da planilha (células como texto).
+
+    Os atendimentos cobrem `anos` anos até `fim` (padrão: hoje) mais 30 dias de agenda futura, em dias úteis e
+    horários de meia em meia hora; clientes e procedimentos têm popularidade desigual e cada cliente mantém idade
+    e gênero. As linhas seguem a ordem de chegada do formulário (carimbo) e o índice é a linha da planilha.
+    Devolve {nome_aba: DataFrame}, incluindo o livro de movimentações (vazio).
+    """
+    rng = np.random.default_rng(semente)
+    num_clientes = num_clientes or max(num_atendimentos // 8, 1)
+    fim = pd.Timestamp(fim if fim is not None else pd.Timestamp.now()).normalize()
+    inicio = fim - pd.DateOffset(years=anos)
+    n_dias = (fim - inicio).days + 31
+
+    dias_uteis = np.flatnonzero(pd.date_range(inicio, periods=n_dias, freq='D').dayofweek < 6)
+    dia = np.sort(rng.choice(dias_uteis, num_atendimentos))
+    # O formulário é enviado até 20 dias antes do atendimento (as datas do carimbo começam 20 dias antes de `inicio`)
+    dia_carimbo = dia + 20 - rng.integers(0, 21, num_atendimentos)
+    cliente = rng.choice(num_clientes, num_atendimentos, p=_pesos(rng, num_clientes, 1.2))
+    procedimento = rng.choice(num_procedimentos, num_atendimentos, p=_pesos(rng, num_procedimentos))
+    profissional = rng.choice(num_profissionais, num_atendimentos, p=_pesos(rng, num_profissionais, 0.5))
+    horario = rng.integers(0, len(HORARIOS), num_atendimentos)
+    segundos = rng.integers(0, 86_400, num_atendimentos)
+
+    nomes_clientes = np.array([f"Cliente {i:06d}" for i in range(num_clientes)], dtype=object)
+    idades = np.where(rng.random(num_clientes) < 0.05, '', rng.integers(16, 80, num_clientes).astype(str)).astype(object)
+    generos = GENEROS[rng.choice(3, num_clientes, p=[0.68, 0.29, 0.03])]
+    procedimentos = np.array([f"Procedimento {i:03d}" for i in range(num_procedimentos)], dtype=object)
+    profissionais = np.array([f"Dra. Profissional {i:02d}" for i in range(num_profissionais)], dtype=object)
+    relogio = np.array([f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in range(86_400)], dtype=object)
+
+    ordem = np.lexsort((segundos, dia_carimbo))
+    dia, dia_carimbo, cliente, procedimento, profissional, horario, segundos = (
+        v[ordem] for v in (dia, dia_carimbo, cliente, procedimento, profissional, horario, segundos))
+    agenda = pd.DataFrame({
+        'Carimbo de data/hora': _datas_texto(inicio - pd.Timedelta(days=20), n_dias + 20, '%d/%m/%Y')[dia_carimbo] + ' ' + relogio[segundos],
+        'Nome do Cliente': nomes_clientes[cliente],
+        'Data do Atendimento': _datas_texto(inicio, n_dias, '%d/%m/%Y')[dia],
+        'Horário do Atendimento': HORARIOS[horario],
+        'Procedimento Realizado': procedimentos[procedimento],
+        'Profissional Responsável': profissionais[profissional],
+        'Idade': idades[cliente],
+        'Genero': generos[cliente],
+        # Baixas antigas marcadas na própria agenda; a última semana ainda está pendente
+        'Estoque Deduzido': np.where(dia < (fim - inicio).days - 7, 'SIM', 'NÃO').astype(object),
+    }, index=pd.RangeIndex(LINHA_INICIAL_DADOS, LINHA_INICIAL_DADOS + num_atendimentos))
+
+    materiais = pd.DataFrame({
+        'Material': [f"Material {i:03d}" for i in range(num_materiais)],
+        'Preco Unitario (R$)': np.round(rng.uniform(0.5, 120, num_materiais), 2).astype(str),
+        'Quantidade em Estoque': rng.integers(0, 500, num_materiais).astype(str),
+        'Estoque Mínimo': rng.integers(5, 50, num_materiais).astype(str),
+    }, index=pd.RangeIndex(LINHA_INICIAL_DADOS, LINHA_INICIAL_DADOS + num_materiais))
+
+    # Cada procedimento usa de 1 a 5 materiais; o preço de venda se repete em todas as linhas do procedimento
+    itens = rng.integers(1, min(5, num_materiais) + 1, num_procedimentos)
+    linhas_ficha = [(procedimentos[p], f"Material {m:03d}") for p in range(num_procedimentos) for m in rng.choice(num_materiais, itens[p], replace=False)]
+    precos_venda = np.round(rng.uniform(80, 1500, num_procedimentos), -1)
+    ficha = pd.DataFrame(linhas_ficha, columns=['Procedimento', 'Material'])
+    ficha['Quantidade Usada'] = np.round(rng.uniform(0.1, 5, len(ficha)), 2).astype(str)
+    ficha['Preco de Venda (R$)'] = precos_venda[np.repeat(np.arange(num_procedimentos), itens)].astype(str)
+    ficha[COLUNA_DURACAO] = rng.choice([30, 45, 60, 90], num_procedimentos)[np.repeat(np.arange(num_procedimentos), itens)].astype(str)
+    ficha.index = pd.RangeIndex(LINHA_INICIAL_DADOS, LINHA_INICIAL_DADOS + len(ficha))
+
+    movimentacoes = pd.DataFrame(columns=COLUNAS_MOVIMENTACOES)
+    return {ABA_AGENDA: agenda, ABA_MATERIAIS: materiais, ABA_FICHA: ficha, ABA_MOVIMENTACOES: movimentacoes}
+
+
+def argumentos_geracao(parser):
+    """Opções de tamanho do conjunto sintético, compartilhadas com o benchmark."""
+    parser.add_argument("--clientes", type=int, default=None, help="número de clientes (padrão: atendimentos / 8)")
+    parser.add_argument("--profissionais", type=int, default=5)
+    parser.add_argument("--procedimentos", type=int, default=20)
+    parser.add_argument("--materiais", type=int, default=40)
+    parser.add_argument("--anos", type=int, default=3, help="anos de histórico até hoje")
+    parser.add_argument("--semente", type=int, default=0)
+    return parser
+
+
+def main(argv=None):
+    parser = argumentos_geracao(argparse.ArgumentParser(description="Gera uma base sintética da clínica num banco SQLite local."))
+    parser.add_argument("--atendimentos", type=int, default=10_000)
+    parser.add_argument("--banco", default="clinflow.db", help="arquivo SQLite de destino (as abas são substituídas)")
+    args = parser.parse_args(argv)
+    abas = gerar_dados(args.atendimentos, args.clientes, args.profissionais, args.procedimentos, args.materiais, args.anos, semente=args.semente)
+    destino = ArmazenamentoSQLite(args.banco)
+    for nome_aba, df in abas.items():
+        destino.salvar_aba(nome_aba, df)
+    print(f"{args.atendimentos} atendimentos gravados em {args.banco}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+import pandas as pd
+from metricas import METRICAS
+
+logger = logging.getLogger(__name__)
+# Limite de valores derivados guardados por snapshot (ex.: um resultado de CRM por combinação de filtros)
+MAX_DERIVADOS = 64
+
+
+def memoria_tabelas(*tabelas):
+    """Bytes ocupados pelos DataFrames (None é ignorado), contando o conteúdo das colunas de texto."""
+    return int(sum(df.memory_usage(index=True, deep=True).sum() for df in tabelas if df is not None))
+
+
+def memoria_valor(valor, vistos=None):
+    """Estimativa dos bytes de um valor derivado: DataFrames e Series (sem o conteúdo dos textos, para não percorrer
+    cada célula), arrays e, recursivamente, tuplas, listas, dicionários e atributos de objetos (ex.: CuboDiario).
+    Objetos cujo id está em `vistos` (ex.: as tabelas do snapshot referenciadas pelo valor) não são contados."""
+    vistos = set() if vistos is None else vistos
+    if id(valor) in vistos: return 0
+    vistos.add(id(valor))
+    if isinstance(valor, pd.DataFrame): return int(valor.memory_usage(index=True).sum())
+    if isinstance(valor, (pd.Series, pd.Index)): return int(valor.memory_usage())
+    if isinstance(valor, np.ndarray): return valor.nbytes
+    if isinstance(valor, dict): return sum(memoria_valor(item, vistos) for item in valor.values())
+    if isinstance(valor, (list, tuple, set, frozenset)): return sum(memoria_valor(item, vistos) for item in valor)
+    if hasattr(valor, '__dict__'): return memoria_valor(vars(valor), vistos)
+    return sys.getsizeof(valor)
+
+
+class Snapshot:
+    """Versão somente leitura dos dados da clínica, compartilhada por todas as sessões do processo.
+
+    As sessões guardam apenas a referência e o número da versão. Quem precisa alterar os dados
+    trabalha numa cópia e publica o resultado como uma nova versão no repositório (copy-on-write).
+    Com `memoria_maxima` (bytes), os valores derivados usados há mais tempo são descartados enquanto tabelas e
+    derivados juntos passarem dela.
+    """
+
+    def __init__(self, versao, agenda, materiais, ficha, movimentacoes=None, memoria_maxima=None):
+        self.versao = versao
+        self.agenda = agenda
+        self.materiais = materiais
+        self.ficha = ficha
+        self.movimentacoes = movimentacoes
+        self.memoria_maxima = memoria_maxima
+        self.criado_em = time.time()
+        self._memoria = None
+        self._derivados = OrderedDict()
+        # Bytes estimados de cada valor derivado guardado (ver `memoria_valor`)
+        self._memoria_derivados = {}
+        # Valores derivados sendo construídos agora, cada um com o seu Future (ver `derivado`)
+        self._em_construcao = {}
+        self._lock_derivados = threading.Lock()
+
+    def memoria_tabelas(self):
+        """Bytes ocupados pelas tabelas do snapshot (calculado uma vez)."""
+        if self._memoria is None:
+            self._memoria = memoria_tabelas(self.agenda, self.materiais, self.ficha, self.movimentacoes)
+        return self._memoria
+
+    def memoria(self):
+        """Bytes ocupados pelas tabelas mais a estimativa dos valores derivados guardados agora (cubo, modelos de custo...)."""
+        return self.memoria_tabelas() + sum(self._memoria_derivados.values())
+
+    def derivado(self, chave, construir):
+        """Valor calculado a partir deste snapshot (ex.: cubo de KPIs), construído uma única vez por versão.
+        Guarda até MAX_DERIVADOS valores, descartando os usados há mais tempo.
+
+        `construir` roda fora do lock: só quem pede a mesma `chave` enquanto ela é construída espera (e recebe o
+        mesmo valor ou erro); os demais valores continuam sendo servidos e construídos em paralelo."""
+        nome = chave[0] if isinstance(chave, tuple) else chave
+        with self._lock_derivados:
+            chamada = self._em_construcao.get(chave)
+            METRICAS.registrar_cache(f"derivado:{nome}", chave in self._derivados or chamada is not None)
+            if chave in self._derivados:
+                self._derivados.move_to_end(chave)
+                return self._derivados[chave]
+            primeira = chamada is None
+            if primeira:
+                chamada = self._em_construcao[chave] = Future()
+        if not primeira:
+            return chamada.result()
+        try:
+            with METRICAS.etapa(f"calculo:{nome}"):
+                valor = construir()
+            tamanho = memoria_valor(valor, {id(tabela) for tabela in (self.agenda, self.materiais, self.ficha, self.movimentacoes)})
+            memoria_base = self.memoria_tabelas()
+        except BaseException as e:
+            with self._lock_derivados:
+                del self._em_construcao[chave]
+            chamada.set_exception(e)
+            raise
+        with self._lock_derivados:
+            self._derivados[chave] = valor
+            self._memoria_derivados[chave] = tamanho
+            # O valor recém-construído (o último) nunca é descartado, mesmo sozinho acima do limite
+            while len(self._derivados) > MAX_DERIVADOS or (self.memoria_maxima is not None and len(self._derivados) > 1
+                                                           and memoria_base + sum(self._memoria_derivados.values()) > self.memoria_maxima):
+                antiga, _ = self._derivados.popitem(last=False)
+                del self._memoria_derivados[antiga]
+            del self._em_construcao[chave]
+        chamada.set_result(valor)
+        return valor
+
+    def __repr__(self):
+        return f"Snapshot(versao={self.versao}, atendimentos={len(self.agenda)})"
+
+
+def no_derivado(nos, *parametros):
+    """Registra a função decorada como nó de um GrafoDerivados; `parametros` são os filtros que o nó usa."""
+    def registrar(funcao):
+        nos[funcao.__name__] = (funcao, parametros)
+        return funcao
+    return registrar
+
+
+class GrafoDerivados:
+    """Dados derivados de um snapshot declarados como nós preguiçosos: nada é calculado até alguém pedir.
+
+    Cada nó é uma função `(grafo) -> valor` que pode pedir outros nós com `grafo[nome]`. O valor é memoizado
+    no snapshot sob (nome, valores dos parâmetros que o nó usa), então a chave já inclui a versão dos dados e
+    outras sessões e reruns com os mesmos filtros reaproveitam o resultado. Os valores são compartilhados: não alterar.
+    """
+
+    def __init__(self, snapshot, nos, **parametros):
+        self.snapshot = snapshot
+        self.nos = nos
+        self.parametros = parametros
+
+    def __getitem__(self, nome):
+        funcao, parametros = self.nos[nome]
+        chave = (nome,) + tuple(self.parametros[p] for p in parametros)
+        return self.snapshot.derivado(chave, lambda: funcao(self))
+
+
+class RepositorioSnapshots:
+    """Guarda o snapshot atual do processo e o recarrega quando vence o `ttl`.
+
+    `carregar(completo)` devolve (agenda, materiais, ficha, movimentacoes); com `completo=False` a agenda
+    e o livro de movimentações podem ser sincronizados de forma incremental. Apenas uma thread recarrega por vez; as demais esperam e
+    reaproveitam o resultado; uma recarga forçada que esperou por outra iniciada depois do seu pedido (ex.: vários
+    usuários clicando em "Recarregar") também reaproveita o resultado em vez de reler tudo. Se nada mudou, a versão é mantida.
+
+    Com um `cache` em disco (ver CacheDisco), a primeira consulta devolve na hora o último snapshot gravado e a
+    releitura do armazenamento roda em segundo plano; cada versão nova é gravada de volta no cache.
+    `memoria_maxima` é repassada a cada snapshot criado (limite dos valores derivados, ver Snapshot).
+    """
+
+    def __init__(self, carregar, ttl=60, cache=None, memoria_maxima=None):
+        self._carregar = carregar
+        self.ttl = ttl
+        self.memoria_maxima = memoria_maxima
+        self._cache = cache
+        self._atual = None
+        self._ultima_versao = 0
+        self._carregado_em = 0.0
+        self._recarga_iniciada_em = float('-inf')
+        self._recarga_completa = False
+        self._lock = threading.Lock()
+
+    def atual(self):
+        return self._atual
+
+    def _valido(self):
+        return self._atual is not None and time.monotonic() - self._carregado_em < self.ttl
+
+    def obter(self, forcar=False, completo=False):
+        """Retorna o snapshot atual, recarregando-o se ainda não existir, se o ttl venceu ou se `forcar`."""
+        if not forcar and self._valido():
+            return self._atual
+        pedido_em = time.monotonic()
+        with self._lock:
+            if not forcar and self._valido():
+                return self._atual
+            if self._atual is None and not forcar and self._partida_a_quente():
+                return self._atual
+            if forcar and self._atual is not None and self._recarga_iniciada_em >= pedido_em and (self._recarga_completa or not completo):
+                return self._atual
+            iniciada_em = time.monotonic()
+            agenda, materiais, ficha, movimentacoes = self._carregar(completo)
+            atual = self._atual
+            if atual is None or not (agenda is atual.agenda and movimentacoes is atual.movimentacoes
+                                     and materiais.equals(atual.materiais) and ficha.equals(atual.ficha)):
+                self._atual = Snapshot((atual.versao if atual else self._ultima_versao) + 1, agenda, materiais, ficha, movimentacoes, self.memoria_maxima)
+                if self._cache is not None: self._cache.salvar_em_segundo_plano(self._atual)
+            self._carregado_em = time.monotonic()
+            self._recarga_iniciada_em, self._recarga_completa = iniciada_em, completo
+            return self._atual
+
+    def _partida_a_quente(self):
+        """Adota o snapshot gravado no cache em disco (se houver) e dispara a revalidação em segundo plano."""
+        tabelas = self._cache.carregar() if self._cache is not None else None
+        if tabelas is None:
+            return False
+        self._atual = Snapshot(self._ultima_versao + 1, *tabelas, memoria_maxima=self.memoria_maxima)
+        self._carregado_em = time.monotonic()
+        threading.Thread(target=self._revalidar, name="clinflow-revalidacao", daemon=True).start()
+        return True
+
+    def _revalidar(self):
+        try:
+            self.obter(forcar=True)
+        except Exception:
+            logger.exception("Falha ao revalidar o snapshot carregado do cache em disco")
+
+    def descartar(self, esperar=True):
+        """Esquece o snapshot atual (ex.: para liberar memória); a próxima consulta recarrega tudo.
+        Com `esperar=False` desiste (e retorna False) se outra thread estiver recarregando."""
+        if not self._lock.acquire(blocking=esperar):
+            return False
+        try:
+            # As versões continuam a partir da última, para as sessões perceberem a recarga
+            self._ultima_versao = self._atual.versao if self._atual else self._ultima_versao
+            self._atual = None
+            self._carregado_em = 0.0
+            return True
+        finally:
+            self._lock.release()
+
+    def publicar(self, agenda=None, materiais=None, ficha=None, movimentacoes=None):
+        """Publica uma nova versão substituindo apenas as tabelas informadas (ex.: após salvar alterações)."""
+        with self._lock:
+            atual = self._atual
+            if atual is not None:
+                self._atual = Snapshot(
+                    atual.versao + 1,
+                    atual.agenda if agenda is None else agenda,
+                    atual.materiais if materiais is None else materiais,
+                    atual.ficha if ficha is None else ficha,
+                    atual.movimentacoes if movimentacoes is None else movimentacoes,
+                    self.memoria_maxima,
+                )
+                if self._cache is not None: self._cache.salvar_em_segundo_plano(self._atual)
+                return self._atual
+        # Descartado nesse meio tempo (ver `descartar`): o que foi gravado vem na recarga
+        return self.obter(forcar=True)
+
+
+class AtualizadorSegundoPlano(threading.Thread):
+    """Consulta periodicamente a revisão do armazenamento e recarrega o snapshot só quando os dados mudaram.
+
+    A consulta da revisão é barata (ex.: modifiedTime no Drive); a recarga usa o caminho incremental
+    do repositório e publica uma nova versão apenas se o conteúdo realmente mudou. O caminho incremental só
+    enxerga linhas novas e a última linha já lida: se a revisão mudou e ele não achou nada, a alteração foi
+    numa linha antiga e a recarga é refeita por completo. Enquanto `ocioso()` for verdadeiro (ninguém usa os
+    dados), a revisão não é consultada; a primeira verificação depois disso pega o que mudou nesse meio tempo.
+    """
+
+    def __init__(self, repositorio, revisao, intervalo=10, ocioso=None):
+        super().__init__(name="clinflow-atualizador", daemon=True)
+        self.repositorio = repositorio
+        self.intervalo = intervalo
+        self._revisao = revisao
+        self._ocioso = ocioso
+        self._ultima_revisao = None
+        self._parar = threading.Event()
+
+    def run(self):
+        while not self._parar.wait(self.intervalo):
+            if self._ocioso is None or not self._ocioso():
+                self.verificar()
+
+    def verificar(self):
+        """Recarrega o snapshot se a revisão mudou desde a última verificação; retorna True se recarregou."""
+        try:
+            revisao = self._revisao()
+            if revisao == self._ultima_revisao:
+                return False
+            anterior = self.repositorio.atual()
+            if self.repositorio.obter(forcar=True) is anterior and self._ultima_revisao is not None:
+                self.repositorio.obter(forcar=True, completo=True)
+            self._ultima_revisao = revisao
+            return True
+        except Exception:
+            logger.exception("Falha ao verificar atualizações do armazenamento")
+            return False
+
+    def parar(self):
+        self._parar.set()
@@ -0,0 +1,79 @@
+import pandas as pd
+import pytest
+from armazenamento import ABA_AGENDA, ABA_MATERIAIS, ArmazenamentoGSheets, ArmazenamentoSQLite
+from cliente_sheets import ClienteSheets
+
+
+class AbaFalsa:
+    def __init__(self, planilha, cabecalho, col_count):
+        self.spreadsheet, self.id, self.cabecalho, self.col_count = planilha, 7, cabecalho, col_count
+
+    def row_values(self, linha):
+        return list(self.cabecalho)
+
+
+class PlanilhaFalsa:
+    """Registra as requisições de gravação em vez de enviá-las à API."""
+
+    def __init__(self, cabecalho, col_count=None):
+        self.aba = AbaFalsa(self, cabecalho, col_count or len(cabecalho))
+        self.requisicoes = []
+
+    def worksheet(self, nome_aba):
+        return self.aba
+
+    def values_batch_update(self, corpo):
+        self.requisicoes.append(('values_batch_update', corpo))
+
+    def batch_update(self, corpo):
+        self.requisicoes.append(('batch_update', corpo))
+
+    def values_append(self, intervalo, parametros, corpo):
+        self.requisicoes.append(('values_append', intervalo, parametros, corpo))
+
+
+class ClienteFalso:
+    def __init__(self, planilha):
+        self.planilha = planilha
+
+    def open(self, nome):
+        return self.planilha
+
+
+def gsheets(planilha):
+    return ArmazenamentoGSheets(ClienteSheets(ClienteFalso(planilha), tentativas=1), "Clínica")
+
+
+def test_gsheets_grava_celulas_e_linhas_novas_como_texto_digitado():
+    planilha = PlanilhaFalsa(['Material', 'Quantidade em Estoque'])
+    gsheets(planilha).aplicar_alteracoes(ABA_MATERIAIS, {3: {'Quantidade em Estoque': 12.5}}, [{'Material': 'Algodão', 'Quantidade em Estoque': 4}], [5, 6, 8])
+    assert [requisicao[0] for requisicao in planilha.requisicoes] == ['values_batch_update', 'batch_update', 'values_append']
+    _, celulas = planilha.requisicoes[0]
+    assert celulas == {"valueInputOption": "USER_ENTERED", "data": [{"range": f"'{ABA_MATERIAIS}'!B3", "values": [["12.5"]]}]}
+    _, remocoes = planilha.requisicoes[1]
+    assert [r["deleteDimension"]["range"]["startIndex"] for r in remocoes["requests"]] == [7, 4]
+    _, intervalo, parametros, corpo = planilha.requisicoes[2]
+    assert parametros == {"valueInputOption": "USER_ENTERED", "insertDataOption": "INSERT_ROWS"}
+    assert corpo == {"values": [["Algodão", "4"]]}
+
+
+def test_gsheets_cria_coluna_que_falta_no_cabecalho():
+    planilha = PlanilhaFalsa(['Nome do Cliente'])
+    gsheets(planilha).aplicar_alteracoes(ABA_AGENDA, {2: {'ID do Atendimento': 'AT1'}})
+    assert planilha.requisicoes[0] == ('batch_update', {"requests": [{"appendDimension": {"sheetId": 7, "dimension": "COLUMNS", "length": 1}}]})
+    _, celulas = planilha.requisicoes[1]
+    assert [valor["range"] for valor in celulas["data"]] == [f"'{ABA_AGENDA}'!B1", f"'{ABA_AGENDA}'!B2"]
+    assert celulas["valueInputOption"] == "USER_ENTERED"
+
+
+def test_sqlite_somente_leitura_nao_cria_nem_altera_o_banco(tmp_path):
+    caminho = str(tmp_path / "clinica.db")
+    with pytest.raises(FileNotFoundError):
+        ArmazenamentoSQLite(caminho, somente_leitura=True).existe_aba(ABA_MATERIAIS)
+    assert not (tmp_path / "clinica.db").exists()
+    ArmazenamentoSQLite(caminho).salvar_aba(ABA_MATERIAIS, pd.DataFrame({'Material': ['Gaze']}))
+    leitura = ArmazenamentoSQLite(caminho, somente_leitura=True)
+    assert leitura.existe_aba(ABA_MATERIAIS) and not leitura.existe_aba(ABA_AGENDA)
+    with pytest.raises(Exception):
+        leitura.aplicar_alteracoes(ABA_MATERIAIS, linhas_novas=[{'Material': 'Luva'}])
+    assert leitura.ler_linhas(ABA_MATERIAIS) == [['Material'], ['Gaze']]
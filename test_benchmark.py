@@ -0,0 +1,21 @@
+import json
+from benchmark import PIORA_MINIMA, comparar, main
+
+
+def test_comparar_exige_piora_relativa_e_absoluta():
+    baseline = {'rapida': {'segundos': 0.002, 'pico_mb': 0.1}, 'lenta': {'segundos': 1.0, 'pico_mb': 50.0}}
+    resultados = {'rapida': {'segundos': 0.004, 'pico_mb': 0.5}, 'lenta': {'segundos': 1.5, 'pico_mb': 50.5}, 'nova': {'segundos': 9.0, 'pico_mb': 9.0}}
+    regressoes = comparar(resultados, baseline, 0.25, PIORA_MINIMA)
+    assert len(regressoes) == 1 and regressoes[0].startswith("lenta: segundos")
+
+
+def test_sem_baseline_o_benchmark_falha_em_vez_de_passar(tmp_path):
+    caminho = str(tmp_path / "baseline.json")
+    argumentos = ["--tamanhos", "300", "--repeticoes", "1", "--baseline", caminho]
+    assert main(argumentos) == 2
+    assert main(argumentos + ["--gravar-baseline"]) == 0
+    with open(caminho, encoding="utf-8") as arquivo:
+        assert set(json.load(arquivo)) == {"300"}
+    # Tolerância folgada: a mesma máquina, logo em seguida, não pode acusar regressão
+    assert main(argumentos + ["--tolerancia", "100"]) == 0
+    assert main(["--tamanhos", "400", "--repeticoes", "1", "--baseline", caminho]) == 2
@@ -0,0 +1,52 @@
+import json
+import threading
+import pandas as pd
+import pytest
+from armazenamento import ABA_AGENDA, ABA_FICHA, ABA_MATERIAIS
+from cache_disco import CacheDisco
+from dados import limpar_agenda, limpar_ficha, limpar_materiais, limpar_movimentacoes, ordenar_agenda
+from sintetico import gerar_dados
+from snapshot import RepositorioSnapshots, Snapshot
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def snapshot():
+    bruto = gerar_dados(500, anos=1, fim='2026-02-03', semente=3)
+    # Uma coluna a mais no livro, com números e textos misturados como o formulário às vezes grava
+    movimentacoes = limpar_movimentacoes(pd.DataFrame({'Data': ['03/02/2026'] * 2, 'Tipo': ['BAIXA'] * 2, 'Material': ['Gaze', 'Luva'], 'Quantidade': ['-2', '-1'],
+                                                       'Atendimento': ['AT1'] * 2, 'Observação': [''] * 2, 'Extra': [1, 'a']}, dtype=object))
+    return Snapshot(4, ordenar_agenda(limpar_agenda(bruto[ABA_AGENDA].copy())), limpar_materiais(bruto[ABA_MATERIAIS].copy()),
+                    limpar_ficha(bruto[ABA_FICHA].copy()), movimentacoes)
+
+
+def test_tabelas_voltam_do_disco_iguais_com_indice_e_tipos(tmp_path, snapshot):
+    cache = CacheDisco(str(tmp_path), "sqlite:/dados/clinica.db")
+    cache.salvar(snapshot)
+    for original, lida in zip((snapshot.agenda, snapshot.materiais, snapshot.ficha, snapshot.movimentacoes), cache.carregar()):
+        pd.testing.assert_frame_equal(lida, original.astype({'Extra': str}) if 'Extra' in original.columns else original)
+
+
+@pytest.mark.parametrize("campo, valor", [("formato", -1), ("identificador", "sqlite:/outra.db")])
+def test_cache_de_outro_formato_ou_outra_origem_e_ignorado(tmp_path, snapshot, campo, valor):
+    cache = CacheDisco(str(tmp_path), "sqlite:/dados/clinica.db")
+    cache.salvar(snapshot)
+    manifesto = tmp_path / "sqlite_dados_clinica.db" / "manifesto.json"
+    conteudo = json.loads(manifesto.read_text(encoding='utf-8'))
+    manifesto.write_text(json.dumps({**conteudo, campo: valor}), encoding='utf-8')
+    assert cache.carregar() is None
+
+
+def test_partida_a_quente_devolve_o_cache_e_revalida_em_segundo_plano(tmp_path, snapshot):
+    CacheDisco(str(tmp_path), "sqlite:/dados/clinica.db").salvar(snapshot)
+    liberar = threading.Event()
+    def carregar(completo):
+        liberar.wait(5)
+        return snapshot.agenda.iloc[:10], snapshot.materiais, snapshot.ficha, snapshot.movimentacoes
+    repositorio = RepositorioSnapshots(carregar, cache=CacheDisco(str(tmp_path), "sqlite:/dados/clinica.db"))
+    assert len(repositorio.obter().agenda) == len(snapshot.agenda)  # sem esperar a releitura
+    liberar.set()
+    for thread in threading.enumerate():
+        if thread.name == "clinflow-revalidacao": thread.join(5)
+    assert len(repositorio.atual().agenda) == 10
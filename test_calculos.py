@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+import pytest
+from armazenamento import ABA_AGENDA, ABA_FICHA, ABA_MATERIAIS
+from calculos import CuboDiario, ModeloCusto, calcular_analise_clientes, calcular_financeiro, calcular_retencao_coortes, projetar_estoque
+from dados import fatiar_periodo, limpar_agenda, limpar_ficha, limpar_materiais, ordenar_agenda
+from sintetico import gerar_dados
+
+HOJE = pd.Timestamp('2026-02-03')
+
+
+@pytest.fixture(scope="module")
+def dados():
+    bruto = gerar_dados(3_000, anos=1, fim=HOJE, semente=7)
+    agenda = ordenar_agenda(limpar_agenda(bruto[ABA_AGENDA].copy()))
+    materiais, ficha = limpar_materiais(bruto[ABA_MATERIAIS].copy()), limpar_ficha(bruto[ABA_FICHA].copy())
+    return agenda, materiais, ficha, CuboDiario(agenda, ModeloCusto(materiais, ficha))
+
+
+@pytest.mark.parametrize("inicio, fim", [(HOJE.replace(month=1, day=1), HOJE), (HOJE - pd.Timedelta(days=400), HOJE + pd.Timedelta(days=60)),
+                                         (HOJE, HOJE), (HOJE + pd.Timedelta(days=90), HOJE + pd.Timedelta(days=120))])
+def test_totais_do_cubo_batem_com_calcular_financeiro(dados, inicio, fim):
+    agenda, materiais, ficha, cubo = dados
+    profissionais = sorted(agenda['Profissional Responsável'].dropna().unique())[1:]
+    procedimentos = sorted(agenda['Procedimento Realizado'].dropna().unique())[::2]
+    periodo = fatiar_periodo(agenda, inicio, fim)
+    filtrada = periodo[periodo['Profissional Responsável'].isin(profissionais) & periodo['Procedimento Realizado'].isin(procedimentos)]
+    financeiro = calcular_financeiro(filtrada, materiais, ficha)[0]
+    totais = cubo.totais(inicio, fim, profissionais, procedimentos)
+    assert totais['Atendimentos'] == len(filtrada)
+    if filtrada.empty: return
+    assert totais['Receita'] == pytest.approx(financeiro['Receita Total (R$)'].sum())
+    assert totais['Custo'] == pytest.approx(financeiro['Custo Total (R$)'].sum())
+    assert totais['Lucro'] == pytest.approx(financeiro['Lucro Total (R$)'].sum())
+
+
+def test_por_mes_soma_os_totais_da_janela(dados):
+    cubo = dados[3]
+    inicio, fim = HOJE - pd.Timedelta(days=200), HOJE
+    mensal = cubo.por_mes(inicio, fim)
+    totais = cubo.totais(inicio, fim)
+    np.testing.assert_allclose(mensal[CuboDiario.METRICAS].sum().to_numpy(), [totais[m] for m in CuboDiario.METRICAS])
+
+
+def test_cubo_so_guarda_os_dias_com_atendimento(dados):
+    agenda, materiais, ficha, _ = dados
+    # Uma data digitada errada, décadas à frente, não pode multiplicar o tamanho do cubo
+    errada = agenda.iloc[:1].assign(**{'Data do Atendimento': pd.Timestamp('2062-02-03')})
+    cubo = CuboDiario(pd.concat([agenda, errada]), ModeloCusto(materiais, ficha))
+    assert len(cubo.acumulado) == agenda['Data do Atendimento'].dt.normalize().nunique() + 2
+    assert cubo.totais('2062-02-03', '2062-02-03')['Atendimentos'] == 1
+    assert cubo.totais(HOJE + pd.Timedelta(days=365), '2062-02-02')['Atendimentos'] == 0
+    assert cubo.totais('2000-01-01', '2100-01-01')['Atendimentos'] == len(agenda) + 1
+
+
+def test_projetar_estoque_consome_pendentes_hoje_e_agendados_no_dia():
+    materiais = pd.DataFrame({'Material': ['Gaze', 'Luva', 'Álcool'], 'Preco Unitario (R$)': [1.0, 2.0, 3.0],
+                              'Quantidade em Estoque': [10.0, 5.0, 4.0], 'Estoque Mínimo': [2.0, 1.0, 1.0]})
+    ficha = pd.DataFrame({'Procedimento': ['Limpeza', 'Limpeza'], 'Material': ['Gaze', 'Luva'], 'Quantidade Usada': [2.0, 1.0], 'Preco de Venda (R$)': [100.0, 100.0]})
+    dias = [-1, -2, 1, 3, 36_000]  # um pendente, um já baixado, dois agendados e um digitado décadas à frente
+    agenda = pd.DataFrame({'Data do Atendimento': [HOJE + pd.Timedelta(days=d) for d in dias], 'Procedimento Realizado': ['Limpeza'] * 5,
+                           'Estoque Deduzido': [False, True, False, False, False]})
+    projecao = projetar_estoque(agenda, materiais, ModeloCusto(materiais, ficha), HOJE).set_index('Material')
+    assert projecao['Consumo Agendado'].tolist() == [8.0, 4.0, 0.0]
+    assert projecao['Estoque Projetado'].tolist() == [2.0, 1.0, 4.0]
+    assert projecao.loc['Gaze', 'Atinge o Mínimo em'] == HOJE + pd.Timedelta(days=36_000)
+    assert projecao.loc['Luva', 'Atinge o Mínimo em'] == HOJE + pd.Timedelta(days=36_000)
+    assert projecao['Ruptura Prevista'].isna().all()
+    assert pd.isna(projecao.loc['Álcool', 'Atinge o Mínimo em'])
+
+
+def test_projetar_estoque_aponta_o_dia_da_ruptura():
+    materiais = pd.DataFrame({'Material': ['Gaze'], 'Preco Unitario (R$)': [1.0], 'Quantidade em Estoque': [5.0], 'Estoque Mínimo': [2.0]})
+    ficha = pd.DataFrame({'Procedimento': ['Limpeza'], 'Material': ['Gaze'], 'Quantidade Usada': [2.0], 'Preco de Venda (R$)': [100.0]})
+    agenda = pd.DataFrame({'Data do Atendimento': [HOJE - pd.Timedelta(days=1), HOJE + pd.Timedelta(days=4), HOJE + pd.Timedelta(days=9)],
+                           'Procedimento Realizado': ['Limpeza'] * 3, 'Estoque Deduzido': [False] * 3})
+    projecao = projetar_estoque(agenda, materiais, ModeloCusto(materiais, ficha), HOJE).iloc[0]
+    assert projecao['Atinge o Mínimo em'] == HOJE + pd.Timedelta(days=4)
+    assert projecao['Ruptura Prevista'] == HOJE + pd.Timedelta(days=9)
+    vazia = projetar_estoque(agenda.iloc[:0], materiais, ModeloCusto(materiais, ficha), HOJE).iloc[0]
+    assert vazia['Consumo Agendado'] == 0 and pd.isna(vazia['Ruptura Prevista'])
+
+
+def nota_quintil(valor, todos):
+    """Nota RFM de um valor, contada cliente a cliente: quintil da sua posição média entre `todos` (1 a 5)."""
+    posicao = sum(outro < valor for outro in todos) + (sum(outro == valor for outro in todos) + 1) / 2
+    return min(max(int(np.ceil(posicao / len(todos) * 5)), 1), 5)
+
+
+def test_analise_de_clientes_bate_com_o_calculo_cliente_a_cliente(dados):
+    agenda, materiais, ficha, _ = dados
+    com_preco = calcular_financeiro(agenda, materiais, ficha)[2]
+    analise = calcular_analise_clientes(com_preco, HOJE).set_index('Cliente')
+    esperado = {}
+    for cliente, visitas in com_preco.groupby(com_preco['Nome do Cliente'].astype(object)):
+        esperado[cliente] = (visitas['Preco Venda (R$)'].sum(), visitas['Data do Atendimento'].count(), (HOJE - visitas['Data do Atendimento'].max().normalize()).days)
+    assert sorted(analise.index) == sorted(esperado)
+    gastos, frequencias, recencias = ([valores[i] for valores in esperado.values()] for i in range(3))
+    for cliente, (gasto, frequencia, recencia) in esperado.items():
+        linha = analise.loc[cliente]
+        assert linha['Total Gasto (R$)'] == pytest.approx(gasto) and linha['Nº de Visitas'] == frequencia
+        assert linha['Ticket Médio (R$)'] == pytest.approx(gasto / frequencia) and linha['Recência (dias)'] == recencia
+        notas = (nota_quintil(-recencia, [-r for r in recencias]), nota_quintil(frequencia, frequencias), nota_quintil(gasto, gastos))
+        assert (linha['R'], linha['F'], linha['M']) == notas and linha['RFM'] == ''.join(map(str, notas))
+    assert analise['Total Gasto (R$)'].is_monotonic_decreasing
+
+
+def test_retencao_por_coorte_do_primeiro_mes_de_cada_cliente():
+    agenda = pd.DataFrame({'Nome do Cliente': ['Ana', 'Ana', 'Ana', 'Bia', 'Bia', 'Caio', None],
+                           'Data do Atendimento': pd.to_datetime(['2026-01-05', '2026-01-20', '2026-03-02', '2026-01-10', '2026-02-10', '2026-02-01', '2026-01-01'])})
+    retencao = calcular_retencao_coortes(agenda)
+    assert retencao.index.tolist() == ['2026-01', '2026-02']
+    assert retencao['Clientes'].tolist() == [2, 1]
+    assert retencao.loc['2026-01', ['Mês 0', 'Mês 1', 'Mês 2']].tolist() == [1.0, 0.5, 0.5]
+    assert retencao.loc['2026-02', ['Mês 0', 'Mês 1']].tolist() == [1.0, 0.0]
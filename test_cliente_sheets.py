@@ -0,0 +1,96 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import gspread
+import pytest
+import requests
+from cliente_sheets import BaldeDeFichas, ClienteSheets
+
+
+def erro_api(codigo):
+    resposta = requests.Response()
+    resposta.status_code = codigo
+    resposta._content = f'{{"error": {{"code": {codigo}, "message": "falha", "status": "ERRO"}}}}'.encode()
+    return gspread.exceptions.APIError(resposta)
+
+
+class Falhas:
+    """Chamada que levanta os erros de `erros`, um por tentativa, e depois devolve 'ok'."""
+
+    def __init__(self, *erros):
+        self.erros = list(erros)
+        self.tentativas = 0
+
+    def __call__(self):
+        self.tentativas += 1
+        if self.erros: raise self.erros.pop(0)
+        return 'ok'
+
+
+def cliente(**opcoes):
+    chamadas = []
+    return ClienteSheets(None, espera_inicial=0.001, registrar=lambda nome, segundos, erro: chamadas.append((nome, erro)), **opcoes), chamadas
+
+
+def test_chamadas_identicas_simultaneas_vao_uma_vez_a_api():
+    sheets, chamadas = cliente()
+    liberar = threading.Event()
+    def ler():
+        liberar.wait(1)
+        return object()
+    with ThreadPoolExecutor(4) as executor:
+        pedidos = [executor.submit(sheets.executar, ('ler', 'Planilha', 'A1:B2'), ler) for _ in range(4)]
+        time.sleep(0.05)
+        liberar.set()
+        resultados = [pedido.result() for pedido in pedidos]
+    assert chamadas == [('sheets.ler', False)] and all(resultado is resultados[0] for resultado in resultados)
+    # Terminada a chamada, a próxima com a mesma chave vai à API de novo
+    sheets.executar(('ler', 'Planilha', 'A1:B2'), lambda: None)
+    assert len(chamadas) == 2
+
+
+def test_falhas_passageiras_sao_repetidas_com_espera():
+    sheets, chamadas = cliente()
+    funcao = Falhas(erro_api(503), requests.exceptions.ConnectionError(), erro_api(429))
+    assert sheets.executar(('ler',), funcao) == 'ok'
+    assert funcao.tentativas == 4 and [erro for _, erro in chamadas] == [True, True, True, False]
+
+
+def test_gravacao_que_nao_pode_repetir_so_tenta_de_novo_a_recusa_por_cota():
+    sheets, _ = cliente()
+    assert sheets.executar(None, Falhas(erro_api(429)), repetir=False) == 'ok'
+    for erro in (erro_api(503), requests.exceptions.ConnectionError()):
+        funcao = Falhas(erro)
+        with pytest.raises(type(erro)):
+            sheets.executar(None, funcao, repetir=False)
+        assert funcao.tentativas == 1
+
+
+def test_erro_permanente_e_falhas_alem_das_tentativas_sobem():
+    sheets, _ = cliente(tentativas=3)
+    funcao = Falhas(erro_api(400))
+    with pytest.raises(gspread.exceptions.APIError):
+        sheets.executar(('ler',), funcao)
+    assert funcao.tentativas == 1
+    funcao = Falhas(*[erro_api(503)] * 3)
+    with pytest.raises(gspread.exceptions.APIError):
+        sheets.executar(('ler',), funcao)
+    assert funcao.tentativas == 3
+
+
+def test_balde_libera_a_rajada_e_depois_segura_no_ritmo_configurado():
+    balde = BaldeDeFichas(3, por_segundo=20)
+    inicio = time.monotonic()
+    for _ in range(3): balde.retirar()
+    assert time.monotonic() - inicio < 0.04
+    for _ in range(2): balde.retirar()
+    assert time.monotonic() - inicio >= 0.09
+
+
+def test_consultas_ao_drive_usam_balde_proprio():
+    sheets, chamadas = cliente(requisicoes_por_minuto=1, requisicoes_drive_por_minuto=6000)
+    sheets.executar(('ler',), lambda: None)  # gasta a única ficha do Sheets
+    inicio = time.monotonic()
+    for _ in range(5): sheets.executar(('revisao', 'id'), lambda: None, api='drive')
+    assert time.monotonic() - inicio < 0.5
+    assert [nome for nome, _ in chamadas] == ['sheets.ler'] + ['drive.revisao'] * 5
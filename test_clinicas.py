@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+from armazenamento import ABA_AGENDA, ABA_FICHA, ABA_MATERIAIS, ArmazenamentoSQLite
+from clinicas import Clinica, GerenciadorClinicas, LimiteMemoriaClinica
+
+
+def criar_clinica(caminho, atendimentos=1):
+    """Banco SQLite com as abas de uma clínica e `atendimentos` linhas na agenda."""
+    banco = ArmazenamentoSQLite(str(caminho))
+    banco.salvar_aba(ABA_AGENDA, pd.DataFrame({'Data do Atendimento': '03/02/2026', 'Nome do Cliente': [f'Cliente {i}' for i in range(atendimentos)],
+                                               'Procedimento Realizado': 'Limpeza', 'Profissional Responsável': 'Dra. A', 'Horário do Atendimento': '10:00'}))
+    banco.salvar_aba(ABA_MATERIAIS, pd.DataFrame({'Material': ['Gaze'], 'Preco Unitario (R$)': ['1'], 'Quantidade em Estoque': ['10'], 'Estoque Mínimo': ['2']}))
+    banco.salvar_aba(ABA_FICHA, pd.DataFrame({'Procedimento': ['Limpeza'], 'Material': ['Gaze'], 'Quantidade Usada': ['2'], 'Preco de Venda (R$)': ['100']}))
+    return banco
+
+
+def test_carga_acima_do_limite_da_clinica_e_recusada_e_mantem_a_versao_anterior(tmp_path):
+    banco = criar_clinica(tmp_path / "clinica.db")
+    clinica = Clinica("Centro", banco, ttl=0)
+    anterior = clinica.repositorio.obter()
+    clinica.memoria_maxima = anterior.memoria_tabelas()
+    banco.aplicar_alteracoes(ABA_AGENDA, linhas_novas=[{'Data do Atendimento': '04/02/2026', 'Nome do Cliente': 'Nova',
+                                                         'Procedimento Realizado': 'Limpeza', 'Profissional Responsável': 'Dra. A', 'Horário do Atendimento': '11:00'}])
+    with pytest.raises(LimiteMemoriaClinica, match="memoria_mb"):
+        clinica.repositorio.obter(forcar=True)
+    assert clinica.repositorio.atual() is anterior
+    assert all(sinc.dados is None for sinc in clinica.sincronizadores.values())
+
+
+def test_gerenciador_descarta_a_clinica_usada_ha_mais_tempo(tmp_path):
+    bancos = {nome: criar_clinica(tmp_path / f"{nome}.db", 50) for nome in "ABC"}
+    gerenciador = GerenciadorClinicas({nome: {"origem": nome} for nome in bancos}, bancos.get, intervalo_atualizacao=3600)
+    for nome in "AB":
+        gerenciador.repositorio(nome).obter()
+    memoria = gerenciador.clinica("A").memoria()
+    gerenciador.orcamento_memoria = 2 * memoria + memoria // 2
+    gerenciador.repositorio("B").obter()  # B passa a ser a mais recente e A a usada há mais tempo
+    gerenciador.repositorio("C").obter()
+    assert [nome for nome, snapshot in gerenciador.snapshots_atuais().items() if snapshot is not None] == ["B", "C"]
+    for nome in "ABC": gerenciador.clinica(nome).desativar()
+
+
+def test_limite_da_configuracao_chega_ao_snapshot_em_bytes(tmp_path):
+    banco = criar_clinica(tmp_path / "clinica.db")
+    gerenciador = GerenciadorClinicas({"Centro": {"origem": "x", "memoria_mb": 1.5}}, lambda origem: banco, intervalo_atualizacao=3600)
+    clinica = gerenciador.clinica("Centro")
+    assert clinica.memoria_maxima == 3 << 19
+    assert clinica.repositorio.obter().memoria_maxima == 3 << 19
+    clinica.desativar()
@@ -0,0 +1,276 @@
+import pandas as pd
+import pytest
+from armazenamento import ABA_AGENDA, ABA_FICHA, ABA_MATERIAIS, ABA_MOVIMENTACOES, ArmazenamentoSQLite, garantir_abas_do_sistema
+from dados import (ConflitoDeEdicao, SincronizadorAgenda, SincronizadorMovimentacoes, alteracoes_do_editor, aplicar_alteracoes, buscar_texto, carregar_dados,
+                   converter_datas, converter_numeros, gravar_alteracoes, limpar_agenda, limpar_materiais, mesclar_alteracoes, montar_visao_semana, ordenar_agenda, para_edicao)
+
+
+def materiais(*linhas, primeira_linha=2):
+    """Aba Materiais crua (como lida da planilha), indexada pela linha da planilha."""
+    df = pd.DataFrame(linhas, columns=['Material', 'Preco Unitario (R$)', 'Quantidade em Estoque', 'Estoque Mínimo'])
+    df.index = pd.RangeIndex(primeira_linha, primeira_linha + len(df))
+    return df
+
+
+@pytest.fixture
+def banco(tmp_path):
+    armazenamento = ArmazenamentoSQLite(str(tmp_path / "clinica.db"))
+    armazenamento.salvar_aba(ABA_MATERIAIS, materiais(['Gaze', '1', '10', '2'], ['Luva', '2', '20', '5'], ['Seringa', '3', '30', '5']))
+    return armazenamento
+
+
+def ler_materiais(armazenamento):
+    return limpar_materiais(armazenamento.ler_aba(ABA_MATERIAIS))
+
+
+def test_mesclar_acompanha_linha_que_mudou_de_posicao():
+    base = materiais(['Gaze', 1, 10, 2], ['Luva', 2, 20, 5], ['Seringa', 3, 30, 5])
+    # Outra pessoa apagou a primeira linha: a Luva subiu da linha 3 para a 2
+    atual = materiais(['Luva', 2, 20, 5], ['Seringa', 3, 30, 5])
+    celulas, removidas = mesclar_alteracoes(ABA_MATERIAIS, base, atual, {3: {'Estoque Mínimo': 7}}, [4])
+    assert celulas == {2: {'Estoque Mínimo': 7}}
+    assert removidas == [3]
+
+
+def test_mesclar_preserva_alteracoes_de_outras_pessoas_em_outras_colunas():
+    base = materiais(['Gaze', 1, 10, 2])
+    atual = materiais(['Gaze', 1, 99, 2])
+    assert mesclar_alteracoes(ABA_MATERIAIS, base, atual, {2: {'Estoque Mínimo': 3}}) == ({2: {'Estoque Mínimo': 3}}, [])
+
+
+def test_mesclar_recusa_celula_alterada_por_outra_pessoa():
+    base = materiais(['Gaze', 1, 10, 2])
+    atual = materiais(['Gaze', 1, 10, 4])
+    with pytest.raises(ConflitoDeEdicao) as erro:
+        mesclar_alteracoes(ABA_MATERIAIS, base, atual, {2: {'Estoque Mínimo': 3}})
+    assert erro.value.linhas == [2]
+
+
+def test_mesclar_recusa_linha_que_sumiu_ou_ficou_ambigua():
+    base = materiais(['Gaze', 1, 10, 2], ['Luva', 2, 20, 5])
+    with pytest.raises(ConflitoDeEdicao):
+        mesclar_alteracoes(ABA_MATERIAIS, base, materiais(['Luva', 2, 20, 5]), {2: {'Estoque Mínimo': 3}})
+    with pytest.raises(ConflitoDeEdicao):
+        mesclar_alteracoes(ABA_MATERIAIS, base, materiais(['Luva', 2, 20, 5], ['Gaze', 1, 10, 2], ['Gaze', 1, 10, 2]), {2: {'Estoque Mínimo': 3}})
+
+
+def test_mesclar_ignora_remocao_ja_feita_e_recusa_remover_linha_editada():
+    base = materiais(['Gaze', 1, 10, 2], ['Luva', 2, 20, 5])
+    assert mesclar_alteracoes(ABA_MATERIAIS, base, materiais(['Luva', 2, 20, 5]), linhas_removidas=[2]) == ({}, [])
+    with pytest.raises(ConflitoDeEdicao):
+        mesclar_alteracoes(ABA_MATERIAIS, base, materiais(['Gaze', 1, 11, 2], ['Luva', 2, 20, 5]), linhas_removidas=[2])
+
+
+def test_aplicar_alteracoes_renumera_como_a_planilha():
+    df = aplicar_alteracoes(materiais(['Gaze', 1, 10, 2], ['Luva', 2, 20, 5], ['Seringa', 3, 30, 5]),
+                            {4: {'Estoque Mínimo': 9}}, [{'Material': 'Algodão'}], [2])
+    assert list(df.index) == [2, 3, 4]
+    assert list(df['Material']) == ['Luva', 'Seringa', 'Algodão']
+    assert df.at[3, 'Estoque Mínimo'] == 9
+
+
+def test_gravar_alteracoes_mescla_com_edicao_concorrente(banco):
+    base = ler_materiais(banco)
+    # Outra sessão muda o estoque da Luva antes desta gravar o mínimo da Seringa
+    gravar_alteracoes(banco, ABA_MATERIAIS, base, {3: {'Quantidade em Estoque': 25}})
+    gravado = gravar_alteracoes(banco, ABA_MATERIAIS, base, {4: {'Estoque Mínimo': 8}})
+    relido = ler_materiais(banco)
+    pd.testing.assert_frame_equal(gravado, relido, check_dtype=False)
+    assert relido.set_index('Material').loc['Luva', 'Quantidade em Estoque'] == 25
+    assert relido.set_index('Material').loc['Seringa', 'Estoque Mínimo'] == 8
+
+
+def test_gravar_alteracoes_em_conflito_nao_grava_nada(banco):
+    base = ler_materiais(banco)
+    gravar_alteracoes(banco, ABA_MATERIAIS, base, {3: {'Estoque Mínimo': 6}})
+    antes = banco.ler_linhas(ABA_MATERIAIS)
+    with pytest.raises(ConflitoDeEdicao):
+        gravar_alteracoes(banco, ABA_MATERIAIS, base, {3: {'Estoque Mínimo': 7}, 4: {'Estoque Mínimo': 1}})
+    assert banco.ler_linhas(ABA_MATERIAIS) == antes
+
+
+def test_gravar_alteracoes_anexa_sem_reler(banco):
+    base = ler_materiais(banco)
+    gravado = gravar_alteracoes(banco, ABA_MATERIAIS, base, linhas_novas=[{'Material': 'Algodão', 'Preco Unitario (R$)': '0,50'}], reler=False)
+    assert gravado.at[5, 'Material'] == 'Algodão'
+    assert banco.ler_linhas(ABA_MATERIAIS)[-1][:2] == ['Algodão', '0,50']
+
+
+def test_converter_numeros_aceita_formato_brasileiro():
+    convertido = converter_numeros(pd.Series(['R$ 1.234,56', '10', '2.5', '', 'abc', None], dtype=object))
+    assert convertido.iloc[:3].tolist() == [1234.56, 10.0, 2.5]
+    assert convertido.iloc[3:].isna().all()
+
+
+def test_converter_datas_usa_formatos_explicitos():
+    convertido = converter_datas(pd.Series(['03/02/2026', '2026-02-03', '03/02/2026 10:30', '2026-02-03T00:00:00.000', '02-03-2026', '']))
+    assert convertido.iloc[0] == pd.Timestamp('2026-02-03')
+    assert convertido.iloc[1] == pd.Timestamp('2026-02-03')
+    assert convertido.iloc[2] == pd.Timestamp('2026-02-03 10:30')
+    assert convertido.iloc[3] == pd.Timestamp('2026-02-03')
+    assert convertido.iloc[4:].isna().all()
+
+
+def test_data_editada_no_editor_volta_como_data_depois_de_gravar_e_reler(tmp_path):
+    banco = ArmazenamentoSQLite(str(tmp_path / "clinica.db"))
+    banco.salvar_aba(ABA_AGENDA, pd.DataFrame({'Data do Atendimento': ['03/02/2026', '04/02/2026'], 'Nome do Cliente': ['Ana', 'Bia'],
+                                               'Procedimento Realizado': ['Limpeza'] * 2, 'Profissional Responsável': ['Dra. A'] * 2,
+                                               'Horário do Atendimento': ['10:00'] * 2}))
+    base = ordenar_agenda(limpar_agenda(banco.ler_aba(ABA_AGENDA)))
+    # O st.data_editor devolve a data editada como texto ISO
+    celulas, _, _ = alteracoes_do_editor(para_edicao(base), {"edited_rows": {0: {'Data do Atendimento': '2026-02-05T00:00:00.000'}}})
+    gravado = gravar_alteracoes(banco, ABA_AGENDA, base, celulas)
+    quarentena = []
+    relido = limpar_agenda(banco.ler_aba(ABA_AGENDA), quarentena)
+    assert banco.ler_linhas(ABA_AGENDA)[1][0] == '05/02/2026'
+    assert gravado.at[2, 'Data do Atendimento'] == relido.at[2, 'Data do Atendimento'] == pd.Timestamp('2026-02-05')
+    assert not quarentena
+
+
+def test_alteracoes_do_editor_traduz_posicoes_em_linhas_da_planilha():
+    pagina = materiais(['Gaze', 1, 10, 2], ['Luva', 2, 20, 5], primeira_linha=40)
+    estado = {"edited_rows": {1: {'Estoque Mínimo': 6}}, "added_rows": [{'_index': 0, 'Material': 'Algodão'}], "deleted_rows": [0]}
+    assert alteracoes_do_editor(pagina, estado) == ({41: {'Estoque Mínimo': 6}}, [{'Material': 'Algodão'}], [40])
+
+
+def test_gravar_alteracoes_relendo_so_as_linhas_tocadas(banco):
+    tabela = ler_materiais(banco)
+    pagina = tabela.loc[[3, 4]]
+    gravado = gravar_alteracoes(banco, ABA_MATERIAIS, pagina, {3: {'Estoque Mínimo': 9}}, linhas_removidas=[4], tabela=tabela)
+    assert list(gravado['Material']) == ['Gaze', 'Luva']
+    assert gravado.set_index('Material').loc['Luva', 'Estoque Mínimo'] == 9
+    assert list(ler_materiais(banco)['Material']) == ['Gaze', 'Luva']
+
+
+def test_buscar_texto_em_colunas_categoricas_e_de_texto():
+    df = pd.DataFrame({'Material': pd.Categorical(['Gaze', 'Luva', None]), 'Obs': ['luva nova', None, 'GAZE']})
+    assert buscar_texto(df, ' gaze ', ['Material']).tolist() == [True, False, False]
+    assert buscar_texto(df, 'gaze', ['Material', 'Obs']).tolist() == [True, False, True]
+    assert buscar_texto(df, '', ['Material']).all()
+
+
+class ArmazenamentoContado(ArmazenamentoSQLite):
+    """SQLite que anota as leituras feitas e os intervalos pedidos em cada uma."""
+
+    def __init__(self, caminho):
+        super().__init__(caminho)
+        self.pedidos = []
+        self.leituras = 0
+
+    def ler_intervalos(self, pedidos):
+        self.pedidos += pedidos
+        self.leituras += 1
+        return super().ler_intervalos(pedidos)
+
+
+def linha_agenda(cliente, data='03/02/2026'):
+    return {'Data do Atendimento': data, 'Nome do Cliente': cliente, 'Procedimento Realizado': 'Limpeza',
+            'Profissional Responsável': 'Dra. A', 'Horário do Atendimento': '10:00'}
+
+
+@pytest.fixture
+def agenda_sincronizada(tmp_path):
+    banco = ArmazenamentoContado(str(tmp_path / "clinica.db"))
+    banco.salvar_aba(ABA_AGENDA, pd.DataFrame([linha_agenda('Ana'), linha_agenda('Bia'), linha_agenda('Caio')]))
+    sincronizador = SincronizadorAgenda(banco)
+    sincronizador.sincronizar()
+    banco.pedidos.clear()
+    return banco, sincronizador
+
+
+def test_sincronizacao_le_so_a_ancora_e_as_linhas_novas(agenda_sincronizada):
+    banco, sincronizador = agenda_sincronizada
+    banco.aplicar_alteracoes(ABA_AGENDA, linhas_novas=[linha_agenda('Davi'), linha_agenda('Eva')])
+    agenda = sincronizador.sincronizar()
+    assert banco.pedidos == [(ABA_AGENDA, 2, 5)]
+    assert agenda.sort_index()['Nome do Cliente'].tolist() == ['Ana', 'Bia', 'Caio', 'Davi', 'Eva']
+    banco.pedidos.clear()
+    sincronizador.sincronizar()
+    assert banco.pedidos == [(ABA_AGENDA, 4, 5)]  # a âncora passou a ser a linha 6
+
+
+@pytest.mark.parametrize('mudanca', [{'celulas': {4: {'Nome do Cliente': 'Carla'}}}, {'linhas_removidas': [4]}, {'linhas_removidas': [2]}],
+                         ids=['ancora-editada', 'aba-encolheu', 'linhas-renumeradas'])
+def test_sincronizacao_rele_a_aba_quando_a_ancora_nao_confere(agenda_sincronizada, mudanca):
+    banco, sincronizador = agenda_sincronizada
+    banco.aplicar_alteracoes(ABA_AGENDA, **mudanca)
+    agenda = sincronizador.sincronizar()
+    assert banco.pedidos[-1] == (ABA_AGENDA, 0, None)
+    relida = limpar_agenda(banco.ler_aba(ABA_AGENDA))
+    assert agenda.sort_index()['Nome do Cliente'].tolist() == relida.sort_index()['Nome do Cliente'].tolist()
+
+
+def test_edicao_no_meio_da_aba_chega_na_recarga_completa_periodica(agenda_sincronizada):
+    banco, sincronizador = agenda_sincronizada
+    banco.aplicar_alteracoes(ABA_AGENDA, celulas={2: {'Nome do Cliente': 'Aline'}})
+    assert sincronizador.sincronizar().at[2, 'Nome do Cliente'] == 'Ana'  # a âncora não mudou
+    sincronizador.intervalo_recarga_completa = 0
+    assert sincronizador.sincronizar().at[2, 'Nome do Cliente'] == 'Aline'
+
+
+def test_sincronizacao_continua_incremental_depois_de_gravar(agenda_sincronizada):
+    banco, sincronizador = agenda_sincronizada
+    celulas = {3: {'Nome do Cliente': 'Beatriz'}, 4: {'Horário do Atendimento': '11:00'}}  # a linha 4 é a âncora
+    gravado = gravar_alteracoes(banco, ABA_AGENDA, sincronizador.dados, celulas, tabela=sincronizador.dados)
+    sincronizador.adotar(gravado, celulas)
+    banco.aplicar_alteracoes(ABA_AGENDA, linhas_novas=[linha_agenda('Davi')])  # nova resposta do formulário
+    banco.pedidos.clear()
+    agenda = sincronizador.sincronizar()
+    assert banco.pedidos == [(ABA_AGENDA, 2, 5)]  # só a âncora e as linhas seguintes
+    assert agenda.sort_index()['Nome do Cliente'].tolist() == ['Ana', 'Beatriz', 'Caio', 'Davi']
+    assert agenda.at[4, 'Horário do Atendimento'] == '11:00'
+
+
+def test_linhas_anexadas_na_gravacao_chegam_uma_vez_na_sincronizacao(agenda_sincronizada):
+    banco, sincronizador = agenda_sincronizada
+    gravado = gravar_alteracoes(banco, ABA_AGENDA, sincronizador.dados, linhas_novas=[linha_agenda('Davi')])
+    sincronizador.adotar(gravado)
+    banco.pedidos.clear()
+    assert sincronizador.sincronizar().sort_index()['Nome do Cliente'].tolist() == ['Ana', 'Bia', 'Caio', 'Davi']
+    assert banco.pedidos == [(ABA_AGENDA, 2, 5)]
+
+
+def test_adotar_sem_as_linhas_ja_sincronizadas_rele_a_aba(agenda_sincronizada):
+    banco, sincronizador = agenda_sincronizada
+    gravado = gravar_alteracoes(banco, ABA_AGENDA, sincronizador.dados, linhas_removidas=[2])
+    sincronizador.adotar(gravado)
+    banco.pedidos.clear()
+    assert sincronizador.sincronizar().sort_index()['Nome do Cliente'].tolist() == ['Bia', 'Caio']
+    assert banco.pedidos[0] == (ABA_AGENDA, 0, None)
+
+
+def test_adotar_tira_da_quarentena_a_celula_corrigida(tmp_path):
+    banco = ArmazenamentoSQLite(str(tmp_path / "clinica.db"))
+    banco.salvar_aba(ABA_AGENDA, pd.DataFrame([linha_agenda('Ana', 'ontem'), linha_agenda('Bia')]))
+    sincronizador = SincronizadorAgenda(banco)
+    sincronizador.sincronizar()
+    assert [parte['Linha'].tolist() for parte in sincronizador.quarentena] == [[2]]
+    celulas = {2: {'Data do Atendimento': pd.Timestamp('2026-02-02')}}
+    sincronizador.adotar(gravar_alteracoes(banco, ABA_AGENDA, sincronizador.dados, celulas, tabela=sincronizador.dados), celulas)
+    assert all(parte.empty for parte in sincronizador.quarentena)
+
+
+def test_carregar_dados_le_as_quatro_abas_numa_unica_leitura(agenda_sincronizada):
+    banco, sincronizador = agenda_sincronizada
+    banco.salvar_aba(ABA_MATERIAIS, materiais(['Gaze', '1', '10', '2']))
+    banco.salvar_aba(ABA_FICHA, pd.DataFrame({'Procedimento': ['Limpeza'], 'Material': ['Gaze'], 'Quantidade Usada': ['2'], 'Preco de Venda (R$)': ['100']}))
+    garantir_abas_do_sistema(banco)
+    movimentacoes = SincronizadorMovimentacoes(banco)
+    banco.leituras = 0
+    agenda, tabela_materiais, ficha, livro = carregar_dados(banco, sincronizador, True, movimentacoes)
+    assert banco.leituras == 1
+    assert [pedido[0] for pedido in banco.pedidos[-4:]] == [ABA_MATERIAIS, ABA_FICHA, ABA_AGENDA, ABA_MOVIMENTACOES]
+    assert len(agenda) == 3 and tabela_materiais['Material'].tolist() == ['Gaze'] and len(ficha) == 1 and livro.empty
+    banco.aplicar_alteracoes(ABA_AGENDA, linhas_novas=[linha_agenda('Davi')])
+    banco.leituras = 0
+    assert len(carregar_dados(banco, sincronizador, False, movimentacoes)[0]) == 4
+    assert banco.leituras == 1 and banco.pedidos[-2] == (ABA_AGENDA, 2, 5)
+
+
+def test_visao_da_semana_tem_todos_os_dias_e_atendimentos_em_ordem_de_horario():
+    linhas = [('Ana', '03/02/2026', '14:00'), ('Bia', '03/02/2026', '09:30'), ('Caio', '05/02/2026', '10:00'), ('Davi', '10/02/2026', '10:00'), ('Eva', '02/02/2026', '08:00')]
+    bruta = pd.DataFrame([{**linha_agenda(cliente, data), 'Horário do Atendimento': horario} for cliente, data, horario in linhas], index=range(2, 7))
+    semana = montar_visao_semana(ordenar_agenda(limpar_agenda(bruta)), '2026-02-03 15:00')
+    assert list(semana) == list(pd.date_range('2026-02-03', periods=7).date)
+    assert semana[pd.Timestamp('2026-02-03').date()] == [('09:30', 'Bia', 'Limpeza', 'Dra. A'), ('14:00', 'Ana', 'Limpeza', 'Dra. A')]
+    assert [cliente for atendimentos in semana.values() for _, cliente, _, _ in atendimentos] == ['Bia', 'Ana', 'Caio']
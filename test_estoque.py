@@ -0,0 +1,78 @@
+import pandas as pd
+from calculos import ModeloCusto
+from dados import aplicar_alteracoes, limpar_agenda, limpar_movimentacoes
+from estoque import (COLUNA_ID_ATENDIMENTO, TIPO_BAIXA, atendimentos_baixados, atribuir_ids, estoque_atual, ids_atendimentos, ids_legados,
+                     movimentos_de_baixa)
+
+
+def agenda(*linhas):
+    """Agenda limpa, indexada pela linha da planilha, com (cliente, data, procedimento) por atendimento."""
+    bruta = pd.DataFrame([{'Carimbo de data/hora': '01/02/2026 08:00:00', 'Nome do Cliente': cliente, 'Data do Atendimento': data, 'Horário do Atendimento': '10:00',
+                           'Procedimento Realizado': procedimento, 'Profissional Responsável': 'Dra. A'} for cliente, data, procedimento in linhas])
+    bruta.index = pd.RangeIndex(2, 2 + len(bruta))
+    return limpar_agenda(bruta)
+
+
+def modelo():
+    materiais = pd.DataFrame({'Material': ['Gaze', 'Luva'], 'Preco Unitario (R$)': [1.0, 2.0], 'Quantidade em Estoque': [10.0, 20.0], 'Estoque Mínimo': [2.0, 5.0]})
+    ficha = pd.DataFrame({'Procedimento': ['Limpeza', 'Limpeza', 'Avaliação'], 'Material': ['Gaze', 'Luva', None],
+                          'Quantidade Usada': [2.0, 1.0, 0.0], 'Preco de Venda (R$)': [100.0, 100.0, 50.0]})
+    return materiais, ModeloCusto(materiais, ficha)
+
+
+def test_atribuir_ids_completa_so_os_vazios_e_grava_os_que_faltam():
+    df = agenda(('Ana', '02/02/2026', 'Limpeza'), ('Bia', '02/02/2026', 'Limpeza'))
+    df.at[3, COLUNA_ID_ATENDIMENTO] = 'ATfixo'
+    ids, celulas = atribuir_ids(df, ids_atendimentos(df))
+    assert ids[3] == 'ATfixo'
+    assert ids[2].startswith('AT') and ids[2] != 'ATfixo'
+    assert celulas == {2: {COLUNA_ID_ATENDIMENTO: ids[2]}}
+
+
+def test_id_gravado_nao_muda_quando_o_atendimento_e_editado_ou_linhas_somem():
+    df = agenda(('Ana', '02/02/2026', 'Limpeza'), ('Bia', '02/02/2026', 'Limpeza'))
+    ids, celulas = atribuir_ids(df, ids_atendimentos(df))
+    df = aplicar_alteracoes(df, celulas)
+    editada = aplicar_alteracoes(df, {3: {'Nome do Cliente': 'Beatriz', 'Horário do Atendimento': '11:00'}}, linhas_removidas=[2])
+    assert ids_atendimentos(editada).tolist() == [ids[3]]
+
+
+def test_baixa_antiga_e_reconhecida_pelo_id_legado_e_passa_a_ser_gravada():
+    df = agenda(('Ana', '02/02/2026', 'Limpeza'), ('Bia', '02/02/2026', 'Limpeza'))
+    legado = ids_legados(df)[2]
+    ids = ids_atendimentos(df, baixados={legado})
+    assert ids.tolist() == [legado, '']
+    completos, celulas = atribuir_ids(df, ids)
+    assert celulas[2] == {COLUNA_ID_ATENDIMENTO: legado}
+    assert completos[3] in celulas[3].values()
+
+
+def test_ids_legados_diferenciam_atendimentos_repetidos():
+    df = agenda(('Ana', '02/02/2026', 'Limpeza'), ('Ana', '02/02/2026', 'Limpeza'))
+    legados = ids_legados(df)
+    assert legados[3] == f"{legados[2]}-1"
+
+
+def test_movimentos_de_baixa_por_atendimento_e_material():
+    df = agenda(('Ana', '02/02/2026', 'Limpeza'), ('Bia', '02/02/2026', 'Avaliação'))
+    _, custo = modelo()
+    movimentos = movimentos_de_baixa(df, custo, '03/02/2026', pd.Series(['AT1', 'AT2'], index=df.index))
+    assert sorted(zip(movimentos['Atendimento'], movimentos['Material'], movimentos['Quantidade'])) == [('AT1', 'Gaze', -2.0), ('AT1', 'Luva', -1.0), ('AT2', '', 0.0)]
+    assert (movimentos['Tipo'] == TIPO_BAIXA).all()
+    assert atendimentos_baixados(movimentos) == {'AT1', 'AT2'}
+
+
+def test_estoque_atual_conta_uma_vez_a_baixa_reenviada():
+    materiais, custo = modelo()
+    df = agenda(('Ana', '02/02/2026', 'Limpeza'))
+    baixa = movimentos_de_baixa(df, custo, '03/02/2026', pd.Series(['AT1'], index=df.index))
+    reposicao = pd.DataFrame({'Data': ['04/02/2026'], 'Tipo': ['REPOSIÇÃO'], 'Material': ['Gaze'], 'Quantidade': ['5'], 'Atendimento': [''], 'Observação': ['']})
+    livro = limpar_movimentacoes(pd.concat([baixa, baixa, reposicao], ignore_index=True).astype(str))
+    estoque = estoque_atual(materiais, livro).set_index('Material')['Quantidade em Estoque']
+    assert estoque.to_dict() == {'Gaze': 13.0, 'Luva': 19.0}
+
+
+def test_agenda_tem_coluna_de_id_mesmo_sem_ela_na_planilha():
+    df = limpar_agenda(pd.DataFrame({'Data do Atendimento': ['03/02/2026'], 'Nome do Cliente': ['Ana'], 'Procedimento Realizado': ['Limpeza'],
+                                     'Profissional Responsável': ['Dra. A'], 'Horário do Atendimento': ['10:00']}, index=[2]))
+    assert df.at[2, COLUNA_ID_ATENDIMENTO] == ''
@@ -0,0 +1,50 @@
+import json
+import sqlite3
+import threading
+import pandas as pd
+import pytest
+from armazenamento import ABA_MATERIAIS, ArmazenamentoSQLite
+from metricas import ArmazenamentoInstrumentado, Metricas
+
+
+def test_etapas_da_rodada_sao_separadas_por_thread():
+    metricas = Metricas()
+    metricas.iniciar_rodada()
+    with metricas.etapa("carga"): pass
+    def outra_sessao():
+        metricas.iniciar_rodada()
+        with metricas.etapa("grafico"): pass
+    sessao = threading.Thread(target=outra_sessao)
+    sessao.start()
+    sessao.join()
+    assert [nome for nome, _ in metricas.rodada()] == ["carga"]
+    assert {nome: d['contagem'] for nome, d in metricas.resumo()['etapas'].items()} == {"carga": 1, "grafico": 1}
+
+
+def test_armazenamento_instrumentado_conta_chamadas_e_falhas(tmp_path):
+    metricas = Metricas()
+    banco = ArmazenamentoInstrumentado(ArmazenamentoSQLite(str(tmp_path / "clinica.db")), metricas)
+    banco.salvar_aba(ABA_MATERIAIS, pd.DataFrame({'Material': ['Gaze']}))
+    banco.ler_intervalos([(ABA_MATERIAIS, 0, None)])
+    with pytest.raises(sqlite3.OperationalError):
+        banco.ler_intervalos([("Aba que não existe", 0, None)])
+    chamadas = metricas.resumo()['chamadas']
+    assert chamadas['sqlite.ler_intervalos']['contagem'] == 2 and chamadas['sqlite.ler_intervalos']['erros'] == 1
+    assert chamadas['sqlite.salvar_aba']['erros'] == 0
+
+
+def test_exportar_em_json_e_no_formato_do_prometheus(tmp_path):
+    metricas = Metricas()
+    metricas.registrar_cache('derivado:cubo', True)
+    metricas.registrar_cache('derivado:cubo', False)
+    metricas.registrar_chamada('gsheets.ler_intervalos', 0.5, erro=True)
+    caminho = tmp_path / "metricas.jsonl"
+    metricas.exportar(str(caminho))
+    metricas.exportar(str(caminho))
+    linhas = caminho.read_text(encoding='utf-8').splitlines()
+    assert len(linhas) == 2 and json.loads(linhas[-1])['caches'] == {'derivado:cubo': {'acertos': 1, 'falhas': 1}}
+    metricas.exportar(str(tmp_path / "metricas.prom"))
+    texto = (tmp_path / "metricas.prom").read_text(encoding='utf-8')
+    assert 'clinflow_cache_total{cache="derivado:cubo",resultado="acerto"} 1' in texto
+    assert 'clinflow_chamada_erros_total{chamada="gsheets.ler_intervalos"} 1' in texto
+    assert not (tmp_path / "metricas.prom.tmp").exists()
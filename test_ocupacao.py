@@ -0,0 +1,34 @@
+import pandas as pd
+from dados import limpar_agenda
+from ocupacao import COLUNA_DURACAO, IndiceOcupacao
+
+
+def agenda(*linhas):
+    """Agenda limpa com (profissional, data, horário, procedimento) por atendimento."""
+    return limpar_agenda(pd.DataFrame([{'Nome do Cliente': f"Cliente {n}", 'Data do Atendimento': data, 'Horário do Atendimento': horario,
+                                        'Procedimento Realizado': procedimento, 'Profissional Responsável': profissional}
+                                       for n, (profissional, data, horario, procedimento) in enumerate(linhas)], index=range(2, 2 + len(linhas))))
+
+
+FICHA = pd.DataFrame({'Procedimento': ['Limpeza', 'Cirurgia'], 'Material': ['Gaze', 'Gaze'], COLUNA_DURACAO: [30.0, 90.0]})
+
+
+def test_sobreposicoes_so_entre_atendimentos_do_mesmo_profissional():
+    df = agenda(('Dra. A', '02/02/2026', '09:00', 'Cirurgia'), ('Dra. A', '02/02/2026', '10:00', 'Limpeza'),
+                ('Dra. A', '02/02/2026', '10:30', 'Limpeza'), ('Dr. B', '02/02/2026', '09:00', 'Limpeza'),
+                ('Dra. A', '03/02/2026', '09:00', 'Limpeza'))
+    indice = IndiceOcupacao(df, FICHA)
+    sobrepostos = indice.sobreposicoes('02/02/2026', '03/02/2026')
+    assert sorted(sobrepostos.index) == [2, 3]
+    assert indice.sobreposicoes('03/02/2026', '03/02/2026').empty
+    assert indice.sobreposicoes('02/02/2026', '02/02/2026', profissionais=['Dr. B']).empty
+
+
+def test_horarios_livres_pulam_blocos_ocupados_e_dias_sem_atendimento():
+    df = agenda(('Dra. A', '2026-02-07', '08:00', 'Cirurgia'), ('Dra. A', '2026-02-07', '09:00', 'Limpeza'))
+    indice = IndiceOcupacao(df, FICHA)
+    # 07/02/2026 é sábado: ocupado das 8h às 9h30
+    assert indice.horarios_livres('Dra. A', 60, pd.Timestamp('2026-02-07 07:10'), quantidade=2) == [pd.Timestamp('2026-02-07 09:30'), pd.Timestamp('2026-02-07 10:30')]
+    # Domingo não é dia de atendimento: depois das 18h de sábado o próximo horário é segunda às 8h
+    assert indice.horarios_livres('Dra. A', 60, pd.Timestamp('2026-02-07 18:30'), quantidade=1) == [pd.Timestamp('2026-02-09 08:00')]
+    assert indice.horarios_livres('Dr. B', 30, pd.Timestamp('2026-02-09 12:10'), quantidade=1) == [pd.Timestamp('2026-02-09 12:30')]
@@ -0,0 +1,52 @@
+import os
+import sqlite3
+import pandas as pd
+import pytest
+from armazenamento import ABA_MOVIMENTACOES, ArmazenamentoSQLite
+from relatorios import carregar_clinica, main, relatorio_mensal
+from sintetico import gerar_dados
+
+HOJE = pd.Timestamp('2026-02-03')
+
+
+@pytest.fixture
+def banco(tmp_path):
+    """Clínica sintética num SQLite sem a aba de movimentações (nunca aberta no dashboard)."""
+    caminho = str(tmp_path / "clinica.db")
+    destino = ArmazenamentoSQLite(caminho)
+    for nome_aba, df in gerar_dados(2_000, anos=1, fim=HOJE, semente=3).items():
+        if nome_aba != ABA_MOVIMENTACOES: destino.salvar_aba(nome_aba, df)
+    return caminho
+
+
+def test_relatorio_mensal_resume_o_mes(banco):
+    agenda, materiais, ficha, movimentacoes = carregar_clinica(ArmazenamentoSQLite(banco, somente_leitura=True))
+    tabelas = relatorio_mensal(agenda, materiais, ficha, movimentacoes, '2026-01')
+    janeiro = agenda[agenda['Data do Atendimento'].dt.to_period('M') == '2026-01']
+    resumo = tabelas['resumo'].iloc[0]
+    assert resumo['Atendimentos'] == len(janeiro) == tabelas['financeiro']['Qtd Realizada'].sum()
+    assert resumo['Clientes'] == janeiro['Nome do Cliente'].nunique()
+    assert resumo['Receita (R$)'] == pytest.approx(tabelas['financeiro']['Receita Total (R$)'].sum())
+    assert resumo['Lucro (R$)'] == pytest.approx(resumo['Receita (R$)'] - resumo['Custo (R$)'])
+    assert len(tabelas['estoque']) == len(materiais)
+
+
+def test_estoque_do_relatorio_ignora_movimentacoes_depois_do_mes():
+    materiais = pd.DataFrame({'Material': ['Gaze'], 'Quantidade em Estoque': [10.0], 'Estoque Mínimo': [2.0]})
+    movimentacoes = pd.DataFrame({'Data': pd.to_datetime(['2026-01-31 18:00', '2026-02-01 08:00', None]), 'Tipo': ['AJUSTE'] * 3,
+                                  'Material': ['Gaze'] * 3, 'Quantidade': [-3.0, -5.0, 1.0], 'Atendimento': [''] * 3, 'Observação': [''] * 3})
+    ficha = pd.DataFrame(columns=['Procedimento', 'Material', 'Quantidade Usada', 'Preco de Venda (R$)'])
+    agenda = pd.DataFrame({'Data do Atendimento': pd.to_datetime([]), 'Nome do Cliente': [], 'Procedimento Realizado': []})
+    estoque = relatorio_mensal(agenda, materiais, ficha, movimentacoes, '2026-01')['estoque']
+    assert estoque.loc[0, 'Quantidade em Estoque'] == 8.0
+
+
+def test_cli_so_le_a_clinica(banco, tmp_path):
+    antes = os.path.getmtime(banco)
+    assert main([f"sqlite:{banco}", "--meses", "2026-01", "--formatos", "csv", "--destino", str(tmp_path / "saida"), "--processos", "1"]) == 0
+    assert [arquivo.parent.name for arquivo in (tmp_path / "saida").rglob("resumo.csv")] == ["2026-01"]
+    assert os.path.getmtime(banco) == antes
+    with sqlite3.connect(banco) as con:
+        assert ABA_MOVIMENTACOES not in {nome for (nome,) in con.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    assert main([f"sqlite:{tmp_path / 'nao_existe.db'}", "--destino", str(tmp_path / "saida"), "--processos", "1"]) == 1
+    assert not (tmp_path / "nao_existe.db").exists()
@@ -0,0 +1,140 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from snapshot import AtualizadorSegundoPlano, RepositorioSnapshots, Snapshot, memoria_valor
+
+
+def snapshot():
+    agenda = pd.DataFrame({'Nome do Cliente': ['Ana', 'Bia']})
+    return Snapshot(1, agenda, pd.DataFrame({'Material': ['Gaze']}), pd.DataFrame({'Procedimento': ['Limpeza']}))
+
+
+class Derivado:
+    def __init__(self, tabela, n):
+        self.tabela = tabela
+        self.valores = np.zeros(n)
+
+
+def test_memoria_conta_os_derivados_sem_repetir_as_tabelas_do_snapshot():
+    atual = snapshot()
+    base = atual.memoria()
+    atual.derivado('cubo', lambda: Derivado(atual.agenda, 1000))
+    assert atual.memoria() - base == memoria_valor(Derivado(atual.agenda, 1000), {id(atual.agenda)})
+    assert 8000 <= atual.memoria() - base < 9000
+
+
+def test_derivados_antigos_sao_descartados_acima_do_limite():
+    atual = snapshot()
+    atual.memoria_maxima = atual.memoria_tabelas() + 20_000
+    for chave in ('a', 'b', 'c'):
+        atual.derivado(chave, lambda: np.zeros(1000))
+    assert list(atual._derivados) == ['b', 'c']
+    # Sozinho acima do limite, o valor recém-construído ainda é guardado
+    grande = atual.derivado('d', lambda: np.zeros(10_000))
+    assert list(atual._derivados) == ['d'] and atual.derivado('d', lambda: None) is grande
+
+
+class Carga:
+    """`carregar` do repositório que conta as chamadas e devolve a mesma agenda até `mudar()`."""
+
+    def __init__(self, espera=0.0):
+        self.chamadas = 0
+        self.completas = 0
+        self.espera = espera
+        self.mudar()
+
+    def mudar(self):
+        self.agenda = pd.DataFrame({'Nome do Cliente': ['Ana']})
+
+    def __call__(self, completo):
+        self.chamadas += 1
+        self.completas += completo
+        time.sleep(self.espera)
+        return self.agenda, pd.DataFrame({'Material': ['Gaze']}), pd.DataFrame({'Procedimento': ['Limpeza']}), None
+
+
+def test_repositorio_so_recarrega_depois_do_ttl():
+    carga = Carga()
+    repositorio = RepositorioSnapshots(carga, ttl=60)
+    assert repositorio.obter() is repositorio.obter()
+    assert carga.chamadas == 1
+    repositorio.ttl = 0
+    repositorio.obter()
+    assert carga.chamadas == 2
+
+
+def test_repositorio_mantem_a_versao_quando_nada_mudou():
+    carga = Carga()
+    repositorio = RepositorioSnapshots(carga, ttl=0)
+    primeiro = repositorio.obter()
+    assert repositorio.obter(forcar=True) is primeiro
+    carga.mudar()
+    assert repositorio.obter(forcar=True).versao == primeiro.versao + 1
+
+
+def test_sessoes_simultaneas_disparam_uma_unica_recarga():
+    carga = Carga(espera=0.2)
+    repositorio = RepositorioSnapshots(carga)
+    with ThreadPoolExecutor(8) as executor:
+        snapshots = list(executor.map(lambda _: repositorio.obter(), range(8)))
+    assert carga.chamadas == 1 and all(snapshot is snapshots[0] for snapshot in snapshots)
+
+
+def test_publicar_troca_so_as_tabelas_informadas():
+    repositorio = RepositorioSnapshots(Carga())
+    anterior = repositorio.obter()
+    agenda = pd.DataFrame({'Nome do Cliente': ['Bia']})
+    novo = repositorio.publicar(agenda=agenda)
+    assert novo.versao == anterior.versao + 1 and repositorio.atual() is novo
+    assert novo.agenda is agenda and novo.materiais is anterior.materiais and novo.ficha is anterior.ficha
+
+
+def test_derivado_e_construido_uma_vez_mesmo_com_pedidos_simultaneos():
+    atual = snapshot()
+    construcoes = []
+    liberar = threading.Event()
+    def construir():
+        construcoes.append(1)
+        liberar.wait(1)
+        return object()
+    with ThreadPoolExecutor(4) as executor:
+        pedidos = [executor.submit(atual.derivado, 'cubo', construir) for _ in range(4)]
+        time.sleep(0.05)
+        liberar.set()
+        valores = [pedido.result() for pedido in pedidos]
+    assert len(construcoes) == 1 and all(valor is valores[0] for valor in valores)
+
+
+def test_atualizador_so_recarrega_quando_a_revisao_muda():
+    carga, revisao = Carga(), ['r1']
+    repositorio = RepositorioSnapshots(carga)
+    atualizador = AtualizadorSegundoPlano(repositorio, lambda: revisao[0])
+    assert atualizador.verificar() and not atualizador.verificar()
+    assert carga.chamadas == 1
+    revisao[0] = 'r2'
+    carga.mudar()
+    anterior = repositorio.atual()
+    assert atualizador.verificar()
+    assert repositorio.atual().versao == anterior.versao + 1 and carga.completas == 0
+
+
+def test_atualizador_recarrega_tudo_quando_a_revisao_muda_sem_linhas_novas():
+    carga, revisao = Carga(), ['r1']
+    repositorio = RepositorioSnapshots(carga)
+    atualizador = AtualizadorSegundoPlano(repositorio, lambda: revisao[0])
+    atualizador.verificar()
+    revisao[0] = 'r2'  # alguém editou uma linha antiga: o caminho incremental não enxerga a mudança
+    atualizador.verificar()
+    assert carga.chamadas == 3 and carga.completas == 1
+
+
+def test_atualizador_nao_consulta_a_revisao_enquanto_ocioso():
+    consultas = []
+    atualizador = AtualizadorSegundoPlano(RepositorioSnapshots(Carga()), lambda: consultas.append(1), intervalo=0.01, ocioso=lambda: True)
+    atualizador.start()
+    time.sleep(0.1)
+    atualizador.parar()
+    atualizador.join()
+    assert not consultas